@@ -22,6 +22,18 @@ import keyoscacquire.fileio as fileio
 import keyoscacquire.config as config
 import keyoscacquire.programmes as programmes
 import keyoscacquire.visa_utils as visa_utils
+import keyoscacquire.async_oscilloscope as async_oscilloscope
+import keyoscacquire.scope_group as scope_group
+import keyoscacquire.shared_buffer as shared_buffer
+import keyoscacquire.trace_server as trace_server
+import keyoscacquire.broker as broker
+import keyoscacquire.sweep as sweep
 
 from .oscilloscope import Oscilloscope, _SUPPORTED_SERIES
+from .async_oscilloscope import AsyncOscilloscope
+from .scope_group import ScopeGroup
+from .shared_buffer import TracePublisher, TraceReader
+from .trace_server import TraceServer, TraceClient
+from .broker import ScopeBroker, BrokerClient
+from .sweep import ParameterSweep
 from .fileio import save_trace, load_trace, _SCREEN_COLORS
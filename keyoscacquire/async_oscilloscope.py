@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio interface to the oscilloscope
+
+The blocking VISA communication of :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+is run in a dedicated single thread executor per instrument, which also
+serialises the commands sent to the instrument. Saving traces to disk runs in
+a separate executor so that it overlaps with the next acquisition. This lets
+one event loop drive several instruments and a user interface concurrently.
+"""
+
+import asyncio
+import logging
+import functools
+import concurrent.futures
+
+import keyoscacquire.config as config
+import keyoscacquire.fileio as fileio
+import keyoscacquire.dataprocessing as dataprocessing
+import keyoscacquire.oscilloscope as oscilloscope
+
+_log = logging.getLogger(__name__)
+
+
+class AsyncOscilloscope:
+    """Awaitable version of :class:`~keyoscacquire.oscilloscope.Oscilloscope`.
+
+    Create it with :meth:`open`, preferably as an asynchronous context
+    manager::
+
+        async with await AsyncOscilloscope.open(address) as scope:
+            time, values, channels = await scope.get_trace(channels=[1, 3])
+            await scope.save_trace("measurement")
+
+    Parameters
+    ----------
+    scope : :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+        The connected oscilloscope, must only be used through this object
+    executor : :class:`concurrent.futures.ThreadPoolExecutor`
+        Single thread executor in which the instrument communication runs
+
+    Attributes
+    ----------
+    scope : :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+        The wrapped oscilloscope. Its attributes (e.g. ``fname``, ``ext``,
+        ``verbose_acquistion``) can be set directly, but its methods should
+        not be called outside of the executor
+    """
+
+    def __init__(self, scope, executor):
+        """See class docstring"""
+        self.scope = scope
+        self._executor = executor
+        # File I/O in its own thread, overlapping with the instrument I/O
+        self._file_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="keyoscacquire-file")
+
+    @classmethod
+    async def open(cls, address=config._visa_address, timeout=config._timeout, **kwargs):
+        """Connect to the oscilloscope without blocking the event loop.
+
+        Parameters
+        ----------
+        address : str, default :data:`~keyoscacquire.config._visa_address`
+            Visa address of instrument
+        timeout : int, default :data:`~keyoscacquire.config._timeout`
+            Milliseconds before timeout on the channel to the instrument
+        **kwargs
+            Other arguments to :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+
+        Returns
+        -------
+        :class:`AsyncOscilloscope`
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"keyoscacquire-{address}")
+        loop = asyncio.get_running_loop()
+        try:
+            scope = await loop.run_in_executor(executor, functools.partial(
+                oscilloscope.Oscilloscope, address=address, timeout=timeout, **kwargs))
+        except Exception:
+            executor.shutdown(wait=False)
+            raise
+        return cls(scope, executor)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close(set_running=exc_type is None)
+
+    async def _run(self, function, *args, **kwargs):
+        """Run ``function`` in the instrument's executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          functools.partial(function, *args, **kwargs))
+
+    async def close(self, set_running=True):
+        """Close the connection to the oscilloscope after pending file I/O
+        has finished, see :meth:`Oscilloscope.close`"""
+        await self._run(self.scope.close, set_running=set_running)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._file_executor.shutdown)
+        self._executor.shutdown(wait=False)
+
+    ## Instrument communication ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    async def write(self, command):
+        """See :meth:`Oscilloscope.write`"""
+        return await self._run(self.scope.write, command)
+
+    async def query(self, command, action=""):
+        """See :meth:`Oscilloscope.query`"""
+        return await self._run(self.scope.query, command, action=action)
+
+    async def get_full_error_queue(self, verbose=True):
+        """See :meth:`Oscilloscope.get_full_error_queue`"""
+        return await self._run(self.scope.get_full_error_queue, verbose=verbose)
+
+    async def run(self):
+        """See :meth:`Oscilloscope.run`"""
+        return await self._run(self.scope.run)
+
+    async def stop(self):
+        """See :meth:`Oscilloscope.stop`"""
+        return await self._run(self.scope.stop)
+
+    async def is_running(self):
+        """See :meth:`Oscilloscope.is_running`"""
+        return await self._run(self.scope.is_running)
+
+    async def get_property(self, name):
+        """Read a property of the oscilloscope, for example
+        ``await scope.get_property('acq_type')``
+
+        Parameters
+        ----------
+        name : str
+            Name of the property, e.g. ``'active_channels'``, ``'acq_type'``,
+            ``'num_averages'``, ``'p_mode'``, ``'num_points'``, ``'wav_format'``
+        """
+        return await self._run(getattr, self.scope, name)
+
+    async def set_property(self, name, value):
+        """Set a property of the oscilloscope, for example
+        ``await scope.set_property('acq_type', 'AVER8')``, see :meth:`get_property`"""
+        return await self._run(setattr, self.scope, name, value)
+
+    async def measure(self, measurements, **kwargs):
+        """See :meth:`Oscilloscope.measure`"""
+        return await self._run(self.scope.measure, measurements, **kwargs)
+
+    ## Acquisition ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    async def set_acquiring_options(self, **kwargs):
+        """See :meth:`Oscilloscope.set_acquiring_options`"""
+        return await self._run(self.scope.set_acquiring_options, **kwargs)
+
+    async def set_channels_for_capture(self, channels='active'):
+        """See :meth:`Oscilloscope.set_channels_for_capture`"""
+        return await self._run(self.scope.set_channels_for_capture, channels=channels)
+
+    async def save_setup(self, name):
+        """See :meth:`Oscilloscope.save_setup`"""
+        return await self._run(self.scope.save_setup, name)
+
+    async def restore_setup(self, name, force=False):
+        """See :meth:`Oscilloscope.restore_setup`"""
+        return await self._run(self.scope.restore_setup, name, force=force)
+
+    async def capture_and_read(self, set_running=True):
+        """See :meth:`Oscilloscope.capture_and_read`"""
+        return await self._run(self.scope.capture_and_read, set_running=set_running)
+
+    async def get_trace(self, channels=None, verbose_acquistion=None, set_running=True):
+        """See :meth:`Oscilloscope.get_trace`"""
+        return await self._run(self.scope.get_trace, channels=channels,
+                               verbose_acquistion=verbose_acquistion,
+                               set_running=set_running)
+
+    async def set_options_get_trace(self, **kwargs):
+        """See :meth:`Oscilloscope.set_options_get_trace`"""
+        return await self._run(self.scope.set_options_get_trace, **kwargs)
+
+    async def save_trace(self, fname=None, ext=None, additional_header_info=None,
+                         savepng=None, showplot=None, nowarn=False):
+        """Save the most recent trace, see :meth:`Oscilloscope.save_trace`.
+
+        The file header is obtained from the instrument in the instrument's
+        executor, while the plotting and file writing runs in a separate
+        thread, so that the next acquisition can proceed meanwhile.
+
+        .. note:: ``showplot`` is not recommended here as the plot window is
+          opened from a thread that is not the main thread.
+        """
+        scope = self.scope
+        fname = scope.fname if fname is None else fname
+        ext = scope.ext if ext is None else ext
+        savepng = scope.savepng if savepng is None else savepng
+        showplot = scope.showplot if showplot is None else showplot
+        # Remove extenstion if provided in the fname
+        if fname[-4:] in ['.npy', '.csv']:
+            fname, ext = fname[:-4], fname[-4:]
+
+        def snapshot():
+            """Take the data of this trace before the next acquisition
+            replaces it, in the instrument's executor so that it is not
+            mixed with a concurrently scheduled acquisition"""
+            if scope._time is None:
+                return None
+            values, channels, labels = scope._values, scope._capture_channels, None
+            if values.ndim == 3:
+                # Segments from get_segmented_traces()
+                values, channels, labels = dataprocessing._segments_as_columns(values, channels)
+            head = scope.generate_file_header(channels=channels if labels is None else labels,
+                                              additional_line=additional_header_info)
+            return scope._time, values, channels, head
+
+        trace = await self._run(snapshot)
+        if trace is None:
+            print("(!) No trace has been acquired yet, use get_trace()")
+            _log.info("(!) No trace has been acquired yet, use get_trace()")
+            return
+        time, values, channels, head = trace
+
+        def save():
+            """Check the filename, plot and save"""
+            checked_fname = fileio.check_file(fname, ext)
+            fileio.plot_trace(time, values, channels, fname=checked_fname,
+                              showplot=showplot, savepng=savepng)
+            fileio.save_trace(checked_fname, time, values, fileheader=head, ext=ext,
+                              print_filename=scope.verbose_acquistion, nowarn=nowarn)
+            return checked_fname
+
+        loop = asyncio.get_running_loop()
+        scope.fname = await loop.run_in_executor(self._file_executor, save)
+        scope.ext = ext
+        return scope.fname
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+Broker sharing one oscilloscope between several programs
+
+:class:`ScopeBroker` owns the connection to the oscilloscope and serves
+requests from :class:`BrokerClient` s over a TCP or Unix socket, so that
+several tools can use the same instrument without each opening (and
+reconfiguring) it.
+
+The requests are queued and served in batches by one thread. Within a
+batch
+
+* identical trace requests (same channels and acquisition settings) are
+  coalesced into one capture, whose trace is sent to all of them
+* the trace requests are reordered so that the settings that are already
+  applied are used first, and each following capture needs as few setting
+  changes as possible. Only the settings that differ are sent
+
+Each client has its own acquisition settings, set with
+:meth:`BrokerClient.set_options` or with the trace request, and applied by
+the broker only when needed. Settings a client has not specified are the
+defaults of the broker (:attr:`ScopeBroker.defaults`), not whatever another
+client applied last. The time each request waited in the queue is
+returned with the reply and summarised in :attr:`ScopeBroker.stats`.
+
+Example
+-------
+The broker::
+
+    with Oscilloscope() as scope:
+        ScopeBroker(scope, "localhost:5051").serve_forever()
+
+A client::
+
+    with BrokerClient("localhost:5051") as client:
+        client.set_options(acq_type='AVER8')
+        time, values, channels = client.get_trace(channels=[1, 3])
+        print(f"Waited {client.last_wait:.3f} s in the queue")
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+import numpy as np
+
+import keyoscacquire.config as config
+import keyoscacquire.trace_server as trace_server
+
+_log = logging.getLogger(__name__)
+
+#: Length of the JSON request that follows
+_REQUEST_HEADER = struct.Struct('!I')
+#: Acquisition settings that can be requested, see
+#: :meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_acquiring_options`
+_SETTINGS = ('wav_format', 'acq_type', 'num_averages', 'p_mode', 'num_points')
+#: Type of each setting, so that equal settings compare equal regardless of
+#: how they were given (e.g. ``8`` or ``'8'`` averages)
+_SETTING_TYPES = {'wav_format': str, 'acq_type': str, 'num_averages': int,
+                  'p_mode': str, 'num_points': int}
+_NO_DATA = np.empty((0, 0))
+
+
+class _Connection:
+    """A connected client: its socket and acquisition settings"""
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.settings = {}
+        self.channels = None
+        self.send_lock = threading.Lock()
+
+    def reply(self, request_id, data, metadata):
+        """Send the reply to a request"""
+        frame = trace_server.encode_frame(request_id, time.time(), data, metadata)
+        with self.send_lock:
+            for buffer in frame:
+                self.sock.sendall(buffer)
+
+
+class _Request:
+    """A request in the queue"""
+
+    def __init__(self, connection, message):
+        self.connection = connection
+        self.message = message
+        self.enqueued = time.monotonic()
+        self.wait = None
+
+
+class ScopeBroker:
+    """Serve the oscilloscope to several clients, see the module docstring.
+
+    Parameters
+    ----------
+    scope : :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+        The connected oscilloscope. Must not be used by other code while the
+        broker is running
+    address : str or tuple, default :data:`~keyoscacquire.config._broker_address`
+        ``'<host>:<port>'``, ``'unix:<path>'`` or ``(host, port)``
+    batch_window : float, default 0
+        Seconds to wait after the first request of a batch for more requests
+        to arrive, giving more opportunities to coalesce and reorder
+    defaults : dict or ``None``, default ``None``
+        Acquisition settings used for the settings a client does not
+        specify, updating the defaults :data:`~keyoscacquire.config._waveform_format`,
+        :data:`~keyoscacquire.config._acq_type`, :data:`~keyoscacquire.config._p_mode`,
+        :data:`~keyoscacquire.config._num_points` and the number of averages
+        of the oscilloscope when the broker is created
+
+    Attributes
+    ----------
+    defaults : dict
+        The default acquisition settings, see the ``defaults`` parameter
+    stats : dict
+        ``'requests'`` served, ``'captures'`` made, trace requests
+        ``'coalesced'`` into another capture, ``'reconfigurations'`` of the
+        acquisition settings, and the ``'mean_wait'`` and ``'max_wait'``
+        seconds in the queue
+    """
+
+    def __init__(self, scope, address=config._broker_address, batch_window=0., defaults=None):
+        """See class docstring"""
+        self.scope = scope
+        self.address = address
+        self.batch_window = batch_window
+        self.defaults = {'wav_format': config._waveform_format, 'acq_type': config._acq_type,
+                         'num_averages': int(scope.num_averages), 'p_mode': config._p_mode,
+                         'num_points': config._num_points}
+        if defaults is not None:
+            self.defaults.update(defaults)
+        self.stats = {'requests': 0, 'captures': 0, 'coalesced': 0,
+                      'reconfigurations': 0, 'mean_wait': 0., 'max_wait': 0.}
+        self._total_wait = 0.
+        # Settings known to be applied on the oscilloscope
+        self._applied = {}
+        self._requests = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._listener = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start listening for clients and serving requests in background threads"""
+        family, address = trace_server.parse_server_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen()
+        self._listener.settimeout(0.2)
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._accept_clients, daemon=True),
+                         threading.Thread(target=self._serve_requests, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        print(f"Brokering {self.scope._model} on {self.address}")
+
+    def serve_forever(self):
+        """Start the broker and block until interrupted with ctrl-c"""
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print("Stopping the broker")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            family, address = trace_server.parse_server_address(self.address)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.remove(address)
+
+    ## Clients ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def _accept_clients(self):
+        """Accept new clients until stopped, one thread reading the requests
+        of each client"""
+        while not self._stop.is_set():
+            try:
+                sock, address = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _log.info(f"Client connected: {address}")
+            connection = _Connection(sock, address)
+            threading.Thread(target=self._read_requests, args=(connection,), daemon=True).start()
+
+    def _read_requests(self, connection):
+        """Queue the requests of a client until it disconnects"""
+        try:
+            with connection.sock.makefile('rb') as stream:
+                while not self._stop.is_set():
+                    header = stream.read(_REQUEST_HEADER.size)
+                    if len(header) < _REQUEST_HEADER.size:
+                        break
+                    length, = _REQUEST_HEADER.unpack(header)
+                    self._requests.put(_Request(connection, json.loads(stream.read(length))))
+        except OSError as err:
+            _log.info(f"Client {connection.address} disconnected: {err}")
+        finally:
+            connection.sock.close()
+
+    ## Scheduling ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def _serve_requests(self):
+        """Serve the queued requests in batches until stopped"""
+        while not self._stop.is_set():
+            try:
+                batch = [self._requests.get(timeout=0.2)]
+            except queue.Empty:
+                continue
+            if self.batch_window:
+                time.sleep(self.batch_window)
+            while True:
+                try:
+                    batch.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            self._serve_batch(batch)
+
+    def _serve_batch(self, batch):
+        """Serve the other requests in arrival order, then the trace
+        requests grouped by identical settings in the order of fewest
+        setting changes"""
+        traces = {}
+        for request in batch:
+            if request.message.get('method') == 'get_trace':
+                traces.setdefault(self._trace_key(request), []).append(request)
+            else:
+                self._serve(request, self._serve_other, request)
+        while traces:
+            key = min(traces, key=self._num_changes)
+            requests = traces.pop(key)
+            self._serve(requests, self._capture, key, requests)
+
+    def _serve(self, requests, function, *args):
+        """Call ``function``, replying with the error to the requests if it fails"""
+        if isinstance(requests, _Request):
+            requests = [requests]
+        try:
+            function(*args)
+        except Exception as err:
+            _log.error(f"Request failed: {err}")
+            for request in requests:
+                self._reply(request, _NO_DATA, {'error': f"{type(err).__name__}: {err}"})
+
+    def _trace_key(self, request):
+        """Channels and acquisition settings of a trace request, combining
+        the settings of the request, of its client and the :attr:`defaults`"""
+        message = request.message
+        settings = dict(self.defaults)
+        settings.update(request.connection.settings)
+        settings.update({name: message[name] for name in _SETTINGS if message.get(name) is not None})
+        acq_type = str(settings['acq_type'])
+        if acq_type[:4].upper() == 'AVER':
+            # 'AVER<m>' is the same request as 'AVERage' with m averages
+            if acq_type[4:].isdigit():
+                settings['num_averages'] = int(acq_type[4:])
+            settings['acq_type'] = 'AVERage'
+        else:
+            # The number of averages only applies to the 'AVERage' mode
+            settings.pop('num_averages')
+        settings = {name: _SETTING_TYPES[name](value) for name, value in settings.items()}
+        channels = message.get('channels', request.connection.channels)
+        if isinstance(channels, list):
+            channels = tuple(channels)
+        return channels, tuple(sorted(settings.items()))
+
+    def _num_changes(self, key):
+        """Number of settings that must be changed for a trace request"""
+        return sum(self._applied.get(name) != value for name, value in key[1])
+
+    def _reply(self, request, data, metadata):
+        """Reply to a request, recording its wait time"""
+        if request.wait is None:
+            request.wait = time.monotonic() - request.enqueued
+        metadata['wait'] = request.wait
+        self.stats['requests'] += 1
+        self._total_wait += request.wait
+        self.stats['mean_wait'] = self._total_wait/self.stats['requests']
+        self.stats['max_wait'] = max(self.stats['max_wait'], request.wait)
+        try:
+            request.connection.reply(request.message.get('id', 0), data, metadata)
+        except OSError as err:
+            _log.info(f"Could not reply to {request.connection.address}: {err}")
+
+    def _capture(self, key, requests):
+        """Apply the settings that differ, capture one trace and send it to
+        all the requests"""
+        start = time.monotonic()
+        for request in requests:
+            request.wait = start - request.enqueued
+        channels, settings = key
+        changes = {name: value for name, value in settings if self._applied.get(name) != value}
+        if changes:
+            try:
+                self.scope.set_acquiring_options(**changes)
+            except Exception:
+                # Some of the settings may have been written
+                self._applied = {}
+                raise
+            self._applied.update(changes)
+            self.stats['reconfigurations'] += 1
+        self.scope.set_channels_for_capture(channels=list(channels) if isinstance(channels, tuple) else channels)
+        self.scope.capture_and_read()
+        self.scope._periodic_error_check()
+        data, metadata = trace_server.trace_payload(self.scope)
+        self.stats['captures'] += 1
+        self.stats['coalesced'] += len(requests)-1
+        for request in requests:
+            self._reply(request, data, dict(metadata, coalesced=len(requests)))
+
+    def _serve_other(self, request):
+        """Serve a request that is not a trace request"""
+        request.wait = time.monotonic() - request.enqueued
+        message = request.message
+        method = message.get('method')
+        connection = request.connection
+        metadata = {}
+        if method == 'set_options':
+            connection.settings.update({name: message[name] for name in _SETTINGS
+                                        if message.get(name) is not None})
+            if 'channels' in message:
+                connection.channels = message['channels']
+        elif method == 'query':
+            metadata['result'] = self.scope.query(message['command'])
+        elif method == 'write':
+            self.scope.write(message['command'])
+            # The command may have changed any setting
+            self._applied = {}
+        elif method == 'stats':
+            metadata['result'] = dict(self.stats)
+        else:
+            raise ValueError(f"Unknown request method '{method}'")
+        self._reply(request, _NO_DATA, metadata)
+
+
+class BrokerClient(trace_server._FrameConnection):
+    """Use an oscilloscope served by a :class:`ScopeBroker`, see the module
+    docstring.
+
+    Parameters
+    ----------
+    address : str or tuple, default :data:`~keyoscacquire.config._broker_address`
+        ``'<host>:<port>'``, ``'unix:<path>'`` or ``(host, port)``
+    timeout : float or ``None``, default ``None``
+        Seconds to wait for each reply, ``None`` waits indefinitely
+
+    Attributes
+    ----------
+    last_wait : float or ``None``
+        Seconds the most recent request waited in the queue of the broker
+    """
+
+    def __init__(self, address=config._broker_address, timeout=None):
+        """See class docstring"""
+        super().__init__(address, timeout)
+        self._request_id = 0
+        self.last_wait = None
+
+    def _request(self, method, **kwargs):
+        """Send a request and wait for the reply
+
+        Raises
+        ------
+        RuntimeError
+            If the request failed in the broker
+        """
+        self._request_id += 1
+        message = json.dumps(dict(kwargs, method=method, id=self._request_id)).encode()
+        self._sock.sendall(_REQUEST_HEADER.pack(len(message)) + message)
+        request_id, _, data, metadata = self.receive()
+        if request_id != self._request_id:
+            raise ConnectionError(f"Reply to request {request_id}, expected {self._request_id}")
+        self.last_wait = metadata.get('wait')
+        if 'error' in metadata:
+            raise RuntimeError(f"The request '{method}' failed: {metadata['error']}")
+        return data, metadata
+
+    def set_options(self, channels=None, **settings):
+        """Set the channels and acquisition settings used for the traces of
+        this client (applied by the broker when capturing)
+
+        Parameters
+        ----------
+        channels : list of ints or ``'active'``, optional
+            See :meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_channels_for_capture`
+        **settings
+            ``wav_format``, ``acq_type``, ``num_averages``, ``p_mode`` and
+            ``num_points``, see
+            :meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_acquiring_options`
+        """
+        kwargs = dict(settings)
+        if channels is not None:
+            kwargs['channels'] = channels
+        self._request('set_options', **kwargs)
+
+    def get_trace(self, channels=None, **settings):
+        """Obtain one trace, possibly coalesced with identical requests from
+        other clients
+
+        Parameters
+        ----------
+        channels : list of ints or ``'active'``, optional
+            Channels for this trace, otherwise those set with :meth:`set_options`
+        **settings
+            Acquisition settings for this trace, added to those set with
+            :meth:`set_options`
+
+        Returns
+        -------
+        time : :class:`~numpy.ndarray`
+            Time axis for the measurement
+        values : :class:`~numpy.ndarray`
+            Voltage values, each column represents one channel
+        channels : list of ints
+            The channels of the trace
+        """
+        kwargs = dict(settings)
+        if channels is not None:
+            kwargs['channels'] = channels
+        data, metadata = self._request('get_trace', **kwargs)
+        return self._to_trace(data, metadata)
+
+    def query(self, command):
+        """Query a VISA command, see :meth:`~keyoscacquire.oscilloscope.Oscilloscope.query`"""
+        return self._request('query', command=command)[1]['result']
+
+    def write(self, command):
+        """Write a VISA command, see :meth:`~keyoscacquire.oscilloscope.Oscilloscope.write`"""
+        self._request('write', command=command)
+
+    def broker_stats(self):
+        """The :attr:`ScopeBroker.stats` of the broker"""
+        return self._request('stats')[1]['result']
@@ -1,12 +1,15 @@
 # -*- coding: utf-8 -*-
 """Default options for keyoscacquire"""
 
+import os
+
 #: VISA address of instrument
 _visa_address = 'USB0::1234::1234::MY1234567::INSTR'
 #: Waveform format transferred from the oscilloscope to the computer
 #: WORD formatted data is transferred as 16-bit uint.
 #: BYTE formatted data is transferred as 8-bit uint.
 #: ASCii formatted data converts the internal integer data values to real Y-axis values. Values are transferred as ASCii digits in floating point notation, separated by commas.
+#: AUTO chooses BYTE or WORD for each capture depending on the acquisition type.
 _waveform_format = 'WORD'
 #: The acqusition type
 #: {HRESolution, NORMal, AVER<m>} where <m> is the number of averages in range [2, 65536]
@@ -30,3 +33,70 @@ _export_png = True
 _show_plot = False
 #: ms timeout for the instrument connection
 _timeout = 15000
+#: Number of ``:SYSTem:ERRor?`` queries sent in one message when draining
+#: the error queue of the oscilloscope
+_error_batch_size = 10
+#: Drain the error queue of the oscilloscope every this many traces
+#: captured with :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_trace`,
+#: :meth:`~keyoscacquire.oscilloscope.Oscilloscope.stream` or
+#: :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_segmented_traces`,
+#: zero disables the periodic check
+_check_errors_every = 0
+#: Directory for keyoscacquire's on-disk caches (e.g. VISA discovery results)
+_cache_dir = os.path.join(os.path.expanduser("~"), ".keyoscacquire")
+#: Seconds the cached VISA discovery results are valid for
+_discovery_cache_ttl = 600
+#: Maximum number of VISA resources probed concurrently when listing devices
+_discovery_workers = 8
+#: Use keyoscacquire's own socket transport rather than pyvisa for
+#: ``TCPIP::<host>::<port>::SOCKET`` addresses
+_socket_transport = False
+#: Receive buffer size in bytes requested for the socket transport
+_socket_buffer_size = 8*1024**2
+#: Chunk sizes in bytes tested by
+#: :meth:`~keyoscacquire.oscilloscope.Oscilloscope.characterize_link`
+_chunk_sizes = [20*1024, 100*1024, 1024**2, 4*1024**2]
+#: Once the link is characterised, set the timeout of each waveform transfer
+#: from the expected transfer time (never lower than the timeout set by the user)
+_auto_timeout = True
+#: Factor applied to the expected transfer time when setting the timeout automatically
+_timeout_margin = 3
+#: How :meth:`~keyoscacquire.oscilloscope.Oscilloscope.capture_and_read` waits
+#: for an acquisition to complete: ``'digitize'`` blocks the next query until
+#: the acquisition is complete, ``'poll'`` polls the run status after a
+#: ``:SINGle`` and ``'srq'`` polls the status byte for the service request
+#: generated by ``*OPC``
+#: {digitize, poll, srq}
+_completion_mode = 'digitize'
+#: Seconds between each check of the acquisition status in the ``'poll'``
+#: and ``'srq'`` completion modes
+_poll_interval = 0.01
+#: Seconds to wait for an acquisition to complete in the ``'poll'`` and
+#: ``'srq'`` completion modes, ``None`` waits indefinitely
+_acquisition_timeout = None
+#: Keep the most recently read waveform of each source in memory while the
+#: oscilloscope is stopped, so that repeated reads do not transfer it again
+_read_cache = True
+#: Points per chunk for chunked transfers of large records when the link has
+#: not been characterised
+_chunk_points = 1000000
+#: Target seconds per chunk for chunked transfers when the link has been characterised
+_chunk_duration = 1.0
+#: Number of times a failed chunk (or source) is retried in chunked transfers
+_chunk_retries = 3
+#: Maximum number of ``:MEASure`` queries sent in one compound query
+_measurements_per_query = 20
+#: Save digital pods run-length encoded (efficient for slowly changing lines)
+_digital_rle = False
+#: Name of the shared memory block of :mod:`keyoscacquire.shared_buffer`
+_shared_memory_name = "keyoscacquire_traces"
+#: Number of traces in the shared memory ring buffer
+_shared_slots = 8
+#: Bytes reserved for the preambles in each slot of the shared memory ring buffer
+_shared_preamble_size = 1024
+#: Address of :class:`~keyoscacquire.trace_server.TraceServer`, ``'<host>:<port>'`` or ``'unix:<path>'``
+_server_address = "localhost:5050"
+#: Number of traces queued for each client of the trace server before the oldest are dropped
+_server_queue = 8
+#: Address of :class:`~keyoscacquire.broker.ScopeBroker`, ``'<host>:<port>'`` or ``'unix:<path>'``
+_broker_address = "localhost:5051"
@@ -12,6 +12,7 @@ post-process data separately from capturing it.
 
 """
 
+import abc
 import logging
 import numpy as np
 
@@ -147,3 +148,1082 @@ def _process_data_ascii(raw, metadata, verbose_acquistion=True):
         y.append(data) # add ascii data for this channel to y array
     y = np.transpose(np.array(y))
     return time, y
+
+
+def process_segmented_data(raw, preambles):
+    """Process raw 8/16-bit data from a segmented acquisition to time
+    values and voltage values, as received from
+    :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_segmented_traces`.
+
+    All segments share the preamble of their channel, so the scaling is
+    done in one vectorised operation.
+
+    Parameters
+    ----------
+    raw : ~numpy.ndarray
+        Array of ints with shape ``(segments, channels, points)``
+    preambles : list of str
+        The preamble of each channel (list of comma separated ascii values,
+        see :ref:`preamble`)
+
+    Returns
+    -------
+    time : :class:`~numpy.ndarray`
+        Time axis relative to the trigger of each segment, one column
+    y : :class:`~numpy.ndarray`
+        Voltage values with shape ``(segments, points, channels)``
+    """
+    time, (yIncr, yOrig, yRef) = _scaling_from_preambles(preambles, raw.shape[2])
+    y = (raw-yRef)*yIncr + yOrig
+    return time, y.transpose(0, 2, 1)
+
+
+def _segments_as_columns(y, channels):
+    """Lay the segments of ``y`` with shape ``(segments, points, channels)``
+    (see :func:`process_segmented_data`) side by side as columns for saving
+    and plotting.
+
+    Returns
+    -------
+    y : :class:`~numpy.ndarray`
+        Voltage values with shape ``(points, segments*channels)``
+    channels : list
+        The channel of each column
+    labels : list of str
+        Column labels ``<channel>_seg<segment>``, segments counted from 1
+    """
+    num_segments = y.shape[0]
+    labels = [f"{ch}_seg{seg+1}" for seg in range(num_segments) for ch in channels]
+    return np.concatenate(y, axis=1), list(channels)*num_segments, labels
+
+
+def _scaling_from_preambles(preambles, num_samples):
+    """Time axis and voltage scaling factors from the preambles of the
+    channels, for vectorised processing of raw data with shape
+    ``(..., channels, points)``
+
+    Returns
+    -------
+    time : :class:`~numpy.ndarray`
+        Time axis, one column
+    scaling : tuple of :class:`~numpy.ndarray`
+        ``(yIncr, yOrig, yRef)``, each with shape ``(channels, 1)`` to
+        broadcast over the points
+    """
+    preambles = [preamble.split(',') for preamble in preambles]
+    xIncr, xOrig, xRef = (float(preambles[0][i]) for i in (4, 5, 6))
+    time = ((np.arange(num_samples)-xRef)*xIncr + xOrig)[:, np.newaxis]
+    scaling = tuple(np.array([[float(preamble[i])] for preamble in preambles])
+                    for i in (7, 8, 9))
+    return time, scaling
+
+
+## Statistics across traces ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+class TraceStatistics:
+    """Running statistics of traces, updated in place for each new trace in
+    constant memory: mean and variance (Welford's algorithm) and min/max
+    envelopes of each point of each channel.
+
+    Example
+    -------
+    ::
+
+        stats = TraceStatistics(outlier_sigma=3)
+        for i in range(1000):
+            time, values, channels = scope.get_trace()
+            stats.update(values)
+        time, summary = stats.summary()
+
+    Parameters
+    ----------
+    outlier_sigma : float or ``None``, default ``None``
+        If not ``None``: reject a trace if the root mean square of its
+        deviation from the running mean, in units of the running standard
+        deviation of each point, exceeds ``outlier_sigma`` (around one for
+        traces from the same distribution)
+    min_count : int, default 10
+        Number of traces accumulated before outliers are rejected
+
+    Attributes
+    ----------
+    count : int
+        Number of traces accumulated
+    rejected : int
+        Number of traces rejected as outliers
+    time : :class:`~numpy.ndarray` or ``None``
+        Time axis of the first trace, if given to :meth:`update`
+    """
+
+    def __init__(self, outlier_sigma=None, min_count=10):
+        """See class docstring"""
+        self.outlier_sigma = outlier_sigma
+        self.min_count = max(2, min_count)
+        self.count = 0
+        self.rejected = 0
+        self.time = None
+        self._mean = None
+
+    def update(self, values, time=None):
+        """Add a trace to the statistics
+
+        Parameters
+        ----------
+        values : ~numpy.ndarray
+            Voltage values, each column represents one channel (as returned
+            by :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_trace`)
+        time : ~numpy.ndarray or ``None``
+            Time axis, stored from the first trace
+
+        Returns
+        -------
+        bool
+            ``False`` if the trace was rejected as an outlier, ``True`` otherwise
+
+        Raises
+        ------
+        ValueError
+            If the shape of ``values`` differs from the first trace
+        """
+        values = np.asarray(values, dtype=float)
+        if self._mean is None:
+            self._mean = values.copy()
+            self._m2 = np.zeros_like(values)
+            self._min = values.copy()
+            self._max = values.copy()
+            # Work buffers reused for every trace
+            self._delta = np.empty_like(values)
+            self._work = np.empty_like(values)
+            self.time = time
+            self.count = 1
+            return True
+        if values.shape != self._mean.shape:
+            raise ValueError(f"Trace with shape {values.shape} does not match "
+                             f"the accumulated shape {self._mean.shape}")
+        delta = np.subtract(values, self._mean, out=self._delta)
+        if self.outlier_sigma is not None and self.count >= self.min_count:
+            # Squared deviation in units of the variance of each point
+            z2 = np.square(delta, out=self._work)
+            z2 *= self.count-1
+            np.divide(z2, self._m2, out=z2, where=self._m2 > 0)
+            z2[self._m2 == 0] = 0
+            if np.sqrt(z2.mean()) > self.outlier_sigma:
+                self.rejected += 1
+                return False
+        self.count += 1
+        # Welford: mean += delta/n, M2 += delta*(x - new mean)
+        self._mean += np.divide(delta, self.count, out=self._work)
+        delta *= np.subtract(values, self._mean, out=self._work)
+        self._m2 += delta
+        np.minimum(self._min, values, out=self._min)
+        np.maximum(self._max, values, out=self._max)
+        return True
+
+    @property
+    def mean(self):
+        """Mean of the accumulated traces"""
+        return self._mean
+
+    @property
+    def variance(self):
+        """Sample variance of the accumulated traces (zero for one trace)"""
+        if self._mean is None:
+            return None
+        return self._m2/(self.count-1) if self.count > 1 else np.zeros_like(self._m2)
+
+    @property
+    def std(self):
+        """Sample standard deviation of the accumulated traces"""
+        variance = self.variance
+        return None if variance is None else np.sqrt(variance)
+
+    @property
+    def min(self):
+        """Minimum envelope of the accumulated traces"""
+        return self._min
+
+    @property
+    def max(self):
+        """Maximum envelope of the accumulated traces"""
+        return self._max
+
+    def summary(self):
+        """The statistics as one array with the columns mean, standard
+        deviation, minimum and maximum of each channel
+
+        Returns
+        -------
+        time : :class:`~numpy.ndarray` or ``None``
+            Time axis of the first trace
+        summary : :class:`~numpy.ndarray`
+            Columns ``mean <ch>..., std <ch>..., min <ch>..., max <ch>...``
+        """
+        return self.time, np.hstack([self.mean, self.std, self.min, self.max])
+
+    @staticmethod
+    def summary_column_names(channels):
+        """Column names of :meth:`summary` for the ``channels``, e.g.
+        ``['mean 1', 'mean 3', 'std 1', ...]``"""
+        return [f"{stat} {ch}" for stat in ['mean', 'std', 'min', 'max'] for ch in channels]
+
+
+## Persistence histograms ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+class PersistenceHistogram:
+    """Two-dimensional time-voltage histogram of many traces, emulating the
+    persistence display of the oscilloscope. Optionally folded on a clock
+    period to give an eye diagram.
+
+    The time bin of each point is computed once for a given time axis, so
+    that each new trace only needs its voltage bins computed before all
+    points of all channels are counted in one :func:`numpy.bincount`.
+
+    Example
+    -------
+    ::
+
+        hist = PersistenceHistogram(voltage_range=(-1, 1), period=1e-9)
+        for i in range(1000):
+            time, values, channels = scope.get_trace()
+            hist.update(time, values)
+        fileio.plot_histogram(hist, channels, fname="eye", savepng=True)
+
+    Parameters
+    ----------
+    voltage_range : tuple of floats
+        ``(min, max)`` voltage of the histogram, points outside are not counted
+    voltage_bins : int, default 256
+        Number of voltage bins
+    time_bins : int, default 1000
+        Number of time bins
+    time_range : tuple of floats or ``None``, default ``None``
+        ``(min, max)`` time of the histogram. ``None`` uses ``(0, period)``
+        when folding, and the time axis of the first trace otherwise
+    period : float or ``None``, default ``None``
+        Fold the time axis on this period (e.g. the clock period for an eye
+        diagram) if not ``None``
+    phase : float, default 0
+        Time offset subtracted before folding
+
+    Attributes
+    ----------
+    counts : :class:`~numpy.ndarray` or ``None``
+        Counts with shape ``(channels, time_bins, voltage_bins)``
+    num_traces : int
+        Number of traces accumulated
+    """
+
+    def __init__(self, voltage_range, voltage_bins=256, time_bins=1000,
+                 time_range=None, period=None, phase=0.):
+        """See class docstring"""
+        self.voltage_range = tuple(float(v) for v in voltage_range)
+        self.voltage_bins = int(voltage_bins)
+        self.time_bins = int(time_bins)
+        self.period = period
+        self.phase = phase
+        if time_range is None and period is not None:
+            time_range = (0., float(period))
+        self.time_range = None if time_range is None else tuple(float(t) for t in time_range)
+        self.counts = None
+        self.num_traces = 0
+        self._time_key = None
+
+    @property
+    def time_edges(self):
+        """Edges of the time bins"""
+        return np.linspace(*self.time_range, self.time_bins+1)
+
+    @property
+    def voltage_edges(self):
+        """Edges of the voltage bins"""
+        return np.linspace(*self.voltage_range, self.voltage_bins+1)
+
+    def _prepare(self, time, num_channels):
+        """Compute the flat histogram index offset of each point from the time
+        axis, only when the time axis or number of channels changes"""
+        time = np.ravel(time)
+        key = (time.size, time[0], time[-1], num_channels)
+        if key == self._time_key:
+            return
+        if self.counts is not None and num_channels != self.counts.shape[0]:
+            raise ValueError(f"Trace with {num_channels} channels does not match "
+                             f"the accumulated {self.counts.shape[0]} channels")
+        if self.period is not None:
+            time = np.mod(time-self.phase, self.period)
+        if self.time_range is None:
+            self.time_range = (float(time.min()), float(time.max()))
+        tmin, tmax = self.time_range
+        t_idx = np.floor((time-tmin)*(self.time_bins/(tmax-tmin))).astype(np.intp)
+        # Include the end point of the range in the last bin
+        t_idx[time == tmax] = self.time_bins-1
+        self._time_valid = (t_idx >= 0) & (t_idx < self.time_bins)
+        channel_offsets = np.arange(num_channels)*(self.time_bins*self.voltage_bins)
+        self._offsets = channel_offsets[:, np.newaxis] + (t_idx*self.voltage_bins)[np.newaxis, :]
+        # Work buffers reused for every trace
+        self._vbins = np.empty((num_channels, time.size))
+        self._index = np.empty((num_channels, time.size), dtype=np.intp)
+        if self.counts is None:
+            self.counts = np.zeros((num_channels, self.time_bins, self.voltage_bins), dtype=np.int64)
+        self._time_key = key
+
+    def _accumulate(self):
+        """Count the points with voltage bins (in units of bins) in ``self._vbins``"""
+        vbins = np.floor(self._vbins, out=self._vbins)
+        valid = (vbins >= 0) & (vbins < self.voltage_bins) & self._time_valid
+        np.copyto(self._index, vbins, casting='unsafe')
+        self._index += self._offsets
+        flat = self.counts.reshape(-1)
+        flat += np.bincount(self._index[valid], minlength=flat.size)
+        self.num_traces += 1
+
+    def update(self, time, values):
+        """Add a trace of voltage values to the histogram
+
+        Parameters
+        ----------
+        time : ~numpy.ndarray
+            Time axis for the measurement
+        values : ~numpy.ndarray
+            Voltage values, each column represents one channel (as returned
+            by :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_trace`)
+        """
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        self._prepare(time, values.shape[1])
+        vmin, vmax = self.voltage_range
+        np.subtract(values.T, vmin, out=self._vbins)
+        self._vbins *= self.voltage_bins/(vmax-vmin)
+        self._accumulate()
+
+    def update_raw(self, raw, preambles):
+        """Add a trace of raw 8/16-bit data to the histogram, scaling straight
+        to voltage bins without computing the voltage values
+
+        Parameters
+        ----------
+        raw : ~numpy.ndarray
+            Raw data with one row per channel, as from
+            :meth:`~keyoscacquire.oscilloscope.Oscilloscope.capture_and_read`
+            with ``'BYTE'`` or ``'WORD'`` waveform format
+        preambles : list of str
+            The preamble of each channel (list of comma separated ascii
+            values, see :ref:`preamble`)
+        """
+        raw = np.asarray(raw)
+        time, (yIncr, yOrig, yRef) = _scaling_from_preambles(preambles, raw.shape[1])
+        self._prepare(time, raw.shape[0])
+        vmin, vmax = self.voltage_range
+        scale = self.voltage_bins/(vmax-vmin)
+        # bin = ((raw-yRef)*yIncr + yOrig - vmin)*scale
+        np.multiply(raw, yIncr*scale, out=self._vbins)
+        self._vbins += (yOrig - yRef*yIncr - vmin)*scale
+        self._accumulate()
+
+
+## Waveform measurements ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+#: Names of the measurements made by :func:`measure_traces`
+MEASUREMENTS = ('vmax', 'vmin', 'vpp', 'vtop', 'vbase', 'amplitude', 'vrms',
+                'frequency', 'period', 'duty_cycle', 'rise_time', 'fall_time',
+                'overshoot')
+
+_TOP_BASE_BINS = 256
+
+
+def measure_traces(time, values, channels=None, levels=(10, 50, 90), return_as_df=False):
+    """Waveform measurements of every channel of a batch of traces, computed
+    in one vectorised pass over all traces and channels.
+
+    The top and base voltages are the most common voltages in the upper and
+    lower half of the voltage range, like on the oscilloscope. Threshold
+    crossings are interpolated linearly between the points. Measurements
+    that are not defined for a trace (e.g. the period of a trace with less
+    than two rising edges) are ``nan``.
+
+    ============== ================================================================
+    ``vmax``       Maximum voltage
+    ``vmin``       Minimum voltage
+    ``vpp``        Peak-to-peak voltage
+    ``vtop``       Top voltage
+    ``vbase``      Base voltage
+    ``amplitude``  ``vtop-vbase``
+    ``vrms``       Root mean square voltage
+    ``frequency``  Inverse of the period
+    ``period``     Mean time between the rising edges at the middle threshold
+    ``duty_cycle`` Percentage of the time above the middle threshold over whole periods
+    ``rise_time``  Time from the lower to the upper threshold of the first rising edge
+    ``fall_time``  Time from the upper to the lower threshold of the first falling edge
+    ``overshoot``  ``(vmax-vtop)/amplitude`` in percent
+    ============== ================================================================
+
+    Parameters
+    ----------
+    time : ~numpy.ndarray
+        Time axis common to all the traces
+    values : ~numpy.ndarray
+        Voltage values with shape ``(traces, points, channels)`` (e.g. from
+        :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_segmented_traces`),
+        or ``(points, channels)`` for one trace (e.g. from
+        :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_trace`)
+    channels : list of ints or ``None``, default ``None``
+        Channel names used in the dataframe, defaults to ``0, 1, ...``
+    levels : tuple of floats, default ``(10, 50, 90)``
+        Lower, middle and upper thresholds in percent of the amplitude
+    return_as_df : bool, default ``False``
+        Return a Pandas dataframe with one row per trace and channel instead
+        of a structured array
+
+    Returns
+    -------
+    measurements : :class:`~numpy.ndarray` or :class:`~pandas.DataFrame`
+        Structured array with shape ``(traces, channels)`` and the fields in
+        :data:`MEASUREMENTS`, or a dataframe with the columns ``trace``,
+        ``channel`` and the measurements
+    """
+    time = np.ravel(time)
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 2:
+        values = values[np.newaxis]
+    num_traces, num_points, num_channels = values.shape
+    # One row per waveform
+    y = np.ascontiguousarray(values.transpose(0, 2, 1)).reshape(-1, num_points)
+    num_rows = y.shape[0]
+    result = np.full(num_rows, np.nan, dtype=[(name, float) for name in MEASUREMENTS])
+    vmax, vmin = y.max(axis=1), y.min(axis=1)
+    vtop, vbase = _top_and_base(y, vmin, vmax)
+    amplitude = vtop - vbase
+    result['vmax'], result['vmin'], result['vpp'] = vmax, vmin, vmax-vmin
+    result['vtop'], result['vbase'], result['amplitude'] = vtop, vbase, amplitude
+    result['vrms'] = np.sqrt(np.einsum('ij,ij->i', y, y)/num_points)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['overshoot'] = np.where(amplitude > 0, (vmax-vtop)/amplitude*100, np.nan)
+    low, mid, high = (vbase + amplitude*level/100 for level in levels)
+    above_mid = y >= mid[:, np.newaxis]
+    rows = np.arange(num_rows)
+    # Period, frequency and duty cycle from the rising edges at the middle threshold
+    rising, rising_t = _crossings(y, time, mid, above=above_mid)
+    first, last = (np.searchsorted(rising, (rows+i)*num_points) for i in (0, 1))
+    last -= 1
+    num_edges = last - first + 1
+    periodic = num_edges >= 2
+    first_idx, last_idx = rising[first[periodic]] % num_points, rising[last[periodic]] % num_points
+    period = (rising_t[last[periodic]]-rising_t[first[periodic]])/(num_edges[periodic]-1)
+    result['period'][periodic] = period
+    result['frequency'][periodic] = 1/period
+    # Number of points above the middle threshold between the first and last edge
+    cumulative_above = np.cumsum(above_mid, axis=1, dtype=np.int64)
+    num_above = (cumulative_above[periodic, last_idx]-cumulative_above[periodic, first_idx])
+    result['duty_cycle'][periodic] = num_above/(last_idx-first_idx)*100
+    # Rise and fall times around the first middle crossing of each direction
+    falling, _ = _crossings(y, time, mid, above=above_mid, rising=False)
+    for name, mid_crossings, start_level, end_level, is_rising in [
+            ('rise_time', rising, low, high, True),
+            ('fall_time', falling, high, low, False)]:
+        result[name] = _transition_times(y, time, mid_crossings, start_level,
+                                         end_level, is_rising)
+    result = result.reshape(num_traces, num_channels)
+    if not return_as_df:
+        return result
+    import pandas as pd
+    channels = list(range(num_channels)) if channels is None else channels
+    df = pd.DataFrame(result.reshape(-1))
+    df.insert(0, 'channel', np.tile(channels, num_traces))
+    df.insert(0, 'trace', np.repeat(np.arange(num_traces), num_channels))
+    return df
+
+
+def _top_and_base(y, vmin, vmax):
+    """Most common voltage in the upper and lower half of the range of each
+    row, from one histogram of all rows"""
+    bins = _TOP_BASE_BINS
+    span = vmax - vmin
+    scale = np.divide(bins-1, span, out=np.zeros_like(span), where=span > 0)
+    index = ((y - vmin[:, np.newaxis])*scale[:, np.newaxis]).astype(np.intp)
+    index += (np.arange(y.shape[0])*bins)[:, np.newaxis]
+    counts = np.bincount(index.ravel(), minlength=y.shape[0]*bins).reshape(-1, bins)
+    base_bin = np.argmax(counts[:, :bins//2], axis=1)
+    top_bin = np.argmax(counts[:, bins//2:], axis=1) + bins//2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bin_width = np.where(span > 0, span/(bins-1), 0)
+    vbase = np.minimum(vmin + (base_bin+0.5)*bin_width, vmax)
+    vtop = np.minimum(vmin + (top_bin+0.5)*bin_width, vmax)
+    return vtop, vbase
+
+
+def _crossings(y, time, level, above=None, rising=True):
+    """Crossings of ``level`` (one per row) in each row of ``y``
+
+    Returns
+    -------
+    flat_index : :class:`~numpy.ndarray`
+        ``row*points + i`` where the crossing is between point ``i`` and
+        ``i+1``, sorted
+    times : :class:`~numpy.ndarray`
+        Linearly interpolated time of each crossing
+    """
+    if above is None:
+        above = y >= level[:, np.newaxis]
+    if rising:
+        edges = ~above[:, :-1] & above[:, 1:]
+    else:
+        edges = above[:, :-1] & ~above[:, 1:]
+    row, i = np.nonzero(edges)
+    y0, y1 = y[row, i], y[row, i+1]
+    fraction = (level[row]-y0)/(y1-y0)
+    times = time[i] + fraction*(time[i+1]-time[i])
+    return row*y.shape[1] + i, times
+
+
+def _transition_times(y, time, mid_crossings, start_level, end_level, rising):
+    """Time from the last ``start_level`` crossing before to the first
+    ``end_level`` crossing after a middle crossing, for the first middle
+    crossing of each row with a complete transition inside the record"""
+    num_rows, num_points = y.shape
+    result = np.full(num_rows, np.nan)
+    start, start_t = _crossings(y, time, start_level, rising=rising)
+    end, end_t = _crossings(y, time, end_level, rising=rising)
+    if start.size == 0 or end.size == 0:
+        return result
+    start_pos = np.searchsorted(start, mid_crossings, side='right') - 1
+    end_pos = np.searchsorted(end, mid_crossings, side='left')
+    valid = (start_pos >= 0) & (end_pos < end.size)
+    start_pos, end_pos = np.clip(start_pos, 0, None), np.clip(end_pos, None, end.size-1)
+    row = mid_crossings // num_points
+    valid &= (start[start_pos] // num_points == row) & (end[end_pos] // num_points == row)
+    # The crossings are sorted by row, so unique gives the first in each row
+    rows, first = np.unique(row[valid], return_index=True)
+    transitions = (end_t[end_pos] - start_t[start_pos])[valid]
+    result[rows] = transitions[first]
+    return result
+
+
+## Spectral analysis ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+#: Window functions for :class:`WelchSpectrum`
+_WINDOWS = {'hann': np.hanning, 'hamming': np.hamming, 'blackman': np.blackman,
+            'rect': np.ones}
+
+
+class WelchSpectrum:
+    """Power spectral density of every channel averaged over the overlapping
+    segments of a stream of traces (Welch's method).
+
+    The window, its normalisation and the frequency axis are computed once
+    for a given record length and sample interval, and the windowed real FFT
+    of all segments of all channels of a trace is made in one call.
+
+    Example
+    -------
+    ::
+
+        spectrum = WelchSpectrum(segment_length=2**14)
+        for time, values in scope.stream(n=100, channels=[1, 3]):
+            spectrum.update(time, values)
+        fileio.save_trace("psd", spectrum.frequency[:, np.newaxis], spectrum.psd_db)
+
+    Parameters
+    ----------
+    segment_length : int or ``None``, default ``None``
+        Number of points in each segment, ``None`` uses the whole trace
+    overlap : float, default 0.5
+        Fraction of overlap between consecutive segments in a trace
+    window : ``{'hann', 'hamming', 'blackman', 'rect'}`` or ~numpy.ndarray, default ``'hann'``
+        Window function, or the window values (same length as the segments)
+    detrend : bool, default ``True``
+        If ``True``: subtract the mean of each segment before the FFT
+
+    Attributes
+    ----------
+    num_traces : int
+        Number of traces accumulated
+    num_segments : int
+        Number of segments accumulated (for all traces)
+    """
+
+    def __init__(self, segment_length=None, overlap=0.5, window='hann', detrend=True):
+        """See class docstring"""
+        if not 0 <= overlap < 1:
+            raise ValueError(f"The overlap must be in [0, 1), not {overlap}")
+        self.segment_length = segment_length
+        self.overlap = overlap
+        self.window = window
+        self.detrend = detrend
+        self.num_traces = 0
+        self.num_segments = 0
+        self._sum = None
+        self._key = None
+
+    def _prepare(self, num_points, num_channels, xIncr):
+        """Compute the window, scaling and frequency axis when the record
+        length, number of channels or sample interval changes"""
+        key = (num_points, num_channels, xIncr)
+        if key == self._key:
+            return
+        if self._sum is not None:
+            raise ValueError(f"Trace with {num_points} points, {num_channels} channels and "
+                             f"sample interval {xIncr} does not match the accumulated "
+                             f"{self._key}")
+        nperseg = min(num_points, self.segment_length or num_points)
+        if isinstance(self.window, str):
+            # Periodic version of the symmetric numpy windows
+            window = _WINDOWS[self.window](nperseg+1)[:-1]
+        else:
+            window = np.asarray(self.window, dtype=float)
+            if window.size != nperseg:
+                raise ValueError(f"The window has {window.size} points, the segments {nperseg}")
+        self._window = window
+        self._step = max(1, nperseg - int(nperseg*self.overlap))
+        self._nperseg = nperseg
+        self._frequency = np.fft.rfftfreq(nperseg, d=xIncr)
+        # One-sided PSD in V^2/Hz: 2|X|^2/(fs*sum(w^2)), except at DC and Nyquist
+        scale = np.full(self._frequency.size, 2*xIncr/np.sum(window**2))
+        scale[0] /= 2
+        if nperseg % 2 == 0:
+            scale[-1] /= 2
+        self._scale = scale[:, np.newaxis]
+        self._sum = np.zeros((self._frequency.size, num_channels))
+        self._key = key
+
+    def _accumulate(self, y):
+        """Add the power of all segments of ``y``, shape ``(channels, points)``"""
+        segments = np.lib.stride_tricks.sliding_window_view(y, self._nperseg, axis=-1)[:, ::self._step]
+        if self.detrend:
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+        spectra = np.fft.rfft(segments*self._window, axis=-1)
+        power = spectra.real**2 + spectra.imag**2
+        self._sum += power.sum(axis=1).T
+        self.num_segments += segments.shape[1]
+        self.num_traces += 1
+
+    def update(self, time, values, xIncr=None):
+        """Add a trace to the spectrum
+
+        Parameters
+        ----------
+        time : ~numpy.ndarray
+            Time axis for the measurement, gives the sample interval if
+            ``xIncr`` is not given
+        values : ~numpy.ndarray
+            Voltage values, each column represents one channel (as returned
+            by :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_trace`)
+        xIncr : float or ``None``, default ``None``
+            Sample interval in seconds, e.g. the x increment of the preamble
+            (see :ref:`preamble`). ``None`` uses the mean interval of ``time``
+
+        Raises
+        ------
+        ValueError
+            If ``xIncr`` is not given for a trace with fewer than two points
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        if xIncr is None:
+            time = np.ravel(time)
+            if time.size < 2:
+                raise ValueError("The sample interval xIncr is required for traces "
+                                 "with fewer than two points")
+            xIncr = float(time[-1]-time[0])/(time.size-1)
+        self._prepare(values.shape[0], values.shape[1], float(xIncr))
+        self._accumulate(values.T)
+
+    def update_raw(self, raw, preambles):
+        """Add a trace of raw 8/16-bit data to the spectrum, with the sample
+        interval ``xIncr`` and voltage scaling from the preambles
+
+        Parameters
+        ----------
+        raw : ~numpy.ndarray
+            Raw data with one row per channel, as from
+            :meth:`~keyoscacquire.oscilloscope.Oscilloscope.capture_and_read`
+            with ``'BYTE'`` or ``'WORD'`` waveform format
+        preambles : list of str
+            The preamble of each channel (list of comma separated ascii
+            values, see :ref:`preamble`)
+        """
+        raw = np.asarray(raw)
+        _, (yIncr, yOrig, yRef) = _scaling_from_preambles(preambles, 0)
+        xIncr = float(preambles[0].split(',')[4])
+        self._prepare(raw.shape[1], raw.shape[0], xIncr)
+        self._accumulate((raw-yRef)*yIncr + yOrig)
+
+    @property
+    def frequency(self):
+        """Frequency axis in Hz"""
+        return None if self._sum is None else self._frequency
+
+    @property
+    def psd(self):
+        """Power spectral density in V²/Hz, each column represents one channel"""
+        if self._sum is None:
+            return None
+        return self._sum*self._scale/self.num_segments
+
+    @property
+    def psd_db(self):
+        """Power spectral density in dBV/√Hz (``10*log10`` of :attr:`psd`),
+        each column represents one channel"""
+        psd = self.psd
+        if psd is None:
+            return None
+        with np.errstate(divide='ignore'):
+            return 10*np.log10(psd)
+
+
+## Digital channels ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def digital_line_names(pods):
+    """Names of the digital lines of the pods, e.g. ``['D0', ..., 'D7']``
+    for ``['POD1']`` and ``['D8', ..., 'D15']`` for ``['POD2']``"""
+    return [f"D{8*(int(pod[-1])-1)+bit}" for pod in pods for bit in range(8)]
+
+
+def unpack_digital(packed):
+    """Unpack digital pod data with one bit per line to one column per line.
+
+    Parameters
+    ----------
+    packed : ~numpy.ndarray
+        ``uint8`` data with shape ``(points, pods)``, as from
+        :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_digital`
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        ``uint8`` zeros and ones with shape ``(points, 8*pods)``, the least
+        significant bit of each pod first, in the order of
+        :func:`digital_line_names`
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    if packed.ndim == 1:
+        packed = packed[:, np.newaxis]
+    return np.unpackbits(packed, axis=1, bitorder='little')
+
+
+def run_length_encode(packed):
+    """Run-length encode digital pod data: only the points where any of the
+    lines change are kept.
+
+    Parameters
+    ----------
+    packed : ~numpy.ndarray
+        Data with shape ``(points, pods)``
+
+    Returns
+    -------
+    starts : :class:`~numpy.ndarray`
+        Index of the first point of each run
+    values : :class:`~numpy.ndarray`
+        Value of the pods in each run, shape ``(runs, pods)``
+    """
+    packed = np.asarray(packed)
+    if packed.ndim == 1:
+        packed = packed[:, np.newaxis]
+    changes = np.flatnonzero(np.any(packed[1:] != packed[:-1], axis=1)) + 1
+    starts = np.concatenate(([0], changes))
+    return starts, packed[starts]
+
+
+def run_length_decode(starts, values, num_points):
+    """Inverse of :func:`run_length_encode`
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        Data with shape ``(num_points, pods)``
+    """
+    lengths = np.diff(np.append(starts, num_points))
+    return np.repeat(values, lengths, axis=0)
+
+
+## Event filtering ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def _identity(level):
+    """Voltage levels unchanged, for predicates evaluated on voltages"""
+    return level
+
+
+class EventPredicate(abc.ABC):
+    """Base class of the predicates of :class:`TraceFilter`, finding the
+    first event in one channel of a trace.
+
+    Custom predicates implement :meth:`first_event`, converting any voltage
+    levels with ``to_y`` so that they also work on raw integer data.
+
+    Parameters
+    ----------
+    channel : int or str
+        The channel the predicate is evaluated on, sources given as strings
+        are upper case like in
+        :meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_channels_for_capture`
+    """
+
+    def __init__(self, channel):
+        if isinstance(channel, str) and channel.isdigit():
+            channel = int(channel)
+        self.channel = channel.upper() if isinstance(channel, str) else channel
+
+    @abc.abstractmethod
+    def first_event(self, time, y, to_y=_identity):
+        """Index of the first point of the first event
+
+        Parameters
+        ----------
+        time : ~numpy.ndarray
+            Time axis, one dimensional
+        y : ~numpy.ndarray
+            Values of the channel, voltages or raw integers
+        to_y : callable
+            Converts a voltage level to the units of ``y``
+
+        Returns
+        -------
+        int
+            The index, ``-1`` if there is no event
+        """
+
+
+def _first(mask, offset=0):
+    """Index of the first ``True`` in ``mask`` plus ``offset``, ``-1`` if none"""
+    i = np.argmax(mask) if mask.size else 0
+    return int(i) + offset if mask.size and mask[i] else -1
+
+
+class ThresholdCrossing(EventPredicate):
+    """Event where a channel crosses a voltage level
+
+    Parameters
+    ----------
+    channel : int or str
+        The channel
+    level : float
+        Voltage level
+    slope : {``'rising'``, ``'falling'``, ``'either'``}, default ``'rising'``
+        Direction of the crossing
+    """
+
+    def __init__(self, channel, level, slope='rising'):
+        super().__init__(channel)
+        if slope not in ('rising', 'falling', 'either'):
+            raise ValueError(f"Unknown slope '{slope}'")
+        self.level = level
+        self.slope = slope
+
+    def first_event(self, time, y, to_y=_identity):
+        above = y >= to_y(self.level)
+        if self.slope == 'rising':
+            edges = ~above[:-1] & above[1:]
+        elif self.slope == 'falling':
+            edges = above[:-1] & ~above[1:]
+        else:
+            edges = above[:-1] != above[1:]
+        return _first(edges, offset=1)
+
+
+class PulseWidth(EventPredicate):
+    """Event where a channel has a pulse with a width in a window, only
+    pulses that start and end inside the record are considered
+
+    Parameters
+    ----------
+    channel : int or str
+        The channel
+    level : float
+        Voltage level defining the pulse
+    min_width, max_width : float or ``None``, default ``None``
+        Limits for the width of the pulse in seconds, ``None`` for no limit
+    positive : bool, default ``True``
+        ``True`` for pulses above the level, ``False`` for pulses below
+    """
+
+    def __init__(self, channel, level, min_width=None, max_width=None, positive=True):
+        super().__init__(channel)
+        self.level = level
+        self.min_width = min_width
+        self.max_width = max_width
+        self.positive = positive
+
+    def first_event(self, time, y, to_y=_identity):
+        inside = y >= to_y(self.level)
+        if not self.positive:
+            inside = ~inside
+        starts = np.flatnonzero(~inside[:-1] & inside[1:]) + 1
+        ends = np.flatnonzero(inside[:-1] & ~inside[1:]) + 1
+        # The end of each pulse is the first end after its start
+        end_pos = np.searchsorted(ends, starts)
+        complete = end_pos < ends.size
+        starts = starts[complete]
+        widths = time[ends[end_pos[complete]]] - time[starts]
+        match = np.ones(starts.size, dtype=bool)
+        if self.min_width is not None:
+            match &= widths >= self.min_width
+        if self.max_width is not None:
+            match &= widths <= self.max_width
+        i = _first(match)
+        return int(starts[i]) if i >= 0 else -1
+
+
+class AmplitudeLimit(EventPredicate):
+    """Event where a channel is outside voltage limits
+
+    Parameters
+    ----------
+    channel : int or str
+        The channel
+    low, high : float or ``None``, default ``None``
+        The limits, ``None`` for no limit
+    """
+
+    def __init__(self, channel, low=None, high=None):
+        super().__init__(channel)
+        self.low = low
+        self.high = high
+
+    def first_event(self, time, y, to_y=_identity):
+        outside = np.zeros(y.shape, dtype=bool)
+        if self.high is not None:
+            outside |= y > to_y(self.high)
+        if self.low is not None:
+            outside |= y < to_y(self.low)
+        return _first(outside)
+
+
+class TraceFilter:
+    """Find events in traces with vectorised predicates, to keep only the
+    traces (or a window around the event in the traces) with events.
+
+    Example
+    -------
+    ::
+
+        trace_filter = TraceFilter([ThresholdCrossing(1, 0.5),
+                                    PulseWidth(2, 1.0, max_width=20e-9)],
+                                   mode='all', window=(1e-6, 4e-6))
+        for i in range(1000):
+            time, values, channels = scope.get_trace()
+            event = trace_filter.match(time, values, channels)
+            if event is not None:
+                time, values = trace_filter.cut(time, values, event)
+                save(time, values)
+        print(f"{trace_filter.num_matched} of {trace_filter.num_examined} traces had an event")
+
+    Parameters
+    ----------
+    predicates : list of :class:`EventPredicate`
+        E.g. :class:`ThresholdCrossing`, :class:`PulseWidth` and
+        :class:`AmplitudeLimit`
+    mode : {``'any'``, ``'all'``}, default ``'any'``
+        Whether any or all of the predicates must find an event
+    window : tuple of floats or ``None``, default ``None``
+        Seconds ``(before, after)`` the event kept by :meth:`cut`, ``None``
+        keeps the whole trace
+
+    Attributes
+    ----------
+    num_examined : int
+        Number of traces examined
+    num_matched : int
+        Number of traces with an event
+    """
+
+    def __init__(self, predicates, mode='any', window=None):
+        """See class docstring"""
+        if mode not in ('any', 'all'):
+            raise ValueError(f"Unknown mode '{mode}', use 'any' or 'all'")
+        self.predicates = list(predicates)
+        self.mode = mode
+        self.window = window
+        self.num_examined = 0
+        self.num_matched = 0
+
+    def _column(self, predicate, channels):
+        try:
+            return list(channels).index(predicate.channel)
+        except ValueError:
+            raise ValueError(f"The channel {predicate.channel} of {type(predicate).__name__} "
+                             f"is not among the captured channels {channels}") from None
+
+    def match(self, time, values, channels):
+        """Find the event in a trace
+
+        Parameters
+        ----------
+        time : ~numpy.ndarray
+            Time axis
+        values : ~numpy.ndarray
+            Voltage values, each column represents one channel
+        channels : list
+            The channels of the columns
+
+        Returns
+        -------
+        int or ``None``
+            Index of the first point of the earliest event, ``None`` if the
+            trace does not match
+        """
+        time = np.ravel(time)
+        events = [predicate.first_event(time, values[:, self._column(predicate, channels)])
+                  for predicate in self.predicates]
+        return self._combine(events)
+
+    def match_raw(self, raw, preambles, channels):
+        """Find the event in a trace of raw integers, converting the levels
+        of the predicates instead of the data to voltages
+
+        Parameters
+        ----------
+        raw : ~numpy.ndarray
+            ``'WORD'`` or ``'BYTE'`` data, each row represents one channel
+        preambles : list of str
+            The preamble of each channel
+        channels : list
+            The channels of the rows
+
+        Returns
+        -------
+        int or ``None``
+            See :meth:`match`
+        """
+        time, (yIncr, yOrig, yRef) = _scaling_from_preambles(preambles, len(raw[0]))
+        time = np.ravel(time)
+        events = []
+        for predicate in self.predicates:
+            i = self._column(predicate, channels)
+            to_y = lambda level: (level - yOrig[i, 0])/yIncr[i, 0] + yRef[i, 0]
+            events.append(predicate.first_event(time, np.asarray(raw[i]), to_y))
+        return self._combine(events)
+
+    def _combine(self, events):
+        """Earliest event if any or all predicates found one"""
+        self.num_examined += 1
+        found = [event for event in events if event >= 0]
+        if not found or (self.mode == 'all' and len(found) < len(events)):
+            return None
+        self.num_matched += 1
+        return min(found)
+
+    def cut(self, time, values, event):
+        """The :attr:`window` around an event
+
+        Parameters
+        ----------
+        time : ~numpy.ndarray
+            Time axis
+        values : ~numpy.ndarray
+            Values, each column represents one channel
+        event : int
+            Index of the event, see :meth:`match`
+
+        Returns
+        -------
+        time, values : :class:`~numpy.ndarray`
+            The points in the window, the whole trace if :attr:`window` is ``None``
+        """
+        if self.window is None:
+            return time, values
+        flat_time = np.ravel(time)
+        before, after = self.window
+        start = np.searchsorted(flat_time, flat_time[event] - before, side='left')
+        stop = np.searchsorted(flat_time, flat_time[event] + after, side='right')
+        return time[start:stop], values[start:stop]
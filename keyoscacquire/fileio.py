@@ -11,8 +11,10 @@ import logging
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 
 import keyoscacquire.config as config
+import keyoscacquire.dataprocessing as dataprocessing
 
 
 _log = logging.getLogger(__name__)
@@ -74,7 +76,7 @@ def plot_trace(time, y, channels, fname="", showplot=config._show_plot,
     """
     fig, ax = plt.subplots()
     for i, vals in enumerate(np.transpose(y)): # for each channel
-        ax.plot(time, vals, color=_SCREEN_COLORS[channels[i]])
+        ax.plot(time, vals, color=_SCREEN_COLORS.get(channels[i]))
     if savepng:
         fig.savefig(fname+".png", bbox_inches='tight')
     if showplot:
@@ -272,3 +274,173 @@ def load_header(fname, ext=config._filetype):
             else:
                 break
     return header
+
+
+## Digital channels ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def save_digital(fname, time, packed, pods, rle=False, print_filename=True):
+    """Saves digital pod data packed (one byte per pod and point) to a numpy
+    ``.npz`` file. The time axis is stored as its first value and increment.
+
+    Parameters
+    ----------
+    fname : str
+        Filename to save to, without extension
+    time : ~numpy.ndarray
+        Time axis of the digital channels
+    packed : ~numpy.ndarray
+        ``uint8`` data with shape ``(points, pods)``, see
+        :meth:`keyoscacquire.oscilloscope.Oscilloscope.get_digital`
+    pods : list of str
+        The pods, e.g. ``['POD1', 'POD2']``
+    rle : bool, default ``False``
+        ``True`` stores the data run-length encoded, see
+        :func:`keyoscacquire.dataprocessing.run_length_encode`
+    print_filename : bool, default ``True``
+        ``True`` prints the filename it is saved to
+
+    Raises
+    ------
+    RuntimeError
+        If the file already exists
+    """
+    if os.path.exists(fname+".npz"):
+        raise RuntimeError(f"{fname}.npz already exists")
+    if print_filename:
+        print(f"Saving digital channels to:  {fname}.npz\n")
+    time = np.ravel(time)
+    increment = time[1]-time[0] if time.size > 1 else 0.
+    data = {'time_start': time[0], 'time_increment': increment,
+            'num_points': len(packed), 'pods': np.asarray(pods)}
+    if rle:
+        data['rle_starts'], data['rle_values'] = dataprocessing.run_length_encode(packed)
+    else:
+        data['packed'] = packed
+    np.savez(fname+".npz", **data)
+
+
+def load_digital(fname, unpack=False):
+    """Load digital pod data saved with :func:`save_digital`
+
+    Parameters
+    ----------
+    fname : str
+        Filename, with or without extension
+    unpack : bool, default ``False``
+        ``True`` unpacks to one column per digital line, see
+        :func:`keyoscacquire.dataprocessing.unpack_digital`
+
+    Returns
+    -------
+    time : :class:`~numpy.ndarray`
+        Time axis of the digital channels
+    data : :class:`~numpy.ndarray`
+        Packed data with shape ``(points, pods)``, or unpacked with shape
+        ``(points, 8*pods)``
+    names : list of str
+        The pods, or the digital lines if ``unpack`` is ``True``
+    """
+    if fname[-4:] != ".npz":
+        fname += ".npz"
+    with np.load(fname) as data:
+        num_points = int(data['num_points'])
+        time = data['time_start'] + np.arange(num_points)*data['time_increment']
+        pods = data['pods'].tolist()
+        if 'rle_starts' in data:
+            packed = dataprocessing.run_length_decode(data['rle_starts'], data['rle_values'], num_points)
+        else:
+            packed = data['packed']
+    if unpack:
+        return time, dataprocessing.unpack_digital(packed), dataprocessing.digital_line_names(pods)
+    return time, packed, pods
+
+
+## Histograms ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def save_histogram(fname, histogram, channels=None, print_filename=True):
+    """Saves a :class:`~keyoscacquire.dataprocessing.PersistenceHistogram`
+    with its bin edges to a numpy ``.npz`` file
+
+    Parameters
+    ----------
+    fname : str
+        Filename to save to, without extension
+    histogram : :class:`~keyoscacquire.dataprocessing.PersistenceHistogram`
+        The histogram
+    channels : list of ints or ``None``
+        The channels of the histogram, stored with the counts
+    print_filename : bool, default ``True``
+        ``True`` prints the filename it is saved to
+
+    Raises
+    ------
+    RuntimeError
+        If the file already exists
+    """
+    if os.path.exists(fname+".npz"):
+        raise RuntimeError(f"{fname}.npz already exists")
+    if print_filename:
+        print(f"Saving histogram to:  {fname}.npz\n")
+    channels = [] if channels is None else channels
+    np.savez(fname+".npz", counts=histogram.counts, time_edges=histogram.time_edges,
+             voltage_edges=histogram.voltage_edges, channels=np.asarray(channels),
+             num_traces=histogram.num_traces)
+
+
+def load_histogram(fname):
+    """Load a histogram saved with :func:`save_histogram`
+
+    Returns
+    -------
+    counts : :class:`~numpy.ndarray`
+        Counts with shape ``(channels, time_bins, voltage_bins)``
+    time_edges : :class:`~numpy.ndarray`
+        Edges of the time bins
+    voltage_edges : :class:`~numpy.ndarray`
+        Edges of the voltage bins
+    channels : list
+        The channels of the histogram
+    """
+    if fname[-4:] != ".npz":
+        fname += ".npz"
+    with np.load(fname) as data:
+        return (data['counts'], data['time_edges'], data['voltage_edges'],
+                data['channels'].tolist())
+
+
+def plot_histogram(histogram, channels, fname="", showplot=config._show_plot,
+                   savepng=config._export_png, log=True):
+    """Plots a :class:`~keyoscacquire.dataprocessing.PersistenceHistogram`
+    as one colour map per channel and saves as a png.
+
+    .. Caution:: No filename check for the saved plot, can overwrite
+      existing png files.
+
+    Parameters
+    ----------
+    histogram : :class:`~keyoscacquire.dataprocessing.PersistenceHistogram`
+        The histogram
+    channels : list of ints
+        list of the channels of the histogram, example [1, 3]
+    fname : str, default ``""``
+        Filename of possible exported png
+    showplot : bool, default :data:`~keyoscacquire.config._show_plot`
+        True shows the plot (must be closed before the programme proceeds)
+    savepng : bool, default :data:`~keyoscacquire.config._export_png`
+        ``True`` exports the plot to ``fname``.png
+    log : bool, default ``True``
+        Logarithmic colour scale
+    """
+    fig, axs = plt.subplots(len(channels), 1, sharex=True, squeeze=False)
+    norm = LogNorm(vmin=1) if log else None
+    for ax, counts, ch in zip(axs[:, 0], histogram.counts, channels):
+        counts = np.ma.masked_equal(counts, 0) if log else counts
+        ax.pcolormesh(histogram.time_edges, histogram.voltage_edges, counts.T,
+                      norm=norm, shading='flat')
+        ax.set_ylabel(f"Channel {ch} [V]")
+    axs[-1, 0].set_xlabel("Time [s]")
+    if savepng:
+        fig.savefig(fname+".png", bbox_inches='tight')
+    if showplot:
+        plt.show(fig)
+    plt.close(fig)
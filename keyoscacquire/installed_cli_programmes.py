@@ -19,6 +19,7 @@ import sys
 import argparse
 
 import keyoscacquire.programmes as programmes
+import keyoscacquire.dataprocessing as dataprocessing
 import keyoscacquire.config as config
 
 ##============================================================================##
@@ -27,13 +28,57 @@ import keyoscacquire.config as config
 
 # Help strings
 acq_help = f"The acquire type: {{HRESolution, NORMal, AVER<m>}} where <m> is the number of averages in range [2, 65536]. Defaults to '{config._acq_type}'."
-wav_help = f"The waveform format: {{BYTE, WORD, ASCii}}. \nDefaults to '{config._waveform_format}'."
+wav_help = f"The waveform format: {{BYTE, WORD, ASCii, AUTO}}, AUTO chooses BYTE or WORD depending on the acquisition type. \nDefaults to '{config._waveform_format}'."
 file_help = f"The filename base, (without extension, '{config._filetype}' is added). Defaults to '{config._filename}'."
 visa_help = f"Visa address of instrument. To find the visa addresses of the instruments connected to the computer run 'list_visa_devices' in the command line. Defaults to '{config._visa_address}'."
 timeout_help = f"Milliseconds before timeout on the channel to the instrument. Defaults to {config._timeout}."
-channels_help = f"List of the channel numbers to be acquired, for example '1 3' (without ') or 'active' (without ') to capture all the currently active channels on the oscilloscope. Defaults to the currently active channels."
+channels_help = f"List of the channel numbers to be acquired, for example '1 3' (without ') or 'active' (without ') to capture all the currently active channels on the oscilloscope. The sources MATH and, on MSO models, the digital pods POD1 and POD2 can also be given, for example '1 MATH POD1'. Defaults to the currently active channels."
 points_help = f"Use 0 to get the maximum number of points, or set a specific number (the scope might change it slightly). Defaults to '{config._num_points}."
 delim_help = f"Delimiter used between filename and filenumber (before filetype). Defaults to '{config._file_delimiter}'."
+stats_help = "Do not save each trace, but accumulate the mean, standard deviation, minimum and maximum of each point and save only these to '<filename>_statistics'."
+crossing_help = "Keep only traces where channel CH crosses LEVEL volts (in the direction of --slope)."
+slope_help = "Direction of the --crossing: {rising, falling, either}. Defaults to 'rising'."
+pulse_help = "Keep only traces where channel CH has a pulse above LEVEL volts with a width between MIN and MAX seconds (use none for no limit)."
+limits_help = "Keep only traces where channel CH goes below LOW or above HIGH volts (use none for no limit)."
+require_all_help = "Keep only traces where all the conditions are met, instead of any of them."
+window_help = "Save only BEFORE to AFTER seconds around the first event of the kept traces."
+interval_help = "Seconds between the captures, for example 0.5."
+num_periodic_help = "The number of traces to obtain. Defaults to capturing until ctrl-c is pressed."
+outlier_help = "Only with --statistics: reject traces whose rms deviation from the running mean exceeds this number of standard deviations."
+
+
+def _channels_from_args(channels):
+    """Channel numbers as ints, other sources (e.g. ``'POD1'``) as upper case strs"""
+    return [int(c) if c.isdigit() else c.upper() for c in channels]
+
+
+def _limit_from_arg(limit):
+    """Float from the argument, ``None`` for ``'none'``"""
+    return None if limit.lower() == 'none' else float(limit)
+
+
+def _trace_filter_from_args(args):
+    """:class:`~keyoscacquire.dataprocessing.TraceFilter` from the event
+    filtering arguments, ``None`` if no conditions are given"""
+    predicates = []
+    if args.crossing is not None:
+        channel, level = args.crossing
+        predicates.append(dataprocessing.ThresholdCrossing(_channels_from_args([channel])[0],
+                                                           float(level), slope=args.slope))
+    if args.pulse_width is not None:
+        channel, level, min_width, max_width = args.pulse_width
+        predicates.append(dataprocessing.PulseWidth(_channels_from_args([channel])[0], float(level),
+                                                    min_width=_limit_from_arg(min_width),
+                                                    max_width=_limit_from_arg(max_width)))
+    if args.limits is not None:
+        channel, low, high = args.limits
+        predicates.append(dataprocessing.AmplitudeLimit(_channels_from_args([channel])[0],
+                                                        low=_limit_from_arg(low),
+                                                        high=_limit_from_arg(high)))
+    if not predicates:
+        return None
+    return dataprocessing.TraceFilter(predicates, mode='all' if args.require_all else 'any',
+                                      window=args.event_window)
 
 
 def _standard_arguements(parser):
@@ -45,7 +90,7 @@ def _standard_arguements(parser):
                                nargs='?', type=int, default=config._timeout, help=timeout_help)
     acquire_gr = parser.add_argument_group('Acquisition settings')
     acquire_gr.add_argument('-c', '--channels',
-                            nargs='*', type=int, default=None, help=channels_help)
+                            nargs='*', default=None, help=channels_help)
     acquire_gr.add_argument('-a', '--acq_type',
                             nargs='?',default=None, help=acq_help)
     trans_gr = parser.add_argument_group('Transfer and storage settings')
@@ -67,7 +112,7 @@ def connect_each_time_cli():
     args = parser.parse_args()
     # Convert channels arg to ints
     if args.channels is not None:
-        args.channels = [int(c) for c in args.channels]
+        args.channels = _channels_from_args(args.channels)
     programmes.get_traces_connect_each_time_loop(fname=args.filename,
                                                  address=args.visa_address,
                                                  timeout=args.timeout,
@@ -87,7 +132,7 @@ def single_connection_cli():
     args = parser.parse_args()
     # Convert channels arg to ints
     if args.channels is not None:
-        args.channels = [int(c) for c in args.channels]
+        args.channels = _channels_from_args(args.channels)
     programmes.get_traces_single_connection_loop(fname=args.filename,
                                                  address=args.visa_address,
                                                  timeout=args.timeout,
@@ -105,7 +150,7 @@ def single_trace_cli():
     args = parser.parse_args()
     # Convert channels arg to ints
     if args.channels is not None:
-        args.channels = [int(c) for c in args.channels]
+        args.channels = _channels_from_args(args.channels)
     programmes.get_single_trace(fname=args.filename,
                                 address=args.visa_address,
                                 timeout=args.timeout,
@@ -123,10 +168,20 @@ def num_traces_cli():
     # optional args
     trans_gr = _standard_arguements(parser)
     trans_gr.add_argument('--file_delimiter', nargs='?', help=delim_help, default=config._file_delimiter)
+    trans_gr.add_argument('--statistics', action='store_true', help=stats_help)
+    trans_gr.add_argument('--outlier_sigma', nargs='?', type=float, default=None, help=outlier_help)
+    filter_gr = parser.add_argument_group('Event filtering')
+    filter_gr.add_argument('--crossing', nargs=2, metavar=('CH', 'LEVEL'), help=crossing_help)
+    filter_gr.add_argument('--slope', default='rising', choices=['rising', 'falling', 'either'], help=slope_help)
+    filter_gr.add_argument('--pulse_width', nargs=4, metavar=('CH', 'LEVEL', 'MIN', 'MAX'), help=pulse_help)
+    filter_gr.add_argument('--limits', nargs=3, metavar=('CH', 'LOW', 'HIGH'), help=limits_help)
+    filter_gr.add_argument('--require_all', action='store_true', help=require_all_help)
+    filter_gr.add_argument('--event_window', nargs=2, type=float, metavar=('BEFORE', 'AFTER'),
+                           default=None, help=window_help)
     args = parser.parse_args()
     # Convert channels arg to ints
     if args.channels is not None:
-        args.channels = [int(c) for c in args.channels]
+        args.channels = _channels_from_args(args.channels)
     programmes.get_num_traces(num=args.num,
                               fname=args.filename,
                               address=args.visa_address,
@@ -134,7 +189,35 @@ def num_traces_cli():
                               wav_format=args.wav_format,
                               channels=args.channels,
                               acq_type=args.acq_type,
-                              num_points=args.num_points)
+                              num_points=args.num_points,
+                              statistics=args.statistics,
+                              outlier_sigma=args.outlier_sigma,
+                              trace_filter=_trace_filter_from_args(args))
+
+
+def periodic_traces_cli():
+    """Function installed on the command line: Obtains and stores traces at a fixed rate."""
+    parser = argparse.ArgumentParser(description=programmes.get_periodic_traces.__doc__)
+    # postitional arg
+    parser.add_argument('interval', help=interval_help, type=float)
+    # optional args
+    parser.add_argument('-n', '--num', nargs='?', type=int, default=None, help=num_periodic_help)
+    trans_gr = _standard_arguements(parser)
+    trans_gr.add_argument('--file_delimiter', nargs='?', help=delim_help, default=config._file_delimiter)
+    args = parser.parse_args()
+    # Convert channels arg to ints
+    if args.channels is not None:
+        args.channels = _channels_from_args(args.channels)
+    programmes.get_periodic_traces(interval=args.interval,
+                                   num=args.num,
+                                   fname=args.filename,
+                                   address=args.visa_address,
+                                   timeout=args.timeout,
+                                   wav_format=args.wav_format,
+                                   channels=args.channels,
+                                   acq_type=args.acq_type,
+                                   num_points=args.num_points,
+                                   file_delim=args.file_delimiter)
 
 
 def list_visa_devices_cli():
@@ -143,8 +226,12 @@ def list_visa_devices_cli():
     parser.add_argument('-n', action="store_false",
                         help=("If this flag is set, the programme will not query "
                               "the instruments for their IDNs."))
+    parser.add_argument('-r', '--refresh', action="store_true",
+                        help=("If this flag is set, the cached information about "
+                              "the instruments is not used and all instruments "
+                              "are queried again."))
     args = parser.parse_args()
-    programmes.list_visa_devices(ask_idn=args.n)
+    programmes.list_visa_devices(ask_idn=args.n, use_cache=not args.refresh)
 
 
 def path_of_config_cli():
@@ -8,10 +8,15 @@ See Keysight's Programmer's Guide for reference on the VISA commands.
 __docformat__ = "restructuredtext en"
 
 import os
+import re
 import sys
+import hashlib
 import pyvisa
 import time
 import logging
+import itertools
+import queue
+import threading
 import datetime as dt
 import numpy as np
 import matplotlib.pyplot as plt
@@ -31,6 +36,35 @@ _SUPPORTED_SERIES = ['1000', '2000', '3000', '4000', '6000']
 #: Datatype is ``'h'`` for 16 bit signed int (``WORD``), ``'b'`` for 8 bit signed bit (``BYTE``).
 #: Same naming as for structs `docs.python.org/3/library/struct.html#format-characters`
 _DATATYPES = {'BYT':'b', 'WOR':'h', 'BYTE':'b', 'WORD':'h'}
+#: Value returned by the oscilloscope for measurements that could not be made
+_NO_MEASUREMENT = 9.9e37
+#: Commands written during acquisitions that do not invalidate the record of
+#: the applied setup, see :meth:`Oscilloscope.restore_setup`. Matched in both
+#: the long and the short (upper case letters) form of each keyword
+_SETUP_NEUTRAL_COMMANDS = ('*CLS', '*OPC', ':DIGitize', ':RUN', ':STOP', ':SINGle',
+                           ':WAVeform:DATA', ':WAVeform:PREamble',
+                           ':WAVeform:SOURce', ':WAVeform:FORMat')
+#: Subdirectory of :data:`~keyoscacquire.config._cache_dir` with the saved setups
+_SETUP_CACHE_DIR = "setups"
+
+
+def _scpi_header_matches(header, command):
+    """Whether the upper case ``header`` is ``command`` (as in
+    :data:`_SETUP_NEUTRAL_COMMANDS`) with each keyword in its long or short form"""
+    nodes, keywords = header.lstrip(':').split(':'), command.lstrip(':').split(':')
+    if len(nodes) != len(keywords):
+        return False
+    return all(node in (keyword.upper(), ''.join(c for c in keyword if not c.islower()))
+               for node, keyword in zip(nodes, keywords))
+
+
+def _is_setup_neutral(command):
+    """Whether all the parts of ``command`` are in :data:`_SETUP_NEUTRAL_COMMANDS`"""
+    for part in command.split(';'):
+        header = part.strip().split(' ')[0].rstrip('?').upper()
+        if not any(_scpi_header_matches(header, neutral) for neutral in _SETUP_NEUTRAL_COMMANDS):
+            return False
+    return True
 
 
 ## ========================================================================= ##
@@ -60,6 +94,11 @@ class Oscilloscope:
     verbose : bool, default ``True``
         If ``True``: prints when the connection to the device is opened etc,
         and sets attr:`verbose_acquistion` to ``True``
+    socket_transport : bool, default :data:`~keyoscacquire.config._socket_transport`
+        If ``True`` and the address is on the form
+        ``'TCPIP::<host>::<port>::SOCKET'``: communicate through a raw socket
+        (see :class:`~keyoscacquire.visa_utils.SocketResource`) rather than
+        through pyvisa, giving faster transfers of large waveforms
 
     Raises
     ------
@@ -82,7 +121,51 @@ class Oscilloscope:
         If ``True``: will save a png of the plot when :meth:`save_trace()`
     showplot : bool, default :data:`keyoscacquire.config._show_plot`
         If ``True``: will show a matplotlib plot window when :meth:`save_trace()`
-    _inst : :class:`pyvisa.resources.Resource`
+    check_errors_every : int, default :data:`keyoscacquire.config._check_errors_every`
+        If larger than zero: the error queue is drained (and any errors
+        printed if :attr:`verbose`) every ``check_errors_every`` traces
+        obtained with :meth:`get_trace()`, :meth:`stream()` or
+        :meth:`get_segmented_traces()` (one per segmented acquisition), zero
+        disables the check
+    errors : list of str
+        The errors obtained the last time the error queue was drained, see
+        :meth:`get_full_error_queue()`
+    auto_timeout : bool, default :data:`keyoscacquire.config._auto_timeout`
+        If ``True`` and the link has been characterised with
+        :meth:`characterize_link()`: the timeout of each binary waveform
+        transfer is set from the number of points, the bytes per sample and
+        the measured bandwidth (but never lower than :attr:`timeout`)
+    completion_mode : {``'digitize'``, ``'poll'``, ``'srq'``}, default :data:`keyoscacquire.config._completion_mode`
+        How to wait for an acquisition to complete, see :meth:`arm()`
+    poll_interval : float, default :data:`keyoscacquire.config._poll_interval`
+        Seconds between each check of the acquisition status in the
+        ``'poll'`` and ``'srq'`` completion modes
+    acquisition_timeout : float or ``None``, default :data:`keyoscacquire.config._acquisition_timeout`
+        Seconds to wait for an acquisition in the ``'poll'`` and ``'srq'``
+        completion modes, ``None`` waits indefinitely
+    read_cache : bool, default :data:`keyoscacquire.config._read_cache`
+        If ``True``: while the oscilloscope is stopped, the most recent
+        ``'WORD'``/``'BYTE'`` waveform and preamble of each source are kept
+        in memory, and repeated reads of a source (e.g. saving the same frozen
+        trace in several formats or for channel subsets) are served from
+        memory. The cache is only used if the preamble is unchanged and no
+        acquisition has been triggered (``:TER?``, checked when the cache is
+        used) since it was filled. :meth:`get_trace()` only keeps the
+        oscilloscope stopped with ``set_running=False``
+    publisher : :class:`~keyoscacquire.shared_buffer.TracePublisher` or ``None``, default ``None``
+        If not ``None``: each trace obtained with :meth:`get_trace()` or
+        :meth:`stream()` is published to the shared memory ring buffer for
+        other processes
+    digital_rle : bool, default :data:`keyoscacquire.config._digital_rle`
+        If ``True``: digital pods are saved run-length encoded by
+        :meth:`save_trace()`, see :func:`keyoscacquire.fileio.save_digital`
+    measurement_stats : dict or ``None``
+        Number of ``'polls'`` made and ``'missed'`` in the most recent
+        :meth:`poll_measurements()`
+    _setup_hash : str or ``None``
+        SHA-256 of the setup most recently saved or restored, ``None`` after
+        any :meth:`write()` that may have changed the setup
+    _inst : :class:`pyvisa.resources.Resource` or :class:`~keyoscacquire.visa_utils.SocketResource`
         The oscilloscope PyVISA resource
     _id : str
         The maker, model, serial and firmware version of the scope. Examples::
@@ -102,8 +185,16 @@ class Oscilloscope:
         The values for the most recent captured trace
     _capture_channels : list of ints
         The channels of captured for the most recent trace
+    _capture_pods : list of str
+        The digital pods captured for the most recent trace
+    _digital_raw : :class:`~numpy.ndarray`
+        The packed digital data of the most recent trace, see :meth:`get_digital()`
     """
     _capture_channels = None
+    _capture_pods = []
+    _digital_raw = None
+    _digital_metadata = None
+    digital_rle = config._digital_rle
     _raw = None
     _metadata = None
     _time = None
@@ -113,16 +204,42 @@ class Oscilloscope:
     savepng = config._export_png
     showplot = config._show_plot
     verbose_acquistion = False
+    check_errors_every = config._check_errors_every
+    _traces_since_error_check = 0
+    auto_timeout = config._auto_timeout
+    _link_latency = None
+    _link_bandwidth = None
+    _completion_mode = config._completion_mode
+    poll_interval = config._poll_interval
+    acquisition_timeout = config._acquisition_timeout
+    _armed = False
+    _segment_time_tags = None
+    stream_stats = None
+    measurement_stats = None
+    publisher = None
+    _setup_hash = None
+    read_cache = config._read_cache
+    # The trigger event register may be set by the acquisition of the cached data
+    _trigger_event_pending = False
+    _auto_wav_format = False
+    _wav_format_used = None
 
     def __init__(self, address=config._visa_address, timeout=config._timeout,
-                 get_errors_on_init=False, verbose=True):
+                 get_errors_on_init=False, verbose=True,
+                 socket_transport=config._socket_transport):
         """See class docstring"""
         self._address = address
         self.verbose = verbose
+        self.errors = []
+        self._read_cache_data = {}
         # Connect to the scope
         try:
-            rm = pyvisa.ResourceManager()
-            self._inst = rm.open_resource(address)
+            if socket_transport and address.upper().endswith('SOCKET'):
+                host, port = visa_utils.parse_socket_address(address)
+                self._inst = visa_utils.SocketResource(host, port, timeout=timeout)
+            else:
+                rm = pyvisa.ResourceManager()
+                self._inst = rm.open_resource(address)
         except pyvisa.Error as err:
             print(f"\n\nCould not connect to '{address}', see traceback below:\n")
             raise
@@ -144,6 +261,8 @@ class Oscilloscope:
                                    num_points=config._num_points)
         # Will set channels to the active channels
         self.set_channels_for_capture()
+        # Enable the status reporting of the 'srq' completion mode if it is the default
+        self.completion_mode = self._completion_mode
         self.verbose_acquistion = verbose
 
     def _information_about_device(self):
@@ -181,6 +300,8 @@ class Oscilloscope:
         ----------
         command : str
             VISA command to be written"""
+        if self._setup_hash is not None and not _is_setup_neutral(command):
+            self._setup_hash = None
         self._inst.write(command)
 
     def query(self, command, action=""):
@@ -242,22 +363,68 @@ class Oscilloscope:
         # Do not use self.query here as that can lead to infinite nesting!
         return self._inst.query(":SYSTem:ERRor?").strip()
 
-    def get_full_error_queue(self, verbose=True):
+    def get_full_error_queue(self, verbose=True, batch_size=config._error_batch_size):
         """All the latest errors from the oscilloscope, upto 30 errors
-        (and store to the attribute ``errors``)"""
+        (and store to the attribute ``errors``)
+
+        The errors are requested ``batch_size`` at the time in one message,
+        so that the queue is drained in a few round trips rather than one
+        per error.
+
+        Parameters
+        ----------
+        verbose : bool, default ``True``
+            If ``True``: prints the errors
+        batch_size : int, default :data:`~keyoscacquire.config._error_batch_size`
+            Number of errors to request per message, ``1`` gives one
+            ``:SYSTem:ERRor?`` query per error
+
+        Returns
+        -------
+        list of str
+            The errors, each on the form ``error number,description``
+        """
         self.errors = []
-        for i in range(30):
-            err = self.get_error()
-            if err[:2] == "+0":  # No error
-                # Stop querying
+        while len(self.errors) < 30:
+            batch = self._get_errors(min(batch_size, 30-len(self.errors)))
+            # Keep the errors up to the first "+0" (no error) reply
+            errors = list(itertools.takewhile(lambda err: err[:2] != "+0", batch))
+            self.errors.extend(errors)
+            if len(errors) < len(batch):
+                # Reached the end of the queue, stop querying
                 break
-            else:
-                # Store the error
-                self.errors.append(err)
         if verbose:
             self._print_errors(self.errors)
         return self.errors
 
+    def _get_errors(self, num):
+        """Request ``num`` errors from the error queue in a single compound
+        query. The queue returns ``+0,"No error"`` once it is empty.
+
+        Returns
+        -------
+        list of str
+            The ``num`` replies, each on the form ``error number,description``
+        """
+        # Do not use self.query here as that can lead to infinite nesting!
+        reply = self._inst.query(";".join([":SYSTem:ERRor?"]*num))
+        return visa_utils.split_compound_reply(reply)
+
+    def _periodic_error_check(self):
+        """Drain the error queue if :attr:`check_errors_every` traces have
+        been obtained since the last check"""
+        if not self.check_errors_every or self.check_errors_every <= 0:
+            return
+        self._traces_since_error_check += 1
+        if self._traces_since_error_check < self.check_errors_every:
+            return
+        self._traces_since_error_check = 0
+        errors = self.get_full_error_queue(verbose=False)
+        if errors:
+            _log.warning(f"{len(errors)} error(s) in the oscilloscope error queue: {errors}")
+            if self.verbose:
+                self._print_errors(errors)
+
     def _print_errors(self, errors):
         """Print the errors obtained by :func:`Oscilloscope.get_full_error_queue`"""
         if not errors:
@@ -269,6 +436,7 @@ class Oscilloscope:
 
     def run(self):
         """Set the oscilloscope to running mode."""
+        self._read_cache_data.clear()
         self.write(":RUN")
 
     def stop(self):
@@ -303,6 +471,103 @@ class Oscilloscope:
         """See getter"""
         self._inst.timeout = timeout
 
+    def characterize_link(self, chunk_sizes=config._chunk_sizes, repeats=3,
+                          set_chunk_size=True):
+        """Measure the round trip latency and the bulk throughput of the
+        connection for different chunk sizes, and use the fastest chunk size.
+
+        The throughput is measured by reading the waveform of the first
+        source set by :meth:`set_channels_for_capture` with the current
+        number of points, so use the number of points that will be used for
+        the measurements. The scope is stopped during the characterisation
+        and set back to running afterwards if it was running, and the
+        waveform format is restored, also if a transfer fails.
+
+        After the characterisation, the timeout of each waveform transfer
+        is set automatically if :attr:`auto_timeout` is ``True``.
+
+        Parameters
+        ----------
+        chunk_sizes : list of ints, default :data:`~keyoscacquire.config._chunk_sizes`
+            The chunk sizes in bytes to test
+        repeats : int, default 3
+            Number of transfers per chunk size, the median time is used
+        set_chunk_size : bool, default ``True``
+            If ``True``: set the chunk size of the connection to the fastest
+            one, otherwise leave it unchanged
+
+        Returns
+        -------
+        dict
+            ``'latency'``: round trip time in seconds, ``'throughput'``: dict
+            of bytes per second for each chunk size, ``'chunk_size'``: the
+            fastest chunk size
+
+        Raises
+        ------
+        ValueError
+            If no analogue channel or math function is set for capture (for
+            instance if only digital pods are)
+        """
+        if not self._sources:
+            raise ValueError("No analogue channel or math source is set for capture, "
+                             "which is needed to measure the throughput")
+        was_running = self.is_running()
+        self.stop()
+        wav_format = self.wav_format
+        original_chunk_size = self._inst.chunk_size
+        best_chunk_size = original_chunk_size
+        try:
+            # Round trip latency from short queries
+            round_trips = []
+            for i in range(3*repeats):
+                start_time = time.perf_counter()
+                self._inst.query("*OPC?")
+                round_trips.append(time.perf_counter()-start_time)
+            latency = float(np.median(round_trips))
+            # Bulk throughput must be measured with a binary format
+            if wav_format[:3] not in ['WOR', 'BYT']:
+                self._write_wav_format('WORD')
+            datatype = _DATATYPES[self.wav_format[:3]]
+            self.write(f":WAVeform:SOURce {self._sources[0]}")
+            throughput = {}
+            for chunk_size in chunk_sizes:
+                self._inst.chunk_size = chunk_size
+                transfer_times = []
+                for i in range(repeats):
+                    start_time = time.perf_counter()
+                    data = self._inst.query_binary_values(':WAVeform:DATA?', datatype=datatype,
+                                                          container=np.array)
+                    transfer_times.append(time.perf_counter()-start_time)
+                transfer_time = max(float(np.median(transfer_times))-latency, 1e-6)
+                throughput[chunk_size] = data.nbytes/transfer_time
+                _log.debug(f"Chunk size {chunk_size:,d} bytes: {throughput[chunk_size]/1e6:.2f} MB/s")
+            best_chunk_size = max(throughput, key=throughput.get)
+            self._link_latency = latency
+            self._link_bandwidth = throughput[best_chunk_size]
+        except pyvisa.Error:
+            # Discard the rest of a block that timed out
+            self._inst.clear()
+            raise
+        finally:
+            # Leave the connection and the oscilloscope as they were, also
+            # if a transfer times out
+            self._inst.chunk_size = best_chunk_size if set_chunk_size else original_chunk_size
+            if wav_format[:3] not in ['WOR', 'BYT']:
+                self._write_wav_format(wav_format)
+            if was_running:
+                self.run()
+        if self.verbose:
+            print(f"Link latency {latency*1e3:.2f} ms, throughput "
+                  f"{self._link_bandwidth/1e6:.2f} MB/s with chunk size {best_chunk_size:,d} bytes")
+        return {'latency': latency, 'throughput': throughput, 'chunk_size': best_chunk_size}
+
+    def _transfer_timeout(self, num_bytes):
+        """The timeout in ms to use for transferring ``num_bytes`` given the
+        characterised link, never lower than :attr:`timeout`"""
+        expected = self._link_latency + num_bytes/self._link_bandwidth
+        return max(self.timeout, int(np.ceil(config._timeout_margin*expected*1e3)))
+
     @property
     def active_channels(self):
         """Find the currently active channels on the instrument
@@ -508,21 +773,59 @@ class Oscilloscope:
            floating point notation, separated by commas.
         * ``'WORD'`` formatted data transfers signed 16-bit data as two bytes.
         * ``'BYTE'`` formatted data is transferred as signed 8-bit bytes.
+        * ``'AUTO'`` chooses ``'BYTE'`` or ``'WORD'`` for each capture from
+          the :attr:`acq_type` and :attr:`num_averages`: ``'BYTE'`` for
+          ``'NORMal'`` and ``'PEAK'`` (8-bit ADC data), ``'WORD'`` for
+          ``'HRESolution'`` and ``'AVERage'`` with any number of averages
+          (averaged data has more than 8 bits). Halves the transfer time in ``'NORMal'`` mode without
+          losing resolution. The choice is recorded in the file header
 
         :getter:  Returns the number of points that will be acquired, however
                   it does not seem to be fully stable
         :setter:  Set the number, but beware that the scope might change the
                   number depending on memory depth, time axis settings, etc.
-        :type:    ``{'WORD', 'BYTE', 'ASCii'}``
+        :type:    ``{'WORD', 'BYTE', 'ASCii', 'AUTO'}`` (the getter returns
+                  the format of the most recent capture in the ``'AUTO'`` mode)
         """
         return self.query(":WAVeform:FORMat?")
 
     @wav_format.setter
     def wav_format(self, wav_format: str):
         """See getter"""
+        if wav_format.upper() == 'AUTO':
+            self._auto_wav_format = True
+            _log.debug("Waveform format set to:  AUTO")
+        else:
+            self._auto_wav_format = False
+            self._write_wav_format(wav_format)
+
+    def _write_wav_format(self, wav_format):
+        """Set the waveform format on the oscilloscope without changing
+        the ``'AUTO'`` mode"""
         self.write(f":WAVeform:FORMat {wav_format}")
+        self._wav_format_used = wav_format
         _log.debug(f"Waveform format set to:  {wav_format}")
 
+    def _choose_wav_format(self):
+        """The binary waveform format with sufficient resolution for the
+        current :attr:`acq_type`, see :attr:`wav_format`"""
+        acq_type = self.acq_type[:4].upper()
+        if acq_type in ['NORM', 'PEAK']:
+            return 'BYTE'
+        return 'WORD'
+
+    def _wav_format_for_capture(self):
+        """The waveform format to use for the next capture: in the ``'AUTO'``
+        mode it is chosen and set on the oscilloscope if changed, otherwise
+        the current setting of the oscilloscope"""
+        if not self._auto_wav_format:
+            self._wav_format_used = self.wav_format
+        else:
+            wav_format = self._choose_wav_format()
+            if wav_format != self._wav_format_used:
+                self._write_wav_format(wav_format)
+        return self._wav_format_used
+
     def set_acquiring_options(self, wav_format=None, acq_type=None,
                               num_averages=None, p_mode=None, num_points=None,
                               verbose_acquistion=None):
@@ -530,7 +833,7 @@ class Oscilloscope:
 
         Parameters
         ----------
-        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``}, default :data:`keyoscacquire.config._waveform_format`
+        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``, ``'AUTO'``}, default :data:`keyoscacquire.config._waveform_format`
             Select the format of the communication of waveform from the
             oscilloscope, see :attr:`wav_format`
         acq_type : {``'HRESolution'``, ``'NORMal'``, ``'AVERage'``, ``'AVER<m>'``}, default :data:`keyoscacquire.config._acq_type`
@@ -570,7 +873,7 @@ class Oscilloscope:
 
         Parameters
         ----------
-        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``}, default :data:`keyoscacquire.config._waveform_format`
+        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``, ``'AUTO'``}, default :data:`keyoscacquire.config._waveform_format`
             Select the format of the communication of waveform from the
             oscilloscope, see :attr:`wav_format`
         p_mode : {``'NORMal'``, ``'RAW'``}, default :data:`keyoscacquire.config._p_mode`
@@ -593,26 +896,41 @@ class Oscilloscope:
         """Decide the channels to be acquired, or determine by checking active
         channels on the oscilloscope.
 
+        Besides the analogue channel numbers, the list can contain the
+        sources ``'MATH'`` (or ``'FUNC'``), which is captured and processed
+        like an analogue channel, and on MSO models the digital pods
+        ``'POD1'`` (digital lines D0-D7) and ``'POD2'`` (D8-D15). The pods are
+        read as 8-bit words with one bit per line and kept packed, see
+        :meth:`get_digital`.
+
         Parameters
         ----------
-        channels : list of ints or ``'active'``, default active
-            list of the channel numbers to be acquired, example ``[1, 3]``.
-            Use ``'active'`` or ``[]`` to capture all the currently active
-            channels on the oscilloscope.
+        channels : list of ints and strs or ``'active'``, default active
+            list of the channel numbers and sources to be acquired, example
+            ``[1, 3]`` or ``[1, 'MATH', 'POD1']``. Use ``'active'`` or ``[]``
+            to capture all the currently active analogue channels on the
+            oscilloscope.
 
         Returns
         -------
-        list of ints
+        list of ints and strs
             the channels that will be captured, example ``[1, 3]``
         """
         # If no channels specified, find the channels currently active and acquire from those
         if channels is None or np.any(channels in [[], ['active'], 'active']):
-            self._capture_channels = self.active_channels
-        else:
-            self._capture_channels =  channels
+            channels = self.active_channels
+        self._capture_channels, self._capture_pods = [], []
+        for ch in channels:
+            if isinstance(ch, str) and ch.isdigit():
+                ch = int(ch)
+            if isinstance(ch, str) and ch.upper().startswith('POD'):
+                self._capture_pods.append(ch.upper())
+            else:
+                self._capture_channels.append(ch.upper() if isinstance(ch, str) else ch)
         # Build list of sources
-        self._sources = [f"CHAN{ch}" for ch in self._capture_channels]
-        return self._capture_channels
+        self._sources = [f"CHAN{ch}" if isinstance(ch, int) else ch
+                         for ch in self._capture_channels]
+        return self._capture_channels + self._capture_pods
 
     def capture_and_read(self, set_running=True):
         """Acquire raw data from selected channels according to acquring options
@@ -641,19 +959,33 @@ class Oscilloscope:
         --------
         :func:`keyoscacquire.dataprocessing.process_data`
         """
-        wav_format = self.wav_format
+        wav_format = self._wav_format_for_capture()
         if self.verbose_acquistion:
             self.print_acq_settings()
             print(f"Acquiring (format '{wav_format}').. ", end="", flush=True)
         start_time = time.time() # time the acquiring process
         # If the instrument is not running, we presumably want the data
         # on the screen and hence don't want to use DIGitize as digitize
-        # will obtain a new trace.
-        if self.is_running():
-            # DIGitize is a specialised RUN command.
-            # Waveforms are acquired according to the settings of the :ACQuire commands.
-            # When acquisition is complete, the instrument is stopped.
-            self.write(':DIGitize ' + ", ".join(self._sources))
+        # will obtain a new trace. If arm() has been called, the acquisition
+        # has already been started.
+        if self._armed or self.is_running():
+            if not self._armed:
+                self.arm()
+            self.wait_for_acquisition()
+            # This acquisition sets the trigger event register
+            self._trigger_event_pending = True
+        elif self._read_cache_data:
+            # Reading the trigger event register also clears it. If it was
+            # set by the acquisition of the cached data, later triggers will
+            # set it again
+            triggered = int(self.query(":TER?")) == 1
+            if triggered and not self._trigger_event_pending:
+                # An acquisition has been triggered since the cache was filled
+                self._read_cache_data.clear()
+            self._trigger_event_pending = False
+        else:
+            # Any trigger event happened before the data now read
+            self._trigger_event_pending = True
         ## Read from the scope
         wav_format = wav_format[:3]
         if wav_format in ['WOR', 'BYT']:
@@ -663,6 +995,7 @@ class Oscilloscope:
         else:
             raise ValueError(f"\nCould not capture and read data, waveform format "
                              f"'{wav_format}' is unknown.\n")
+        self._read_digital()
         if self.verbose_acquistion:
             print("done")
         to_log = f"Elapsed time capture and read: {(time.time()-start_time)*1e3:.1f} ms"
@@ -670,6 +1003,141 @@ class Oscilloscope:
         if set_running:
             self.run()
 
+    @property
+    def completion_mode(self):
+        """How to wait for an acquisition to complete, see :meth:`arm()`
+
+        :getter:  Returns the completion mode
+        :setter:  Sets the completion mode, enabling the operation complete
+                  bit in the status byte for ``'srq'``
+        :type:    ``{'digitize', 'poll', 'srq'}``
+
+        Raises
+        ------
+        ValueError
+            If the mode is unknown, or if it is ``'srq'`` for a
+            :class:`~keyoscacquire.visa_utils.SocketResource` connection
+            (which has no serial poll)
+        """
+        return self._completion_mode
+
+    @completion_mode.setter
+    def completion_mode(self, mode: str):
+        """See getter"""
+        if mode.lower() not in ('digitize', 'poll', 'srq'):
+            raise ValueError(f"Completion mode '{mode}' is unknown, "
+                             "use one of {'digitize', 'poll', 'srq'}")
+        if mode.lower() == 'srq':
+            if isinstance(self._inst, visa_utils.SocketResource):
+                raise ValueError("The 'srq' completion mode requires serial poll, which is "
+                                 "not available with socket_transport, use 'poll'")
+            # Let the operation complete bit set the event summary bit (bit 5)
+            # of the status byte
+            self.write('*ESE 1;*SRE 32')
+        self._completion_mode = mode
+
+    def arm(self):
+        """Start an acquisition from the sources set by
+        :meth:`set_channels_for_capture` without waiting for it to complete.
+
+        How the acquisition is started and how its completion is detected
+        depends on :attr:`completion_mode`:
+
+        * ``'digitize'`` — ``:DIGitize`` is sent and the next query blocks
+          until the acquisition is complete, so the :attr:`timeout` must
+          cover the time to trigger and acquire
+        * ``'poll'`` — ``:SINGle`` is sent and, once ``*OPC?`` confirms that
+          the oscilloscope is armed, the run status is polled every
+          :attr:`poll_interval` seconds until the acquisition is complete.
+          Note that ``:SINGle`` acquires all displayed channels
+        * ``'srq'`` — ``:DIGitize`` followed by ``*OPC`` is sent with the
+          operation complete bit enabled in the status byte, which is read
+          by serial poll (bypassing the blocked command parser) every
+          :attr:`poll_interval` seconds. Requires a VISA resource with
+          serial poll support (e.g. USB, GPIB or VXI-11 ``INSTR``). The
+          error queue is not cleared
+
+        With ``'poll'`` and ``'srq'`` the thread is free until the
+        acquisition completes, and :attr:`timeout` only has to cover the
+        data transfer. A subsequent :meth:`capture_and_read` or
+        :meth:`get_trace` waits for the armed acquisition and reads it out::
+
+            scope.arm()
+            process_previous_trace()  # while waiting for the trigger
+            scope.get_trace()
+
+        Raises
+        ------
+        ValueError
+            If :attr:`completion_mode` is not one of ``{'digitize', 'poll', 'srq'}``
+        """
+        mode = self.completion_mode.lower()
+        if mode == 'digitize':
+            # DIGitize is a specialised RUN command.
+            # Waveforms are acquired according to the settings of the :ACQuire commands.
+            # When acquisition is complete, the instrument is stopped.
+            self.write(':DIGitize ' + ", ".join(self._sources+self._capture_pods))
+        elif mode == 'poll':
+            # Wait until the oscilloscope is armed, otherwise the run bit may
+            # still be clear when first polled
+            self.query(':SINGle;*OPC?')
+        elif mode == 'srq':
+            # Clear the event status register (but not the error queue as *CLS would)
+            self.query('*ESR?')
+            self.write(':DIGitize ' + ", ".join(self._sources+self._capture_pods) + ';*OPC')
+        else:
+            raise ValueError(f"Completion mode '{self.completion_mode}' is unknown, "
+                             "use one of {'digitize', 'poll', 'srq'}")
+        self._read_cache_data.clear()
+        self._armed = True
+
+    def acquisition_done(self):
+        """Check without blocking if an acquisition started by :meth:`arm`
+        is complete.
+
+        Always ``True`` in the ``'digitize'`` :attr:`completion_mode` as the
+        next query will block until the acquisition is complete.
+
+        Returns
+        -------
+        bool
+            ``True`` if the acquisition is complete
+        """
+        mode = self.completion_mode.lower()
+        if mode == 'poll':
+            # Bit 3 of the operation register is 1 while running/armed
+            return not self.is_running()
+        if mode == 'srq':
+            return (self._inst.read_stb() & 32) == 32
+        return True
+
+    def wait_for_acquisition(self, timeout=None):
+        """Wait for an acquisition started by :meth:`arm` to complete,
+        checking every :attr:`poll_interval` seconds.
+
+        Parameters
+        ----------
+        timeout : float or ``None``, default :attr:`acquisition_timeout`
+            Seconds to wait before giving up, ``None`` waits indefinitely
+
+        Raises
+        ------
+        TimeoutError
+            If the acquisition did not complete within the timeout
+        """
+        if timeout is None:
+            timeout = self.acquisition_timeout
+        start_time = time.perf_counter()
+        while not self.acquisition_done():
+            if timeout is not None and time.perf_counter()-start_time > timeout:
+                raise TimeoutError(f"The acquisition did not complete within {timeout} s "
+                                   f"(completion mode '{self.completion_mode}')")
+            time.sleep(self.poll_interval)
+        if self.completion_mode.lower() == 'srq':
+            # Clear the event status register
+            self.query('*ESR?')
+        self._armed = False
+
     def _read_binary(self, datatype='standard'):
         """Read data and metadata from sources of the oscilloscope
         when waveform format is ``'WORD'`` or ``'BYTE'``.
@@ -703,12 +1171,29 @@ class Oscilloscope:
             self.write(f":WAVeform:SOURce {source}")
             # obtain comma separated metadata values for processing of raw data for this source
             self._metadata.append(self.query(':WAVeform:PREamble?'))
+            # Use the data in memory if it is from the same capture
+            cached = self._read_cache_data.get(source)
+            if cached is not None and cached[:2] == (datatype, self._metadata[-1]):
+                _log.debug(f"Using the cached waveform for {source}")
+                self._raw.append(cached[2])
+                continue
+            # Allow for the transfer time of long records if the link is characterised
+            timeout = self.timeout
+            num_points = int(float(self._metadata[-1].split(',')[2]))
+            if self.auto_timeout and self._link_bandwidth is not None:
+                self._inst.timeout = self._transfer_timeout(num_points*np.dtype(datatype).itemsize)
             try:
                 # obtain the data
                 # read out data for this source
-                self._raw.append(self._inst.query_binary_values(':WAVeform:DATA?',
-                                                               datatype=datatype,
-                                                               container=np.array))
+                if isinstance(self._inst, visa_utils.SocketResource):
+                    # Receive directly into an array sized from the preamble
+                    raw = np.empty(num_points, dtype=datatype)
+                    self._read_block_into(raw, datatype)
+                    self._raw.append(raw)
+                else:
+                    self._raw.append(self._inst.query_binary_values(':WAVeform:DATA?',
+                                                                   datatype=datatype,
+                                                                   container=np.array))
             except pyvisa.Error as err:
                 print(f"\n\nVisaError: {err}\n  When trying to obtain the "
                       f"waveform (full traceback below).")
@@ -722,6 +1207,76 @@ class Oscilloscope:
                     print(excep)
                     print("")
                 raise
+            finally:
+                self._inst.timeout = timeout
+            if self.read_cache:
+                self._read_cache_data[source] = (datatype, self._metadata[-1], self._raw[-1])
+
+    def _read_digital(self):
+        """Read the digital pods set by :func:`set_channels_for_capture` as
+        8-bit words, one bit per digital line, with the ``'BYTE'`` waveform
+        format regardless of :attr:`wav_format`.
+
+        Populates the following attributes
+        _digital_raw : :class:`~numpy.ndarray` or ``None``
+            Packed data with shape ``(points, pods)`` and dtype ``uint8``,
+            ``None`` if no pods are captured
+        _digital_metadata : list of str
+            List of preamble metadata (comma separated ascii values) for each pod
+        """
+        self._digital_raw, self._digital_metadata = None, []
+        if not self._capture_pods:
+            return
+        wav_format = self._wav_format_used
+        if wav_format[:3] != 'BYT':
+            self.write(":WAVeform:FORMat BYTE")
+        try:
+            pods = []
+            for pod in self._capture_pods:
+                self.write(f":WAVeform:SOURce {pod}")
+                self._digital_metadata.append(self.query(':WAVeform:PREamble?'))
+                pods.append(self._inst.query_binary_values(':WAVeform:DATA?', datatype='B',
+                                                           container=np.array))
+        finally:
+            if wav_format[:3] != 'BYT':
+                self.write(f":WAVeform:FORMat {wav_format}")
+        self._digital_raw = np.stack(pods, axis=1).astype(np.uint8, copy=False)
+
+    def get_digital(self, unpack=False):
+        """The digital lines of the most recent trace captured with pods
+        (see :meth:`set_channels_for_capture`).
+
+        Parameters
+        ----------
+        unpack : bool, default ``False``
+            If ``False``: the pods as packed 8-bit words (one byte per pod and
+            point), if ``True``: one column of zeros and ones per digital
+            line, see :func:`keyoscacquire.dataprocessing.unpack_digital`
+
+        Returns
+        -------
+        time : :class:`~numpy.ndarray`
+            Time axis of the digital channels
+        data : :class:`~numpy.ndarray`
+            Packed ``uint8`` data with shape ``(points, pods)``, or unpacked
+            data with shape ``(points, 8*pods)``
+        names : list of str
+            The pods (e.g. ``['POD1']``) or the digital lines (e.g.
+            ``['D0', ..., 'D7']``)
+
+        Raises
+        ------
+        RuntimeError
+            If the most recent trace has no digital pods
+        """
+        if self._digital_raw is None:
+            raise RuntimeError("No digital pods were captured in the most recent trace")
+        time, _ = dataprocessing._scaling_from_preambles(self._digital_metadata,
+                                                         self._digital_raw.shape[0])
+        if unpack:
+            return (time, dataprocessing.unpack_digital(self._digital_raw),
+                    dataprocessing.digital_line_names(self._capture_pods))
+        return time, self._digital_raw, list(self._capture_pods)
 
     def _read_ascii(self):
         """Read data and metadata from sources of the oscilloscope
@@ -757,9 +1312,657 @@ class Oscilloscope:
         self._metadata = (preamble, self._model_series)
 
 
+    ## Segmented acquisition ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def get_segmented_traces(self, num_segments, channels=None, restore_mode=True,
+                             set_running=True):
+        """Capture ``num_segments`` triggers in the segmented memory of the
+        oscilloscope and read out all the segments.
+
+        The oscilloscope captures the segments at full hardware rate after
+        one arming (see :meth:`arm`), the segments are then read out one by
+        one with ``:ACQuire:SEGMented:INDex``. The preamble of each channel
+        is only queried for the first segment as it is the same for all
+        segments. Requires :attr:`wav_format` ``'WORD'`` or ``'BYTE'`` and an
+        oscilloscope with the segmented memory option (e.g. InfiniiVision
+        3000, 4000 and 6000 X-series).
+
+        Parameters
+        ----------
+        num_segments : int
+            Number of segments (triggers) to capture, 2 or more
+        channels : list of ints or ``'active'``, uses oscilloscope setting by default
+            Optionally change the list of the channel numbers to be acquired,
+            see :meth:`set_channels_for_capture`
+        restore_mode : bool, default ``True``
+            If ``True``: set the acquisition mode back to real time
+            (``:ACQuire:MODE RTIMe``) after the read out
+        set_running : bool, default ``True``
+            ``True`` leaves oscilloscope running after the read out
+
+        Returns
+        -------
+        time : :class:`~numpy.ndarray`
+            Time axis relative to the trigger of each segment
+        values : :class:`~numpy.ndarray`
+            Voltage values with shape ``(segments, points, channels)``
+        time_tags : :class:`~numpy.ndarray`
+            Time of the trigger of each segment relative to the trigger of the
+            first segment in seconds
+
+        The segments are also kept in ``_time`` and ``_values`` (which then
+        has three dimensions), so that :meth:`save_trace` saves them with
+        one column per segment and channel.
+
+        Raises
+        ------
+        ValueError
+            If :attr:`wav_format` is not ``'WORD'`` or ``'BYTE'``
+        """
+        wav_format = self._wav_format_for_capture()[:3]
+        if wav_format not in ['WOR', 'BYT']:
+            raise ValueError(f"Segmented acquisition requires the waveform format "
+                             f"'WORD' or 'BYTE' (currently '{self._wav_format_used}')")
+        datatype = _DATATYPES[wav_format]
+        self.set_channels_for_capture(channels=channels)
+        self.write(":ACQuire:MODE SEGMented")
+        try:
+            self.write(f":ACQuire:SEGMented:COUNt {num_segments}")
+            if self.verbose_acquistion:
+                print(f"Acquiring {num_segments} segments from channels "
+                      f"{self._capture_channels}.. ", end="", flush=True)
+            start_time = time.time()
+            self.arm()
+            self.wait_for_acquisition()
+            num_segments = int(float(self.query(":WAVeform:SEGMented:COUNt?")))
+            # Preambles are the same for all segments
+            preambles = []
+            for source in self._sources:
+                self.write(f":WAVeform:SOURce {source}")
+                preambles.append(self.query(':WAVeform:PREamble?'))
+            num_points = int(float(preambles[0].split(',')[2]))
+            # Reuse one buffer for all segments, contiguous per segment and source
+            raw = np.empty((num_segments, len(self._sources), num_points), dtype=datatype)
+            time_tags = np.empty(num_segments)
+            for seg in range(num_segments):
+                self.write(f":ACQuire:SEGMented:INDex {seg+1}")
+                time_tags[seg] = float(self.query(":WAVeform:SEGMented:TTAG?"))
+                for i, source in enumerate(self._sources):
+                    self.write(f":WAVeform:SOURce {source}")
+                    self._read_block_into(raw[seg, i], datatype)
+        finally:
+            # Also if the acquisition or the read out fails
+            if restore_mode:
+                self.write(":ACQuire:MODE RTIMe")
+            if set_running:
+                self.run()
+        if self.verbose_acquistion:
+            print("done")
+        _log.debug(f"Elapsed time segmented capture and read: {(time.time()-start_time)*1e3:.1f} ms")
+        self._raw, self._metadata = raw, preambles
+        self._digital_raw, self._digital_metadata = None, []
+        self._time, self._values = dataprocessing.process_segmented_data(raw, preambles)
+        self._segment_time_tags = time_tags
+        self._periodic_error_check()
+        return self._time, self._values, time_tags
+
+    def _read_block_into(self, out, datatype):
+        """Read ``:WAVeform:DATA?`` into the contiguous array ``out``, directly
+        if the connection supports it (see
+        :meth:`~keyoscacquire.visa_utils.SocketResource.read_binary_block`)"""
+        if hasattr(self._inst, 'read_binary_block'):
+            self._inst.write(':WAVeform:DATA?')
+            values = self._inst.read_binary_block(dtype=datatype, out=out)
+        else:
+            values = self._inst.query_binary_values(':WAVeform:DATA?', datatype=datatype,
+                                                    container=np.array)
+            out[:len(values)] = values
+        if len(values) != len(out):
+            raise ValueError(f"Expected {len(out):,d} points, received {len(values):,d}")
+
+    ## Chunked transfer of large records ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def read_record_chunked(self, channels=None, out=None, chunk_points=None,
+                            max_retries=config._chunk_retries, set_running=True):
+        """Capture (if the oscilloscope is running) and read out a large record
+        in chunks, writing each chunk to a preallocated array or directly to
+        disk as it arrives.
+
+        Each chunk only has to arrive within the :attr:`timeout`, so large
+        records do not require long timeouts. How the record is chunked
+        depends on the instrument:
+
+        * Infiniium (9000 series) — the record is requested in windows
+          with ``:WAVeform:DATA? <start>,<size>``, and only a failed window
+          is requested again
+        * InfiniiVision — ``:WAVeform:DATA?`` has no windowing, so the block
+          is read in chunks of the same size, each with its own timeout.
+          If a chunk fails the connection is cleared and the source is read
+          again (the other sources are kept)
+
+        The data is returned as raw integers together with the preambles,
+        use :func:`keyoscacquire.dataprocessing.process_segmented_data`
+        (with ``raw[np.newaxis]``) or scale chunk by chunk to get voltages.
+
+        Parameters
+        ----------
+        channels : list of ints or ``'active'``, uses oscilloscope setting by default
+            Optionally change the list of the channel numbers to be acquired,
+            see :meth:`set_channels_for_capture`
+        out : ``None``, str or :class:`~numpy.ndarray`, default ``None``
+            ``None`` allocates an array. A filename writes the raw data as it
+            arrives to a ``.npy`` memory map with this name, and the preambles
+            to ``<name>.preamble`` (one line per source). An array with
+            shape ``(sources, points)`` and the dtype of the :attr:`wav_format`
+            is filled in place
+        chunk_points : int or ``None``, default ``None``
+            Points per chunk. ``None`` sizes the chunks to take
+            :data:`~keyoscacquire.config._chunk_duration` seconds on a link
+            characterised by :meth:`characterize_link`, otherwise
+            :data:`~keyoscacquire.config._chunk_points` points
+        max_retries : int, default :data:`~keyoscacquire.config._chunk_retries`
+            Number of times a failed chunk or source is retried
+        set_running : bool, default ``True``
+            ``True`` leaves oscilloscope running after data capture
+
+        Returns
+        -------
+        raw : :class:`~numpy.ndarray` or :class:`~numpy.memmap`
+            Raw integers with shape ``(sources, points)``
+        preambles : list of str
+            The preamble of each source, see :ref:`preamble`
+
+        Raises
+        ------
+        ValueError
+            If :attr:`wav_format` is not ``'WORD'`` or ``'BYTE'``
+        """
+        wav_format = self._wav_format_for_capture()[:3]
+        if wav_format not in ['WOR', 'BYT']:
+            raise ValueError(f"Chunked transfer requires the waveform format "
+                             f"'WORD' or 'BYTE' (currently '{self._wav_format_used}')")
+        datatype = np.dtype(_DATATYPES[wav_format])
+        self.set_channels_for_capture(channels=channels)
+        if self._armed or self.is_running():
+            if not self._armed:
+                self.arm()
+            self.wait_for_acquisition()
+        preambles = []
+        for source in self._sources:
+            self.write(f":WAVeform:SOURce {source}")
+            preambles.append(self.query(':WAVeform:PREamble?'))
+        num_points = int(float(preambles[0].split(',')[2]))
+        shape = (len(self._sources), num_points)
+        if out is None:
+            raw = np.empty(shape, dtype=datatype)
+        elif isinstance(out, str):
+            fname = out[:-4] if out.endswith('.npy') else out
+            raw = np.lib.format.open_memmap(fname+'.npy', mode='w+', dtype=datatype, shape=shape)
+            with open(fname+'.preamble', 'w') as f:
+                f.write("\n".join(preambles)+"\n")
+        else:
+            raw = out
+            if raw.shape != shape or raw.dtype != datatype:
+                raise ValueError(f"out must have shape {shape} and dtype {datatype}")
+        if chunk_points is None:
+            if self._link_bandwidth is not None:
+                chunk_points = int(self._link_bandwidth*config._chunk_duration/datatype.itemsize)
+            else:
+                chunk_points = config._chunk_points
+        chunk_points = max(1, chunk_points)
+        start_time = time.time()
+        for i, source in enumerate(self._sources):
+            self.write(f":WAVeform:SOURce {source}")
+            if self._model_series in ['9000']:
+                self._read_windows_into(raw[i], datatype, chunk_points, max_retries)
+            else:
+                self._read_block_chunked_into(raw[i], datatype, chunk_points, max_retries)
+            if isinstance(raw, np.memmap):
+                raw.flush()
+        _log.debug(f"Elapsed time chunked read: {(time.time()-start_time)*1e3:.1f} ms")
+        if set_running:
+            self.run()
+        self._raw, self._metadata = raw, preambles
+        return raw, preambles
+
+    def _read_windows_into(self, out, datatype, chunk_points, max_retries):
+        """Read the current source in windows with ``:WAVeform:DATA? <start>,<size>``
+        (Infiniium), retrying failed windows"""
+        for start in range(0, len(out), chunk_points):
+            size = min(chunk_points, len(out)-start)
+            for attempt in range(max_retries+1):
+                try:
+                    # The start point is one-based
+                    values = self._inst.query_binary_values(f":WAVeform:DATA? {start+1},{size}",
+                                                            datatype=datatype.char,
+                                                            container=np.array)
+                    out[start:start+len(values)] = values
+                    break
+                except pyvisa.Error as err:
+                    if attempt == max_retries:
+                        raise
+                    _log.warning(f"Retrying points {start}-{start+size} after: {err}")
+                    self._inst.clear()
+
+    def _read_block_chunked_into(self, out, datatype, chunk_points, max_retries):
+        """Read the single ``:WAVeform:DATA?`` block of the current source in
+        chunks, each with its own timeout, retrying the source on failure"""
+        chunk_bytes = chunk_points*datatype.itemsize
+        view = out.view(np.uint8)
+        for attempt in range(max_retries+1):
+            try:
+                self._inst.write(':WAVeform:DATA?')
+                # IEEE 488.2 block header #<n><length>
+                head = self._inst.read_bytes(2)
+                length = int(self._inst.read_bytes(int(head[1:2])))
+                if length != view.nbytes:
+                    raise ValueError(f"Expected a block of {view.nbytes:,d} bytes, got {length:,d}")
+                for start in range(0, length, chunk_bytes):
+                    chunk = view[start:start+chunk_bytes]
+                    if hasattr(self._inst, 'read_into'):
+                        self._inst.read_into(chunk)
+                    else:
+                        chunk[:] = np.frombuffer(self._inst.read_bytes(len(chunk)), dtype=np.uint8)
+                # Termination character after the block
+                self._inst.read_bytes(1)
+                return
+            except pyvisa.Error as err:
+                if attempt == max_retries:
+                    raise
+                _log.warning(f"Retrying the transfer of the source after: {err}")
+                self._inst.clear()
+
+    ## Streaming acquisition ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def stream(self, n=None, channels=None, prefetch=0, drop_when_full=True):
+        """Generator yielding traces captured back to back with the current
+        acquisition settings.
+
+        The channels, waveform format and preambles are determined once at
+        the start, so that each trace only costs the acquisition and the
+        data transfer of each source. The oscilloscope is not set running
+        between the traces, but is set running when the stream ends.
+
+        The statistics of the stream are kept in the attribute
+        ``stream_stats``, a dict with ``'traces'`` (number yielded),
+        ``'dropped'`` (number discarded because the prefetch queue was full),
+        ``'elapsed'`` (seconds) and ``'rate'`` (yielded traces per second).
+
+        .. note:: The preambles are not queried again during the stream, do
+          not change the vertical or horizontal settings of the oscilloscope
+          while streaming.
+
+        .. warning:: With ``prefetch`` larger than zero the traces are
+          acquired in a background thread, do not communicate with the
+          oscilloscope otherwise until the stream has ended (i.e. the
+          generator is exhausted or closed).
+
+        Example
+        -------
+        ::
+
+            for time, values in scope.stream(n=1000, channels=[1, 3], prefetch=4):
+                process(time, values)
+            print(scope.stream_stats)
+
+        Parameters
+        ----------
+        n : int or ``None``, default ``None``
+            Number of traces to acquire, ``None`` streams until the generator
+            is closed
+        channels : list of ints or ``'active'``, uses oscilloscope setting by default
+            Optionally change the list of the channel numbers to be acquired,
+            see :meth:`set_channels_for_capture`
+        prefetch : int, default 0
+            Size of the queue of traces acquired ahead of the consumer in a
+            background thread. Zero acquires each trace when it is requested
+        drop_when_full : bool, default ``True``
+            Only applies when ``prefetch`` > 0. If ``True``: discard new traces
+            when the queue is full so that the acquisition is never held back
+            by the consumer, if ``False``: wait for room in the queue
+
+        Yields
+        ------
+        time : :class:`~numpy.ndarray`
+            Time axis for the measurement (the same array for all traces)
+        values : :class:`~numpy.ndarray`
+            Voltage values, each column represents one channel
+
+        Raises
+        ------
+        ValueError
+            If :attr:`wav_format` is not ``'WORD'`` or ``'BYTE'``
+        """
+        wav_format = self._wav_format_for_capture()[:3]
+        if wav_format not in ['WOR', 'BYT']:
+            raise ValueError(f"Streaming requires the waveform format 'WORD' or "
+                             f"'BYTE' (currently '{self._wav_format_used}')")
+        datatype = _DATATYPES[wav_format]
+        self.set_channels_for_capture(channels=channels)
+        # Capture one trace to get the preambles, used for all the traces
+        self.arm()
+        self.wait_for_acquisition()
+        preambles = []
+        for source in self._sources:
+            self.write(f":WAVeform:SOURce {source}")
+            preambles.append(self.query(':WAVeform:PREamble?'))
+        num_points = int(float(preambles[0].split(',')[2]))
+        time_axis, (yIncr, yOrig, yRef) = dataprocessing._scaling_from_preambles(preambles, num_points)
+        self._metadata = preambles
+        self.stream_stats = {'traces': 0, 'dropped': 0, 'elapsed': 0., 'rate': 0.}
+        first_trace = True
+
+        def acquire():
+            """Acquire and read out one trace of raw data"""
+            nonlocal first_trace
+            # The trace used for obtaining the preambles is the first trace
+            if first_trace:
+                first_trace = False
+            else:
+                self.arm()
+                self.wait_for_acquisition()
+            raw = np.empty((len(self._sources), num_points), dtype=datatype)
+            for i, source in enumerate(self._sources):
+                self.write(f":WAVeform:SOURce {source}")
+                self._read_block_into(raw[i], datatype)
+            self._periodic_error_check()
+            return raw
+
+        start_time = time.perf_counter()
+        stop = threading.Event()
+        if prefetch > 0:
+            traces = queue.Queue(maxsize=prefetch)
+
+            def producer():
+                """Fill the queue until n traces are queued or stopped"""
+                try:
+                    num_queued = 0
+                    while not stop.is_set() and (n is None or num_queued < n):
+                        raw = acquire()
+                        if drop_when_full:
+                            try:
+                                traces.put_nowait(raw)
+                                num_queued += 1
+                            except queue.Full:
+                                self.stream_stats['dropped'] += 1
+                        else:
+                            while not stop.is_set():
+                                try:
+                                    traces.put(raw, timeout=0.1)
+                                    num_queued += 1
+                                    break
+                                except queue.Full:
+                                    pass
+                except Exception as err:
+                    traces.put(err)
+                    return
+                traces.put(None)
+
+            thread = threading.Thread(target=producer, daemon=True)
+            thread.start()
+            get_raw = traces.get
+        else:
+            thread = None
+            get_raw = acquire
+        try:
+            while n is None or self.stream_stats['traces'] < n:
+                raw = get_raw()
+                if raw is None:
+                    break
+                if isinstance(raw, Exception):
+                    raise raw
+                self._raw = raw
+                self._time = time_axis
+                self._values = ((raw-yRef)*yIncr + yOrig).T
+                if self.publisher is not None:
+                    self.publisher.publish_scope(self)
+                self.stream_stats['traces'] += 1
+                elapsed = time.perf_counter()-start_time
+                self.stream_stats['elapsed'] = elapsed
+                self.stream_stats['rate'] = self.stream_stats['traces']/elapsed
+                yield self._time, self._values
+        finally:
+            stop.set()
+            if thread is not None:
+                # Make room in the queue in case the producer is waiting
+                while thread.is_alive():
+                    try:
+                        traces.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                thread.join()
+            self.run()
+            if self.verbose_acquistion:
+                print(f"Streamed {self.stream_stats['traces']} traces at "
+                      f"{self.stream_stats['rate']:.2f} traces/s "
+                      f"({self.stream_stats['dropped']} dropped)")
+
+    ## On-instrument measurements ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def compile_measurements(self, measurements, max_per_query=config._measurements_per_query):
+        """Build the compound ``:MEASure`` queries for a list of measurements,
+        to be used with :meth:`measure` when the same measurements are made
+        repeatedly.
+
+        Parameters
+        ----------
+        measurements : list of tuples
+            ``(measurement, source)`` pairs, where ``measurement`` is the name
+            of a ``:MEASure`` query, e.g. ``'FREQuency'``, ``'VPP'`` or
+            ``'RISetime'``, and ``source`` is a channel number, a source name
+            (e.g. ``'MATH'``), a tuple of these for measurements between two
+            sources (e.g. ``('DELay', (1, 2))``), or ``None`` for the default
+            source of the oscilloscope
+        max_per_query : int, default :data:`~keyoscacquire.config._measurements_per_query`
+            Maximum number of queries in each compound query
+
+        Returns
+        -------
+        list of str
+            The compound queries, each giving a reply with up to
+            ``max_per_query`` values separated by ``;``
+        """
+        queries = []
+        for measurement, source in measurements:
+            if source is None:
+                queries.append(f":MEASure:{measurement}?")
+                continue
+            if not isinstance(source, (tuple, list)):
+                source = [source]
+            source = ",".join(f"CHANnel{src}" if isinstance(src, int) else src
+                              for src in source)
+            queries.append(f":MEASure:{measurement}? {source}")
+        return [";".join(queries[i:i+max_per_query])
+                for i in range(0, len(queries), max_per_query)]
+
+    def measure(self, measurements, max_per_query=config._measurements_per_query):
+        """Make several measurements on the oscilloscope with one round trip
+        per ``max_per_query`` measurements.
+
+        The measurements are made on the current acquisition, stop the
+        oscilloscope first to measure all on the same trace.
+
+        Example
+        -------
+        ::
+
+            values = scope.measure([('FREQuency', 1), ('VPP', 1), ('VPP', 2),
+                                    ('DELay', (1, 2))])
+
+        Parameters
+        ----------
+        measurements : list of tuples or list of str
+            ``(measurement, source)`` pairs, see :meth:`compile_measurements`,
+            or the compound queries returned by :meth:`compile_measurements`
+        max_per_query : int, default :data:`~keyoscacquire.config._measurements_per_query`
+            Maximum number of queries in each compound query
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            The measured values in the order of ``measurements``, ``nan``
+            for measurements the oscilloscope could not make
+        """
+        if measurements and not isinstance(measurements[0], str):
+            measurements = self.compile_measurements(measurements, max_per_query)
+        values = []
+        for command in measurements:
+            replies = visa_utils.split_compound_reply(self.query(command, action="measuring"))
+            values.extend(self._parse_measurement(reply) for reply in replies)
+        return np.array(values)
+
+    @staticmethod
+    def _parse_measurement(reply):
+        """Measurement reply to float, ``nan`` if no measurement was made"""
+        try:
+            value = float(reply)
+        except ValueError:
+            _log.warning(f"Could not parse the measurement reply '{reply}'")
+            return np.nan
+        return np.nan if value >= _NO_MEASUREMENT else value
+
+    def poll_measurements(self, measurements, interval, n=None,
+                          max_per_query=config._measurements_per_query):
+        """Generator making the same measurements at a fixed rate.
+
+        The compound queries are built once. The polls are scheduled on a
+        monotonic clock at multiples of ``interval`` from the start, so that
+        the rate does not drift with the time taken by each poll. Polls that
+        would start more than one interval late are skipped and counted in
+        ``measurement_stats['missed']``.
+
+        Example
+        -------
+        ::
+
+            pairs = [('FREQuency', 1), ('VRMS', 1), ('VRMS', 2)]
+            for timestamp, values in scope.poll_measurements(pairs, interval=0.1, n=600):
+                log(timestamp, values)
+
+        Parameters
+        ----------
+        measurements : list of tuples
+            ``(measurement, source)`` pairs, see :meth:`compile_measurements`
+        interval : float
+            Seconds between the polls
+        n : int or ``None``, default ``None``
+            Number of polls, ``None`` polls until the generator is closed
+        max_per_query : int, default :data:`~keyoscacquire.config._measurements_per_query`
+            Maximum number of queries in each compound query
+
+        Yields
+        ------
+        timestamp : float
+            Host time (:func:`time.time`) at the start of the poll
+        values : :class:`~numpy.ndarray`
+            The measured values in the order of ``measurements``
+        """
+        commands = self.compile_measurements(measurements, max_per_query)
+        self.measurement_stats = {'polls': 0, 'missed': 0}
+        start = time.monotonic()
+        slot = 0
+        while n is None or self.measurement_stats['polls'] < n:
+            delay = start + slot*interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay > interval:
+                # More than one interval late: skip to the next slot in the future
+                missed = int(-delay // interval)
+                self.measurement_stats['missed'] += missed
+                slot += missed
+                continue
+            timestamp = time.time()
+            values = self.measure(commands)
+            self.measurement_stats['polls'] += 1
+            slot += 1
+            yield timestamp, values
+
+    ## Setup snapshots ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+    def _setup_path(self, name):
+        """Path of the cached setup ``name`` for this model and serial"""
+        instrument = re.sub(r'[^\w.-]', '_', f"{self._model}_{self._serial}")
+        return os.path.join(config._cache_dir, _SETUP_CACHE_DIR, instrument,
+                            re.sub(r'[^\w.-]', '_', name)+".set")
+
+    def save_setup(self, name):
+        """Save the complete setup of the oscilloscope (including timebase,
+        trigger and channel settings) as the binary ``:SYSTem:SETup?`` block
+        in the setup cache, see :meth:`restore_setup()`.
+
+        The setups are stored in
+        ``<config._cache_dir>/setups/<model>_<serial>/<name>.set``, so that a
+        setup is only restored to the instrument it was saved from.
+
+        Parameters
+        ----------
+        name : str
+            Name of the setup, overwritten if it exists
+
+        Returns
+        -------
+        str
+            Path of the saved setup
+        """
+        setup = bytes(self._inst.query_binary_values(':SYSTem:SETup?', datatype='B',
+                                                      container=bytearray))
+        path = self._setup_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(setup)
+        self._setup_hash = hashlib.sha256(setup).hexdigest()
+        _log.debug(f"Setup '{name}' ({len(setup)} bytes) saved to {path}")
+        return path
+
+    def restore_setup(self, name, force=False):
+        """Restore a setup saved with :meth:`save_setup()` in one binary
+        ``:SYSTem:SETup`` transfer.
+
+        The restore is skipped if the setup is the one most recently saved or
+        restored and no command that may change the setup has been written
+        since. Changes made on the front panel are not detected, use
+        ``force=True`` in that case.
+
+        Parameters
+        ----------
+        name : str
+            Name of the setup
+        force : bool, default ``False``
+            Restore the setup even if it seems to be applied already
+
+        Returns
+        -------
+        bool
+            ``True`` if the setup was transferred, ``False`` if it was skipped
+
+        Raises
+        ------
+        FileNotFoundError
+            If no setup ``name`` is saved for this model and serial
+        """
+        path = self._setup_path(name)
+        with open(path, 'rb') as f:
+            setup = f.read()
+        setup_hash = hashlib.sha256(setup).hexdigest()
+        if setup_hash == self._setup_hash and not force:
+            _log.debug(f"Setup '{name}' is already applied")
+            return False
+        self._inst.write_binary_values(':SYSTem:SETup ', setup, datatype='B')
+        self.query('*OPC?', action=f"restoring the setup '{name}'")
+        # The setup includes the waveform settings that are assumed by the
+        # binary reads, and may have changed the channels and waveform format
+        self.write(':WAVeform:UNSigned OFF')
+        self.write(':WAVeform:BYTeorder LSBFirst')
+        self._read_cache_data.clear()
+        self._wav_format_used = None
+        self._setup_hash = setup_hash
+        if self.verbose:
+            print(f"Restored the setup '{name}'")
+        return True
+
     ## Building functions to get a trace and various option setting and processing ##
 
-    def get_trace(self, channels=None, verbose_acquistion=None):
+    def get_trace(self, channels=None, verbose_acquistion=None, set_running=True):
         """Obtain one trace with current settings. Will return the values
         of the traces, but alos populate a few attributes, including
         ``_time``, ``_values`` and ``_capture_channels``.
@@ -774,6 +1977,10 @@ class Oscilloscope:
             currently active channels on the oscilloscope.
         verbose_acquistion : bool or ``None``, default ``None``
             Optionally change :attr:`verbose_acquistion`
+        set_running : bool, default ``True``
+            ``True`` leaves oscilloscope running after data capture, ``False``
+            leaves it stopped so that the same trace can be read again (from
+            memory if :attr:`read_cache` is ``True``)
 
         Returns
         -------
@@ -790,9 +1997,23 @@ class Oscilloscope:
             self.verbose_acquistion = verbose_acquistion
         self.set_channels_for_capture(channels=channels)
         # Capture, read and process data
-        self.capture_and_read()
-        self._time, self._values = dataprocessing.process_data(self._raw, self._metadata, self.wav_format,
-                                                               verbose_acquistion=self.verbose_acquistion)
+        self.capture_and_read(set_running=set_running)
+        return self._process_trace()
+
+    def _process_trace(self):
+        """Process the data read by :meth:`capture_and_read` to ``_time`` and
+        ``_values``, publish it and check the error queue, see :meth:`get_trace`"""
+        if self._sources:
+            self._time, self._values = dataprocessing.process_data(self._raw, self._metadata, self._wav_format_used,
+                                                                   verbose_acquistion=self.verbose_acquistion)
+        else:
+            # Only digital pods, which are kept packed (see get_digital)
+            self._time, _ = dataprocessing._scaling_from_preambles(self._digital_metadata,
+                                                                   self._digital_raw.shape[0])
+            self._values = np.empty((len(self._time), 0))
+        if self.publisher is not None:
+            self.publisher.publish_scope(self)
+        self._periodic_error_check()
         return self._time, self._values, self._capture_channels
 
     def set_options_get_trace(self, channels=None, wav_format=None, acq_type=None,
@@ -805,7 +2026,7 @@ class Oscilloscope:
             list of the channel numbers to be acquired, example ``[1, 3]``.
             Use ``'active'`` or ``[]`` to capture all the currently active
             channels on the oscilloscope.
-        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``}, default :data:`~keyoscacquire.config._waveform_format`
+        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``, ``'AUTO'``}, default :data:`~keyoscacquire.config._waveform_format`
             Select the format of the communication of waveform from the
             oscilloscope, see :attr:`wav_format`
         acq_type : {``'HRESolution'``, ``'NORMal'``, ``'AVERage'``, ``'AVER<m>'``}, default :data:`~keyoscacquire.config._acq_type`
@@ -860,7 +2081,7 @@ class Oscilloscope:
             list of the channel numbers to be acquired, example ``[1, 3]``.
             Use ``'active'`` or ``[]`` to capture all the currently active
             channels on the oscilloscope.
-        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``}, default :data:`~keyoscacquire.config._waveform_format`
+        wav_format : {``'WORD'``, ``'BYTE'``, ``'ASCii'``, ``'AUTO'``}, default :data:`~keyoscacquire.config._waveform_format`
             Select the format of the communication of waveform from the
             oscilloscope, see :attr:`wav_format`
         acq_type : {``'HRESolution'``, ``'NORMal'``, ``'AVERage'``, ``'AVER<m>'``}, default :data:`~keyoscacquire.config._acq_type`
@@ -902,7 +2123,9 @@ class Oscilloscope:
 
         .. note:: If ``additional_line`` is not supplied the fileheader will
           be four lines. If ``timestamp=False`` the timestamp line will not
-          be present.
+          be present. If the :attr:`wav_format` is ``'AUTO'``, a line
+          ``wav_format,<format>,AUTO`` with the format used follows the
+          ``<mode>,<averages>`` line.
 
         Parameters
         ----------
@@ -937,6 +2160,9 @@ class Oscilloscope:
         # Set num averages only if AVERage mode
         num_averages = self.num_averages if self.acq_type[:3] == 'AVE' else "N/A"
         mode_line = f"{self.acq_type},{num_averages}\n"
+        # Record the format chosen in the AUTO mode
+        if self._auto_wav_format:
+            mode_line += f"wav_format,{self._wav_format_used},AUTO\n"
         # Set timestamp if called for
         timestamp_line = str(dt.datetime.now())+"\n" if timestamp else ""
         # Set addtional line if called for
@@ -981,11 +2207,19 @@ class Oscilloscope:
                 self.ext = self.fname[-4:]
                 self.fname = self.fname[:-4]
             self.fname = fileio.check_file(self.fname, self.ext)
-            fileio.plot_trace(self._time, self._values, self._capture_channels, fname=self.fname,
+            values, channels, labels = self._values, self._capture_channels, None
+            if values.ndim == 3:
+                # Segments from get_segmented_traces()
+                values, channels, labels = dataprocessing._segments_as_columns(values, channels)
+            fileio.plot_trace(self._time, values, channels, fname=self.fname,
                                showplot=self.showplot, savepng=self.savepng)
-            head = self.generate_file_header(additional_line=additional_header_info)
-            fileio.save_trace(self.fname, self._time, self._values, fileheader=head, ext=self.ext,
+            head = self.generate_file_header(channels=labels, additional_line=additional_header_info)
+            fileio.save_trace(self.fname, self._time, values, fileheader=head, ext=self.ext,
                               print_filename=self.verbose_acquistion, nowarn=nowarn)
+            if self._digital_raw is not None:
+                time, packed, pods = self.get_digital()
+                fileio.save_digital(self.fname+"_digital", time, packed, pods,
+                                    rle=self.digital_rle, print_filename=self.verbose_acquistion)
         else:
             print("(!) No trace has been acquired yet, use get_trace()")
             _log.info("(!) No trace has been acquired yet, use get_trace()")
@@ -993,8 +2227,10 @@ class Oscilloscope:
     def plot_trace(self):
         """Plot and show the most recent trace"""
         if not self._time is None:
-            fileio.plot_trace(self._time, self._values, self._capture_channels,
-                              savepng=False, showplot=True)
+            values, channels = self._values, self._capture_channels
+            if values.ndim == 3:
+                values, channels, _ = dataprocessing._segments_as_columns(values, channels)
+            fileio.plot_trace(self._time, values, channels, savepng=False, showplot=True)
         else:
             print("(!) No trace has been acquired yet, use get_trace()")
             _log.info("(!) No trace has been acquired yet, use get_trace()")
@@ -13,6 +13,7 @@ integrated in python scripts or used as examples.
 
 import os
 import sys
+import time
 import pyvisa
 import logging
 import numpy as np
@@ -22,23 +23,27 @@ import keyoscacquire.oscilloscope as oscilloscope
 import keyoscacquire.config as config
 import keyoscacquire.fileio as fileio
 import keyoscacquire.visa_utils as visa_utils
+import keyoscacquire.dataprocessing as dataprocessing
 
 _log = logging.getLogger(__name__)
 
-def list_visa_devices(ask_idn=True):
+def list_visa_devices(ask_idn=True, use_cache=True):
     """Prints a list of the VISA instruments connected to the computer,
-    including their addresses."""
+    including their addresses.
+
+    The instruments are probed concurrently, and the results are cached on
+    disk for :data:`~keyoscacquire.config._discovery_cache_ttl` seconds so
+    that repeated listings are quick. Set ``use_cache=False`` to probe all
+    the instruments again."""
     rm = pyvisa.ResourceManager()
-    resources = rm.list_resources()
+    resources = list(rm.list_resources())
     if len(resources) == 0:
         print("\nNo VISA devices found!")
         return
     print(f"\nFound {len(resources)} resources. Now obtaining information about them..")
-    information = []
-    # Loop through resources to learn more about them
-    for i, address in enumerate(resources):
-        current_resource_info = visa_utils.obtain_instrument_information(rm, address, i, ask_idn)
-        information.append(current_resource_info)
+    # Probe the resources to learn more about them
+    information = visa_utils.discover_instruments(rm, resources, ask_idn=ask_idn,
+                                                  use_cache=use_cache)
     if ask_idn:
         # transpose to lists of property
         nums, addrs, aliases, makers, models, serials, firmwares, model_series = (list(category) for category in zip(*information))
@@ -156,9 +161,20 @@ def get_num_traces(fname=config._filename, ext=config._filetype, num=1,
                    wav_format=config._waveform_format, channels=None,
                    acq_type=config._acq_type, num_averages=None,
                    p_mode=config._p_mode, num_points=config._num_points,
-                   start_num=0, file_delim=config._file_delimiter):
+                   start_num=0, file_delim=config._file_delimiter,
+                   statistics=False, outlier_sigma=None, trace_filter=None):
     """This program connects to the oscilloscope, sets options for the
     acquisition, and captures and stores 'num' traces.
+
+    With the statistics option, the traces are not stored, but the mean,
+    standard deviation, minimum and maximum of each point are accumulated
+    and only these summary traces are stored to '<fname>_statistics'.
+    Traces deviating more than 'outlier_sigma' from the mean can be rejected.
+
+    With a 'trace_filter' (a keyoscacquire.dataprocessing.TraceFilter), only
+    the traces with an event are used for the statistics or stored, cut to
+    the window around the event if the filter has a window. The files keep
+    the number of the capture, and the number of traces kept is printed.
     """
     with oscilloscope.Oscilloscope(address=address, timeout=timeout) as scope:
         scope.set_acquiring_options(wav_format=wav_format, acq_type=acq_type,
@@ -169,15 +185,147 @@ def get_num_traces(fname=config._filename, ext=config._filetype, num=1,
         scope.set_channels_for_capture(channels=channels)
         scope.print_acq_settings()
         n = start_num
-        fnum = file_delim+str(n)
+        fnum = "_statistics" if statistics else file_delim+str(n)
         # Check that file does not exist from before, append to name if it does
         fname = fileio.check_file(fname, ext, num=fnum)
+        if statistics:
+            stats = dataprocessing.TraceStatistics(outlier_sigma=outlier_sigma)
         for i in tqdm(range(n, n+num)):
             try:
-                fnum = file_delim+str(i)
-                scope.get_trace()
-                scope.save_trace(fname+fnum)
+                header = None
+                if trace_filter is None:
+                    scope.get_trace()
+                else:
+                    event = _get_filtered_trace(scope, trace_filter)
+                    if event is None:
+                        continue
+                    header = f"event at {np.ravel(scope._time)[event]:.6g} s"
+                if statistics:
+                    stats.update(scope._values, time=scope._time)
+                else:
+                    if trace_filter is not None:
+                        scope._time, scope._values = trace_filter.cut(scope._time, scope._values, event)
+                    fnum = file_delim+str(i)
+                    scope.save_trace(fname+fnum, additional_header_info=header)
             except KeyboardInterrupt:
                 print("Stopping the programme")
-                return
+                break
+        if trace_filter is not None:
+            print(f"Kept {trace_filter.num_matched} of {trace_filter.num_examined} traces with events")
+        if statistics and stats.count > 0:
+            _save_statistics(scope, stats, fname+fnum, ext)
     print("Done")
+
+
+def get_periodic_traces(fname=config._filename, ext=config._filetype, interval=1., num=None,
+                        address=config._visa_address, timeout=config._timeout,
+                        wav_format=config._waveform_format, channels=None,
+                        acq_type=config._acq_type, num_averages=None,
+                        p_mode=config._p_mode, num_points=config._num_points,
+                        start_num=0, file_delim=config._file_delimiter):
+    """This program connects to the oscilloscope, sets options for the
+    acquisition, and captures and stores a trace every 'interval' seconds
+    until 'num' traces are stored or ctrl-c is pressed.
+
+    The captures are scheduled on a monotonic clock at multiples of
+    'interval' from the start, so that the rate does not drift with the time
+    taken by each capture. A capture that would start more than one interval
+    late is skipped (not queued) and counted as missed. The host time and
+    the lateness of each capture are logged to '<fname>_schedule.csv', and
+    the achieved rate, the jitter and the number of missed slots are printed
+    at the end.
+    """
+    with oscilloscope.Oscilloscope(address=address, timeout=timeout) as scope:
+        scope.set_acquiring_options(wav_format=wav_format, acq_type=acq_type,
+                                   num_averages=num_averages, p_mode=p_mode,
+                                   num_points=num_points)
+        scope.ext = ext
+        scope.verbose_acquistion = False
+        scope.set_channels_for_capture(channels=channels)
+        scope.print_acq_settings()
+        n = start_num
+        # Check that file does not exist from before, append to name if it does
+        fname = fileio.check_file(fname, ext, num=f"{file_delim}{n}")
+        # Nor overwrite the schedule log of a previous run (the traces are
+        # checked again when saved)
+        fname = fileio.check_file(fname, ".csv", num="_schedule")
+        print(f"Capturing a trace every {interval} s to {fname}{file_delim}<n>{ext}, "
+               "press ctrl-c to stop")
+        lateness, timestamps = [], []
+        missed = 0
+        slot = 0
+        with open(fname+"_schedule.csv", 'w') as log:
+            log.write("# trace,slot,host time (s),lateness (s)\n")
+            start = time.monotonic()
+            try:
+                while num is None or len(timestamps) < num:
+                    delay = start + slot*interval - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    elif -delay > interval:
+                        # More than one interval late: skip to the next slot in the future
+                        missed += int(-delay // interval)
+                        slot += int(-delay // interval)
+                        continue
+                    late = time.monotonic() - (start + slot*interval)
+                    timestamp = time.time()
+                    scope.get_trace()
+                    scope.save_trace(f"{fname}{file_delim}{n}",
+                                     additional_header_info=f"slot {slot}, host time {timestamp:.6f}")
+                    log.write(f"{n},{slot},{timestamp:.6f},{late:.6f}\n")
+                    log.flush()
+                    lateness.append(late)
+                    timestamps.append(timestamp)
+                    n += 1
+                    slot += 1
+            except KeyboardInterrupt:
+                print("Stopping the programme")
+    _print_schedule_report(interval, timestamps, lateness, missed)
+    print("Done")
+
+
+def _get_filtered_trace(scope, trace_filter):
+    """Capture a trace and find its event with the
+    :class:`~keyoscacquire.dataprocessing.TraceFilter`. With a binary
+    waveform format the event is found in the raw integers, and only the
+    traces with an event are processed to voltages.
+    Returns the index of the event, ``None`` if there is no event"""
+    scope.set_channels_for_capture()
+    scope.capture_and_read()
+    if scope._sources and scope._wav_format_used[:3] in ['WOR', 'BYT']:
+        event = trace_filter.match_raw(scope._raw, scope._metadata, scope._capture_channels)
+        if event is None:
+            # Still counts towards the periodic error check
+            scope._periodic_error_check()
+            return None
+        scope._process_trace()
+        return event
+    scope._process_trace()
+    return trace_filter.match(scope._time, scope._values, scope._capture_channels)
+
+
+def _print_schedule_report(interval, timestamps, lateness, missed):
+    """Print the achieved rate, the jitter and the missed slots of
+    :func:`get_periodic_traces`"""
+    print(f"Captured {len(timestamps)} traces, {missed} slots missed")
+    if len(timestamps) > 1:
+        rate = (len(timestamps)-1)/(timestamps[-1]-timestamps[0])
+        print(f"Achieved rate {rate:.4g} traces/s (scheduled {1/interval:.4g} traces/s)")
+    if lateness:
+        lateness = np.array(lateness)
+        print(f"Start jitter {lateness.std()*1e3:.3g} ms rms, "
+              f"{lateness.max()*1e3:.3g} ms maximum lateness")
+
+
+def _save_statistics(scope, stats, fname, ext):
+    """Save the summary traces of a :class:`~keyoscacquire.dataprocessing.TraceStatistics`
+    with the file header of the oscilloscope, and plot the mean"""
+    print(f"Accumulated statistics of {stats.count} traces ({stats.rejected} rejected)")
+    time, summary = stats.summary()
+    channels = scope._capture_channels
+    fileio.plot_trace(time, stats.mean, channels, fname=fname,
+                      showplot=scope.showplot, savepng=scope.savepng)
+    head = scope.generate_file_header(channels=stats.summary_column_names(channels),
+                                      additional_line=(f"statistics of {stats.count} traces, "
+                                                       f"{stats.rejected} rejected as outliers"))
+    fileio.save_trace(fname, time, summary, fileheader=head, ext=ext)
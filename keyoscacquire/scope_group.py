@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Synchronised acquisition from several oscilloscopes
+
+:class:`ScopeGroup` holds connections to several oscilloscopes, and sends
+settings, arms and reads out all of them concurrently with one thread per
+instrument, so that the cycle time does not grow with the number of
+oscilloscopes.
+"""
+
+import logging
+import datetime as dt
+import concurrent.futures
+import numpy as np
+
+import keyoscacquire.config as config
+import keyoscacquire.fileio as fileio
+import keyoscacquire.oscilloscope as oscilloscope
+
+_log = logging.getLogger(__name__)
+
+
+class ScopeGroup:
+    """Several oscilloscopes operated together.
+
+    Example
+    -------
+    ::
+
+        with ScopeGroup(['USB0::1234::1234::MY1234567::INSTR',
+                         'TCPIP0::192.168.1.10::5025::SOCKET']) as group:
+            group.set_acquiring_options(acq_type='AVER8')
+            for i in range(10):
+                traces = group.get_traces()
+                group.save_traces(f"capture{i}")
+
+    Parameters
+    ----------
+    addresses : list of str
+        Visa addresses of the instruments
+    timeout : int, default :data:`~keyoscacquire.config._timeout`
+        Milliseconds before timeout on the channel to the instruments
+    **kwargs
+        Other arguments to :class:`~keyoscacquire.oscilloscope.Oscilloscope`,
+        used for all the instruments
+
+    Attributes
+    ----------
+    scopes : list of :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+        The oscilloscopes in the group
+    fname : str, default :data:`keyoscacquire.config._filename`
+        The filename to which the traces will be saved with :meth:`save_traces()`
+    ext : str, default :data:`keyoscacquire.config._filetype`
+        The extension for saving traces, ``'.csv'`` or ``'.npy'``
+    _capture_index : int
+        Number of captures made with :meth:`get_traces`, the index of the
+        most recent capture is ``_capture_index-1``
+    _traces : list of tuples
+        ``(time, values, channels)`` of each oscilloscope for the most recent
+        capture
+    """
+    fname = config._filename
+    ext = config._filetype
+    _capture_index = 0
+    _traces = None
+
+    def __init__(self, addresses, timeout=config._timeout, **kwargs):
+        """See class docstring"""
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(addresses), thread_name_prefix="keyoscacquire-group")
+        futures = [self._executor.submit(oscilloscope.Oscilloscope, address=address,
+                                         timeout=timeout, **kwargs)
+                   for address in addresses]
+        self.scopes = []
+        try:
+            for future in futures:
+                self.scopes.append(future.result())
+        except Exception:
+            # Close the connections that were made before failing
+            for future in futures:
+                if future.exception() is None:
+                    future.result().close(set_running=False)
+            self._executor.shutdown()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(set_running=exc_type is None)
+
+    def __len__(self):
+        return len(self.scopes)
+
+    def map(self, function, *args, **kwargs):
+        """Call ``function(scope, *args, **kwargs)`` for all the oscilloscopes
+        concurrently, one thread per oscilloscope
+
+        Returns
+        -------
+        list
+            The return values in the order of :attr:`scopes`
+        """
+        futures = [self._executor.submit(function, scope, *args, **kwargs)
+                   for scope in self.scopes]
+        return [future.result() for future in futures]
+
+    def apply(self, method, *args, **kwargs):
+        """Call the :class:`~keyoscacquire.oscilloscope.Oscilloscope` method
+        named ``method`` with the same arguments for all the oscilloscopes
+        concurrently, e.g. ``group.apply('set_acquiring_options', num_points=2000)``
+
+        Returns
+        -------
+        list
+            The return values in the order of :attr:`scopes`
+        """
+        return self.map(lambda scope: getattr(scope, method)(*args, **kwargs))
+
+    def close(self, set_running=True):
+        """Close the connections to all the oscilloscopes, see
+        :meth:`Oscilloscope.close`"""
+        try:
+            self.map(lambda scope: scope.close(set_running=set_running))
+        finally:
+            self._executor.shutdown()
+
+    def set_acquiring_options(self, **kwargs):
+        """Set the same acquiring options on all the oscilloscopes, see
+        :meth:`Oscilloscope.set_acquiring_options`"""
+        self.apply('set_acquiring_options', **kwargs)
+
+    def set_channels_for_capture(self, channels='active'):
+        """Decide the channels to be acquired on each oscilloscope
+
+        Parameters
+        ----------
+        channels : list of ints, ``'active'``, or list of these
+            The same channels for all oscilloscopes, or one item for each
+            oscilloscope, e.g. ``[[1, 3], 'active']``,
+            see :meth:`Oscilloscope.set_channels_for_capture`
+
+        Returns
+        -------
+        list of lists of ints
+            The channels that will be captured on each oscilloscope
+        """
+        if (isinstance(channels, (list, tuple)) and len(channels) == len(self.scopes)
+                and all(isinstance(ch, (list, tuple, str)) or ch is None for ch in channels)):
+            futures = [self._executor.submit(scope.set_channels_for_capture, channels=ch)
+                       for scope, ch in zip(self.scopes, channels)]
+            return [future.result() for future in futures]
+        return self.apply('set_channels_for_capture', channels=channels)
+
+    def get_traces(self, channels=None):
+        """Capture one trace on each oscilloscope.
+
+        All oscilloscopes are first armed (see :meth:`Oscilloscope.arm`), then
+        all are read out concurrently.
+
+        Parameters
+        ----------
+        channels : list of ints, ``'active'``, list of these, or ``None``
+            Optionally change the channels to be acquired,
+            see :meth:`set_channels_for_capture`
+
+        Returns
+        -------
+        list of tuples
+            ``(time, values, channels)`` for each oscilloscope in the order
+            of :attr:`scopes`, see :meth:`Oscilloscope.get_trace`
+        """
+        if channels is not None:
+            self.set_channels_for_capture(channels)
+        # Arm all before reading out any, so the acquisitions start together
+        self.map(lambda scope: scope.arm() if scope.is_running() else None)
+        self._traces = self.map(lambda scope: scope.get_trace(channels=scope._capture_channels))
+        self._capture_index += 1
+        return self._traces
+
+    def generate_file_header(self, additional_line=None):
+        """File header for :meth:`save_traces`: the header lines of each
+        oscilloscope (see :meth:`Oscilloscope.generate_file_header`), a
+        line with the capture index and a timestamp, and the column names
+        on the form ``<serial> time,<serial> <ch>,...``
+
+        Returns
+        -------
+        str
+            string to be used as file header
+        """
+        lines, columns = [], []
+        for scope, (_, _, channels) in zip(self.scopes, self._traces):
+            header = scope.generate_file_header(channels=channels, timestamp=False)
+            lines.extend(header.split("\n")[:-1])
+            columns.extend([f"{scope._serial} time"]+[f"{scope._serial} {ch}" for ch in channels])
+        lines.append(f"capture {self._capture_index-1},{dt.datetime.now()}")
+        if additional_line is not None:
+            lines.append(additional_line)
+        lines.append(",".join(columns))
+        return "\n".join(lines)
+
+    def save_traces(self, fname=None, ext=None, additional_header_info=None):
+        """Save the most recent capture of all the oscilloscopes to one file,
+        with a time column followed by the channel columns for each
+        oscilloscope (see :meth:`generate_file_header`). Will check if the
+        filename exists, and let the user append to the fname if that is the
+        case.
+
+        Parameters
+        ----------
+        fname : str, default :attr:`fname`
+            Filename of the traces
+        ext : ``{'.csv', '.npy'}``, default :attr:`ext`
+            Choose the filetype of the saved file
+        additional_header_info : str, default ```None``
+            Will put this string as a separate line before the column headers
+
+        Raises
+        ------
+        ValueError
+            If the oscilloscopes captured different numbers of points
+        """
+        if self._traces is None:
+            print("(!) No traces have been acquired yet, use get_traces()")
+            return
+        if fname is not None:
+            self.fname = fname
+        if ext is not None:
+            self.ext = ext
+        if self.fname[-4:] in ['.npy', '.csv']:
+            self.fname, self.ext = self.fname[:-4], self.fname[-4:]
+        num_points = {len(time) for time, _, _ in self._traces}
+        if len(num_points) > 1:
+            raise ValueError(f"The oscilloscopes captured different numbers of points "
+                             f"{sorted(num_points)}, cannot save to one file")
+        columns = []
+        for time, values, _ in self._traces:
+            columns.extend([time, values])
+        data = np.hstack(columns)
+        self.fname = fileio.check_file(self.fname, self.ext)
+        head = self.generate_file_header(additional_line=additional_header_info)
+        fileio.save_trace(self.fname, data[:, :1], data[:, 1:], fileheader=head,
+                          ext=self.ext, print_filename=self.scopes[0].verbose_acquistion)
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory ring buffer for handing traces to other local processes
+
+:class:`TracePublisher` writes each trace, as voltage values or as raw
+integers with the preambles, into a ring of slots in a named
+:mod:`multiprocessing.shared_memory` block. :class:`TraceReader` attaches to
+the block from another process and reads the latest trace or follows every
+trace by its sequence number, optionally without copying the data.
+
+The publisher never waits for the readers: a slot is simply overwritten when
+the ring wraps around. Each slot carries the sequence number of the trace
+before and after the data (a sequence lock), so a reader can detect that a
+trace was overwritten while it was being read, and counts the traces it lost.
+
+Example
+-------
+In the acquisition process::
+
+    with Oscilloscope() as scope, TracePublisher("scope1") as publisher:
+        scope.publisher = publisher
+        for i in range(1000):
+            scope.get_trace()   # each trace is published
+
+In a viewer process::
+
+    with TraceReader("scope1") as reader:
+        for trace in reader.follow(every=False):
+            update_plot(trace.time, trace.values)
+"""
+
+import sys
+import time as time_module
+import logging
+import collections
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+import keyoscacquire.config as config
+import keyoscacquire.dataprocessing as dataprocessing
+
+_log = logging.getLogger(__name__)
+
+_MAGIC = 0x6b6f7363  # 'kosc'
+#: Header of the shared memory block
+_HEADER = np.dtype([('magic', 'u8'), ('num_slots', 'u8'), ('slot_size', 'u8'),
+                    ('sequence', 'u8')])
+#: Header of each slot, ``begin`` and ``end`` are the sequence number of the
+#: trace in the slot written before and after the data
+_SLOT_HEADER = np.dtype([('begin', 'u8'), ('end', 'u8'), ('dtype', 'S8'),
+                         ('rows', 'u8'), ('columns', 'u8'), ('timestamp', 'f8'),
+                         ('time_start', 'f8'), ('time_increment', 'f8'),
+                         ('preambles', f'S{config._shared_preamble_size}')])
+
+#: A trace read from the buffer. ``values`` are voltage values with one column
+#: per channel, or raw integers with one row per channel if ``preambles`` is
+#: not ``None``
+SharedTrace = collections.namedtuple('SharedTrace', ['sequence', 'timestamp', 'time',
+                                                     'values', 'preambles'])
+
+
+def _slot_views(shm):
+    """Header, slot headers and slot data views of a shared memory block"""
+    header = np.ndarray((), dtype=_HEADER, buffer=shm.buf)
+    num_slots, slot_size = int(header['num_slots']), int(header['slot_size'])
+    stride = _SLOT_HEADER.itemsize + slot_size
+    slot_headers, slot_data = [], []
+    for i in range(num_slots):
+        offset = _HEADER.itemsize + i*stride
+        slot_headers.append(np.ndarray((), dtype=_SLOT_HEADER, buffer=shm.buf, offset=offset))
+        slot_data.append(shm.buf[offset+_SLOT_HEADER.itemsize:offset+stride])
+    return header, slot_headers, slot_data
+
+
+class TracePublisher:
+    """Publish traces to a shared memory ring buffer, see the module docstring.
+
+    The shared memory block is created at the first trace, with slots the
+    size of that trace unless ``slot_size`` is given.
+
+    Parameters
+    ----------
+    name : str, default :data:`~keyoscacquire.config._shared_memory_name`
+        Name of the shared memory block, used by the readers to attach
+    num_slots : int, default :data:`~keyoscacquire.config._shared_slots`
+        Number of traces kept in the ring
+    slot_size : int or ``None``, default ``None``
+        Bytes of data per slot, ``None`` uses the size of the first trace
+    raw : bool, default ``False``
+        Only applies to :meth:`publish_scope`: ``True`` publishes the raw
+        integers and preambles instead of the voltage values (for the
+        ``'BYTE'`` and ``'WORD'`` waveform formats)
+
+    Attributes
+    ----------
+    sequence : int
+        Sequence number of the most recent trace published, starting at one
+    skipped : int
+        Number of traces :meth:`publish_scope` could not publish (e.g. traces
+        larger than the slots)
+    """
+
+    def __init__(self, name=config._shared_memory_name, num_slots=config._shared_slots,
+                 slot_size=None, raw=False):
+        """See class docstring"""
+        self.name = name
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.raw = raw
+        self.sequence = 0
+        self.skipped = 0
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create(self, nbytes):
+        """Create the shared memory block with room for ``nbytes`` per slot"""
+        if self.slot_size is None:
+            self.slot_size = nbytes
+        size = _HEADER.itemsize + self.num_slots*(_SLOT_HEADER.itemsize+self.slot_size)
+        self._shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        header = np.ndarray((), dtype=_HEADER, buffer=self._shm.buf)
+        header['num_slots'], header['slot_size'] = self.num_slots, self.slot_size
+        header['sequence'] = 0
+        header['magic'] = _MAGIC
+        del header
+        self._header, self._slot_headers, self._slot_data = _slot_views(self._shm)
+        _log.debug(f"Created shared memory '{self.name}' of {size:,d} bytes")
+
+    def publish(self, values, time=None, preambles=None, timestamp=None):
+        """Write a trace to the next slot of the ring
+
+        Parameters
+        ----------
+        values : ~numpy.ndarray
+            Voltage values (one column per channel), or raw integers (one
+            row per channel) if ``preambles`` are given
+        time : ~numpy.ndarray or ``None``
+            Time axis, stored as its first value and increment. Not needed
+            with ``preambles``
+        preambles : list of str or ``None``
+            The preamble of each channel for raw integers, see :ref:`preamble`
+        timestamp : float or ``None``, default ``None``
+            Host time of the trace, :func:`time.time` if ``None``
+
+        Returns
+        -------
+        int
+            The sequence number of the trace
+
+        Raises
+        ------
+        ValueError
+            If the trace is larger than the slots or the preambles are too long
+        """
+        values = np.ascontiguousarray(values)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        if self._shm is None:
+            self._create(values.nbytes)
+        if values.nbytes > self.slot_size:
+            raise ValueError(f"The trace of {values.nbytes:,d} bytes does not fit "
+                             f"in the slots of {self.slot_size:,d} bytes")
+        preamble_str = b"" if preambles is None else ";".join(preambles).encode()
+        if len(preamble_str) > config._shared_preamble_size:
+            raise ValueError(f"The preambles are longer than {config._shared_preamble_size} bytes")
+        sequence = self.sequence + 1
+        slot = self._slot_headers[(sequence-1) % self.num_slots]
+        # Mark the slot as being written before touching the data
+        slot['begin'] = sequence
+        self._slot_data[(sequence-1) % self.num_slots][:values.nbytes] = values.reshape(-1).view(np.uint8)
+        slot['dtype'] = values.dtype.str.encode()
+        slot['rows'], slot['columns'] = values.shape
+        slot['timestamp'] = time_module.time() if timestamp is None else timestamp
+        if time is not None and preambles is None:
+            time = np.ravel(time)
+            slot['time_start'] = time[0]
+            slot['time_increment'] = time[1]-time[0] if time.size > 1 else 0.
+        slot['preambles'] = preamble_str
+        slot['end'] = sequence
+        self._header['sequence'] = sequence
+        self.sequence = sequence
+        return sequence
+
+    def publish_scope(self, scope):
+        """Publish the most recent trace of an
+        :class:`~keyoscacquire.oscilloscope.Oscilloscope`, as raw integers and
+        preambles if :attr:`raw` and the waveform format is binary, otherwise
+        as voltage values.
+
+        Used in the acquisition, so a trace that cannot be published (e.g.
+        larger than the slots, give a larger ``slot_size`` to avoid this) is
+        skipped with a warning in the log rather than raising
+
+        Returns
+        -------
+        int or ``None``
+            The sequence number of the trace, ``None`` if it was skipped
+        """
+        try:
+            if self.raw and isinstance(scope._metadata, list) and len(scope._raw):
+                return self.publish(np.asarray(scope._raw), preambles=scope._metadata)
+            return self.publish(scope._values, time=scope._time)
+        except ValueError as err:
+            self.skipped += 1
+            _log.warning(f"Trace not published to '{self.name}': {err}")
+            return None
+
+    def close(self, unlink=True):
+        """Close the shared memory, and remove it if ``unlink``"""
+        if self._shm is None:
+            return
+        self._header = self._slot_headers = self._slot_data = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+        self._shm = None
+
+
+class TraceReader:
+    """Read traces published by a :class:`TracePublisher`, see the module
+    docstring.
+
+    Parameters
+    ----------
+    name : str, default :data:`~keyoscacquire.config._shared_memory_name`
+        Name of the shared memory block
+    timeout : float, default 10
+        Seconds to wait for the publisher to create the shared memory block
+
+    Attributes
+    ----------
+    lost : int
+        Number of traces that were overwritten before :meth:`follow` read them
+
+    Raises
+    ------
+    FileNotFoundError
+        If the shared memory block has not been created within the timeout
+    """
+
+    def __init__(self, name=config._shared_memory_name, timeout=10):
+        """See class docstring"""
+        self.name = name
+        self.lost = 0
+        start = time_module.monotonic()
+        while True:
+            try:
+                self._shm = _attach(name)
+                break
+            except FileNotFoundError:
+                if time_module.monotonic()-start > timeout:
+                    raise
+                time_module.sleep(0.05)
+        self._header, self._slot_headers, self._slot_data = _slot_views(self._shm)
+        self.num_slots = len(self._slot_headers)
+        self._time_key, self._time = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def sequence(self):
+        """Sequence number of the most recent trace published"""
+        return int(self._header['sequence'])
+
+    def read(self, sequence, copy=True):
+        """Read the trace with the given sequence number
+
+        Parameters
+        ----------
+        sequence : int
+            Sequence number of the trace
+        copy : bool, default ``True``
+            If ``False``: the values are a view into the shared memory, which
+            will be overwritten when the ring wraps around. Check with
+            :meth:`is_valid` after using them
+
+        Returns
+        -------
+        :class:`SharedTrace` or ``None``
+            ``None`` if the trace has been overwritten or is being written
+        """
+        slot = self._slot_headers[(sequence-1) % self.num_slots]
+        if slot['end'] != sequence or slot['begin'] != sequence:
+            return None
+        rows, columns = int(slot['rows']), int(slot['columns'])
+        dtype = np.dtype(slot['dtype'].item().decode())
+        nbytes = rows*columns*dtype.itemsize
+        values = np.frombuffer(self._slot_data[(sequence-1) % self.num_slots][:nbytes],
+                               dtype=dtype).reshape(rows, columns)
+        preambles = slot['preambles'].item().decode()
+        preambles = preambles.split(';') if preambles else None
+        timestamp, time_start, time_increment = (float(slot[key]) for key in
+                                                 ['timestamp', 'time_start', 'time_increment'])
+        if copy:
+            values = values.copy()
+            if slot['begin'] != sequence:
+                # Overwritten while copying
+                return None
+        if preambles is None:
+            time = self._time_axis(rows, time_start, time_increment)
+        else:
+            time, _ = dataprocessing._scaling_from_preambles(preambles, columns)
+        return SharedTrace(sequence, timestamp, time, values, preambles)
+
+    def _time_axis(self, num_points, start, increment):
+        """Time axis, reused while it is unchanged"""
+        key = (num_points, start, increment)
+        if key != self._time_key:
+            self._time = (start + np.arange(num_points)*increment)[:, np.newaxis]
+            self._time_key = key
+        return self._time
+
+    def is_valid(self, trace):
+        """``True`` if the slot of ``trace`` has not been overwritten since
+        it was read (for traces read with ``copy=False``)"""
+        return self._slot_headers[(trace.sequence-1) % self.num_slots]['begin'] == trace.sequence
+
+    def latest(self, copy=True):
+        """The most recent trace, ``None`` if no trace has been published,
+        see :meth:`read`"""
+        while self.sequence > 0:
+            trace = self.read(self.sequence, copy=copy)
+            if trace is not None:
+                return trace
+            # Being written, let the publisher finish
+            time_module.sleep(1e-4)
+        return None
+
+    def follow(self, every=True, copy=True, poll_interval=config._poll_interval,
+               timeout=None):
+        """Generator yielding new traces as they are published
+
+        Parameters
+        ----------
+        every : bool, default ``True``
+            If ``True``: yield every trace in order, traces overwritten before
+            they were read are skipped and counted in :attr:`lost`. If
+            ``False``: only yield the most recent trace, skipping older ones
+        copy : bool, default ``True``
+            See :meth:`read`
+        poll_interval : float, default :data:`~keyoscacquire.config._poll_interval`
+            Seconds between checks for new traces
+        timeout : float or ``None``, default ``None``
+            Stop if no new trace has been published for this many seconds,
+            ``None`` follows until the generator is closed
+
+        Yields
+        ------
+        :class:`SharedTrace`
+        """
+        next_sequence = self.sequence + 1
+        last_new = time_module.monotonic()
+        while True:
+            latest = self.sequence
+            if latest < next_sequence:
+                if timeout is not None and time_module.monotonic()-last_new > timeout:
+                    return
+                time_module.sleep(poll_interval)
+                continue
+            last_new = time_module.monotonic()
+            if not every:
+                self.lost += latest - next_sequence
+                next_sequence = latest
+            trace = self.read(next_sequence, copy=copy)
+            next_sequence += 1
+            if trace is None:
+                self.lost += 1
+                continue
+            yield trace
+
+    def close(self):
+        """Detach from the shared memory. Views returned with ``copy=False``
+        must be deleted first"""
+        self._header = self._slot_headers = self._slot_data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            _log.warning("Could not close the shared memory, views into it still exist")
+
+
+def _attach(name):
+    """Attach to an existing shared memory block without registering it with
+    the resource tracker, which would otherwise remove the block when this
+    (reading) process exits"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps with minimal reconfiguration of the oscilloscope
+
+:class:`ParameterSweep` captures a number of traces at each point of a grid
+of acquisition settings and channels, using
+:meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_options_get_trace`.
+
+* The points are ordered so that the most expensive settings (e.g.
+  ``p_mode``, which stops the oscilloscope) change as rarely as possible, and
+  so that only one setting changes from one point to the next (a reflected
+  Gray code order of the grid)
+* Only the settings that differ from the previous point are written
+* Each completed point is checkpointed to disk, and an interrupted sweep is
+  resumed from the checkpoint when run again
+* The traces of all the points are saved to one ``.npz`` file together with
+  the settings, channels and timestamps of each point, read with
+  :func:`load_sweep`
+
+Example
+-------
+::
+
+    with Oscilloscope() as scope:
+        grid = {'acq_type': ['NORMal', 'HRESolution', 'AVER16'],
+                'p_mode': ['NORMal', 'RAW'],
+                'channels': [[1], [1, 2]]}
+        ParameterSweep(scope, grid, num=5, fname="sweep").run()
+
+    for point in load_sweep("sweep"):
+        print(point['settings'], point['values'].shape)
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import itertools
+import numpy as np
+from tqdm import tqdm
+
+import keyoscacquire.config as config
+
+_log = logging.getLogger(__name__)
+
+#: Relative cost of changing each setting, the most expensive settings are
+#: changed most rarely in a sweep
+_RECONFIGURATION_COST = {'p_mode': 6, 'num_points': 5, 'channels': 4,
+                         'acq_type': 3, 'num_averages': 2, 'wav_format': 1}
+#: Settings that the oscilloscope may change when another setting is changed,
+#: and that are therefore written again (the points mode is forced to
+#: ``'NORMal'`` in the ``'AVERage'`` acquisition mode)
+_DEPENDENT_SETTINGS = {'p_mode': ('num_points',),
+                       'acq_type': ('num_averages', 'p_mode', 'num_points')}
+#: Name of the checkpoint file in the checkpoint directory of a sweep
+_CHECKPOINT_FNAME = "checkpoint.json"
+#: Marks settings that are not known to be applied
+_UNKNOWN = object()
+
+
+def _gray_order(value_lists):
+    """Points of the product of ``value_lists`` in reflected Gray code order,
+    in which consecutive points differ in one value only, and the values of
+    the first list change most rarely"""
+    if not value_lists:
+        yield ()
+        return
+    inner = list(_gray_order(value_lists[1:]))
+    for i, value in enumerate(value_lists[0]):
+        for rest in (inner if i % 2 == 0 else reversed(inner)):
+            yield (value,) + rest
+
+
+class ParameterSweep:
+    """Capture traces for a grid of settings, see the module docstring.
+
+    Parameters
+    ----------
+    scope : :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+        The connected oscilloscope
+    grid : dict
+        Values to sweep for each setting, the settings are ``'channels'``
+        (list of lists of ints) and the parameters of
+        :meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_acquiring_options`:
+        ``'wav_format'``, ``'acq_type'``, ``'num_averages'``, ``'p_mode'``
+        and ``'num_points'``. All the combinations are captured
+    num : int, default 1
+        Number of traces captured at each point
+    fname : str, default :data:`~keyoscacquire.config._filename`
+        Filename of the sweep, without extension. The traces are saved to
+        ``<fname>.npz`` and checkpointed in the directory ``<fname>_partial``
+    channels : list of ints or ``'active'``, optional
+        The channels if ``'channels'`` is not in the ``grid``, the active
+        channels by default
+    reorder : bool, default ``True``
+        ``True`` orders the points to minimise the reconfiguration, ``False``
+        captures them in the order of the grid
+
+    Attributes
+    ----------
+    points : list of dict
+        The settings of each point in the order they are captured
+    settings_written : int
+        Number of settings written during the most recent :meth:`run`
+
+    Raises
+    ------
+    ValueError
+        If the grid has unknown settings
+    """
+
+    def __init__(self, scope, grid, num=1, fname=config._filename, channels=None,
+                 reorder=True):
+        """See class docstring"""
+        unknown = set(grid) - set(_RECONFIGURATION_COST)
+        if unknown:
+            raise ValueError(f"Cannot sweep {sorted(unknown)}, choose from "
+                             f"{list(_RECONFIGURATION_COST)}")
+        self.scope = scope
+        self.num = num
+        self.fname = fname
+        self.channels = channels
+        names = list(grid)
+        if reorder:
+            names.sort(key=lambda name: -_RECONFIGURATION_COST[name])
+            combinations = _gray_order([list(grid[name]) for name in names])
+        else:
+            combinations = itertools.product(*[grid[name] for name in names])
+        self.points = [dict(zip(names, values)) for values in combinations]
+        self.settings_written = 0
+
+    @property
+    def _checkpoint_dir(self):
+        return self.fname+"_partial"
+
+    def _load_checkpoint(self):
+        """The metadata of the completed points of a checkpointed sweep with
+        the same points, or an empty list
+
+        Raises
+        ------
+        ValueError
+            If the checkpoint is of a different sweep
+        """
+        try:
+            with open(os.path.join(self._checkpoint_dir, _CHECKPOINT_FNAME)) as f:
+                checkpoint = json.load(f)
+        except OSError:
+            return []
+        if checkpoint['points'] != json.loads(json.dumps(self.points)) or checkpoint['num'] != self.num:
+            raise ValueError(f"The checkpoint in '{self._checkpoint_dir}' is of another "
+                              "sweep, use resume=False to start over")
+        return checkpoint['completed']
+
+    def _save_checkpoint(self, completed):
+        """Record the completed points, replacing the checkpoint atomically"""
+        path = os.path.join(self._checkpoint_dir, _CHECKPOINT_FNAME)
+        with open(path+".tmp", 'w') as f:
+            json.dump({'points': self.points, 'num': self.num, 'completed': completed}, f, indent=1)
+        os.replace(path+".tmp", path)
+
+    def run(self, resume=True):
+        """Capture the traces of all the points and save them to
+        ``<fname>.npz``, see :func:`load_sweep`
+
+        Parameters
+        ----------
+        resume : bool, default ``True``
+            ``True`` continues from the checkpoint of an interrupted sweep
+            with the same points, ``False`` discards it and starts over
+
+        Returns
+        -------
+        str or ``None``
+            The filename the sweep is saved to, ``None`` if interrupted
+
+        Raises
+        ------
+        ValueError
+            If resuming from the checkpoint of another sweep
+        RuntimeError
+            If ``<fname>.npz`` already exists
+        """
+        if os.path.exists(self.fname+".npz"):
+            raise RuntimeError(f"{self.fname}.npz already exists")
+        if not resume and os.path.exists(self._checkpoint_dir):
+            shutil.rmtree(self._checkpoint_dir)
+        completed = self._load_checkpoint()
+        if completed:
+            print(f"Resuming the sweep after {len(completed)} of {len(self.points)} points")
+        os.makedirs(self._checkpoint_dir, exist_ok=True)
+        self.scope.verbose_acquistion = False
+        self.settings_written = 0
+        # The state of the oscilloscope is not known before the first point
+        applied = {}
+        try:
+            for index in tqdm(range(len(completed), len(self.points)),
+                              initial=len(completed), total=len(self.points)):
+                point = self.points[index]
+                changes = self._changes(point, applied)
+                channels = point.get('channels', self.channels)
+                timestamps = [time.time()]
+                _, values, _ = self.scope.set_options_get_trace(channels=channels, **changes)
+                traces = [values]
+                for _ in range(self.num-1):
+                    timestamps.append(time.time())
+                    traces.append(self.scope.get_trace(channels=channels)[1])
+                self.settings_written += len(changes)
+                applied.update(point)
+                time_axis = np.ravel(self.scope._time)
+                np.save(os.path.join(self._checkpoint_dir, f"point{index}.npy"), np.stack(traces))
+                metadata = {'index': index, 'settings': point,
+                            'channels': list(self.scope._capture_channels),
+                            'wav_format': self.scope._wav_format_used,
+                            'time_start': float(time_axis[0]),
+                            'time_increment': float(time_axis[1]-time_axis[0]) if time_axis.size > 1 else 0.,
+                            'timestamps': timestamps, 'reconfigured': list(changes)}
+                if 'p_mode' in point:
+                    # The points mode actually used, see Oscilloscope.p_mode
+                    metadata['p_mode_used'] = self.scope.p_mode
+                completed.append(metadata)
+                self._save_checkpoint(completed)
+        except KeyboardInterrupt:
+            print(f"Sweep interrupted after {len(completed)} of {len(self.points)} "
+                   "points, run it again to resume")
+            return None
+        self._consolidate(completed)
+        print(f"Sweep saved to:  {self.fname}.npz")
+        return self.fname+".npz"
+
+    def _changes(self, point, applied):
+        """The acquisition settings of ``point`` that differ from the
+        ``applied`` settings, including the settings that depend on them"""
+        changes = {name: value for name, value in point.items()
+                   if name != 'channels' and applied.get(name, _UNKNOWN) != value}
+        for name in list(changes):
+            for dependent in _DEPENDENT_SETTINGS.get(name, ()):
+                if dependent in point:
+                    changes[dependent] = point[dependent]
+        _log.debug(f"Changing {changes}")
+        return changes
+
+    def _consolidate(self, completed):
+        """Save all the checkpointed points to ``<fname>.npz`` and remove the
+        checkpoint"""
+        data = {f"point{point['index']}_values":
+                    np.load(os.path.join(self._checkpoint_dir, f"point{point['index']}.npy"))
+                for point in completed}
+        data['points'] = np.asarray(json.dumps(completed))
+        data['model'] = np.asarray(f"{self.scope._model},{self.scope._serial}")
+        np.savez(self.fname+".npz", **data)
+        shutil.rmtree(self._checkpoint_dir)
+
+
+def load_sweep(fname):
+    """Load a sweep saved by :meth:`ParameterSweep.run`
+
+    Parameters
+    ----------
+    fname : str
+        Filename of the sweep, with or without the ``.npz`` extension
+
+    Returns
+    -------
+    list of dict
+        For each point in the order captured: the ``'settings'``, the
+        ``'channels'``, the ``'wav_format'`` used, the host ``'timestamps'``
+        of the traces, the settings ``'reconfigured'`` for the point, the
+        ``'p_mode_used'`` if ``'p_mode'`` is swept, the ``'time'`` axis and
+        the ``'values'`` with the shape ``(num, points, channels)``
+    """
+    if not fname.endswith(".npz"):
+        fname += ".npz"
+    with np.load(fname) as data:
+        points = json.loads(data['points'].item())
+        for point in points:
+            point['values'] = data[f"point{point['index']}_values"]
+            point['time'] = (point.pop('time_start') + np.arange(point['values'].shape[1])
+                             * point.pop('time_increment'))[:, np.newaxis]
+    return points
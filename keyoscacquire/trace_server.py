@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Local server streaming traces from one oscilloscope to several clients
+
+:class:`TraceServer` keeps one connection to the oscilloscope, acquires
+traces back to back while any client is connected, and sends each trace to
+all the clients connected to a TCP or Unix socket. :class:`TraceClient`
+connects to the server and yields the traces as numpy arrays.
+
+Each trace is sent as one binary frame: a fixed size header, the metadata as
+JSON (channels, preambles, etc.) and the payload, which is the raw 8/16-bit
+integers for the ``'BYTE'`` and ``'WORD'`` waveform formats (scaled by the
+client with the preambles) or float64 voltage values otherwise.
+
+Each client has its own bounded queue of frames sent by its own thread, so a
+slow client only loses frames itself (the oldest are dropped) and never holds
+back the acquisition or the other clients.
+
+Example
+-------
+The server::
+
+    with Oscilloscope() as scope:
+        TraceServer(scope, "localhost:5050", channels=[1, 3]).serve_forever()
+
+A client::
+
+    with TraceClient("localhost:5050") as client:
+        for time, values, channels in client:
+            process(time, values)
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+import numpy as np
+
+import keyoscacquire.config as config
+import keyoscacquire.dataprocessing as dataprocessing
+
+_log = logging.getLogger(__name__)
+
+#: Frame header: magic, sequence number, host timestamp, payload dtype,
+#: rows, columns, metadata bytes, payload bytes
+_FRAME_HEADER = struct.Struct('!4sQd4sIIIQ')
+_MAGIC = b'KOT1'
+
+
+def parse_server_address(address):
+    """Socket family and address from ``'unix:<path>'``, ``'<host>:<port>'``
+    or a ``(host, port)`` tuple
+
+    Returns
+    -------
+    family : int
+        :data:`socket.AF_UNIX` or :data:`socket.AF_INET`
+    address : str or tuple
+        Path or ``(host, port)``
+    """
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or 'localhost', int(port))
+
+
+def encode_frame(sequence, timestamp, data, metadata):
+    """Binary frame for a trace, as a list of buffers to be sent in order
+
+    Parameters
+    ----------
+    sequence : int
+        Sequence number of the trace
+    timestamp : float
+        Host time of the trace
+    data : ~numpy.ndarray
+        Two dimensional payload
+    metadata : dict
+        JSON serialisable metadata
+
+    Returns
+    -------
+    list of bytes-like
+    """
+    data = np.ascontiguousarray(data)
+    meta = json.dumps(metadata).encode()
+    header = _FRAME_HEADER.pack(_MAGIC, sequence, timestamp, data.dtype.str.encode(),
+                                data.shape[0], data.shape[1], len(meta), data.nbytes)
+    return [header, meta, data.reshape(-1).view(np.uint8)]
+
+
+def trace_payload(scope):
+    """Payload and metadata of the most recent capture of ``scope``: raw
+    integers and preambles for binary waveform formats, voltage values
+    otherwise
+
+    Returns
+    -------
+    data : :class:`~numpy.ndarray`
+        The payload for :func:`encode_frame`
+    metadata : dict
+        ``'channels'``, ``'model'``, ``'serial'``, ``'wav_format'`` and
+        ``'preambles'`` or ``'time_start'`` and ``'time_increment'``
+
+    Raises
+    ------
+    ValueError
+        If no analogue channel or math function is captured, as digital pods
+        are not sent
+    """
+    if not scope._sources:
+        raise ValueError(f"Only digital pods {scope._capture_pods} are captured, but traces "
+                          "are sent with analogue channels or math functions only")
+    metadata = {'channels': scope._capture_channels, 'model': scope._model,
+                'serial': scope._serial, 'wav_format': scope._wav_format_used}
+    if scope._wav_format_used[:3] in ['WOR', 'BYT']:
+        metadata['preambles'] = scope._metadata
+        return np.asarray(scope._raw), metadata
+    time_axis, values = dataprocessing.process_data(scope._raw, scope._metadata,
+                                                    scope._wav_format_used,
+                                                    verbose_acquistion=False)
+    metadata['time_start'] = float(time_axis[0, 0])
+    metadata['time_increment'] = float(time_axis[1, 0]-time_axis[0, 0]) if len(time_axis) > 1 else 0.
+    return values, metadata
+
+
+class _Client:
+    """A connected client: its socket, frame queue and sender thread"""
+
+    def __init__(self, sock, address, max_queue):
+        self.sock = sock
+        self.address = address
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.sent = 0
+        self.dropped = 0
+        self.connected = True
+        self.thread = threading.Thread(target=self._send_frames, daemon=True)
+        self.thread.start()
+
+    def put(self, frame):
+        """Queue a frame, dropping the oldest if the queue is full"""
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _send_frames(self):
+        """Send the queued frames until disconnected"""
+        try:
+            while self.connected:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                for buffer in frame:
+                    self.sock.sendall(buffer)
+                self.sent += 1
+        except OSError as err:
+            _log.info(f"Client {self.address} disconnected: {err}")
+        finally:
+            self.connected = False
+            self.sock.close()
+
+    def close(self):
+        """Stop the sender thread and close the socket"""
+        self.connected = False
+        self.put(None)
+        self.thread.join(timeout=1)
+
+
+class TraceServer:
+    """Acquire traces from one oscilloscope and stream them to the clients
+    connected to a socket, see the module docstring.
+
+    Parameters
+    ----------
+    scope : :class:`~keyoscacquire.oscilloscope.Oscilloscope`
+        The connected oscilloscope with the acquisition options set. Must
+        not be used by other code while the server is running
+    address : str or tuple, default :data:`~keyoscacquire.config._server_address`
+        ``'<host>:<port>'``, ``'unix:<path>'`` or ``(host, port)``
+    channels : list of ints or ``'active'``, uses oscilloscope setting by default
+        The channels to acquire, see
+        :meth:`~keyoscacquire.oscilloscope.Oscilloscope.set_channels_for_capture`
+    max_queue : int, default :data:`~keyoscacquire.config._server_queue`
+        Number of frames queued for each client before the oldest are dropped
+
+    Attributes
+    ----------
+    sequence : int
+        Sequence number of the most recent trace acquired
+    """
+
+    def __init__(self, scope, address=config._server_address, channels=None,
+                 max_queue=config._server_queue):
+        """See class docstring"""
+        self.scope = scope
+        self.address = address
+        self.channels = channels
+        self.max_queue = max_queue
+        self.sequence = 0
+        self._clients = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._listener = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def stats(self):
+        """Number of frames sent and dropped for each connected client"""
+        with self._lock:
+            return [{'address': client.address, 'sent': client.sent,
+                     'dropped': client.dropped} for client in self._clients]
+
+    def start(self):
+        """Start listening for clients and acquiring in background threads"""
+        family, address = parse_server_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen()
+        self._listener.settimeout(0.2)
+        self.scope.set_channels_for_capture(channels=self.channels)
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._accept_clients, daemon=True),
+                         threading.Thread(target=self._acquire, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        print(f"Serving traces from {self.scope._model} on {self.address}")
+
+    def serve_forever(self):
+        """Start the server and block until interrupted with ctrl-c"""
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print("Stopping the server")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop acquiring, disconnect the clients and close the socket"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            family, address = parse_server_address(self.address)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.remove(address)
+
+    def _accept_clients(self):
+        """Accept new clients until stopped"""
+        while not self._stop.is_set():
+            try:
+                sock, address = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _log.info(f"Client connected: {address}")
+            with self._lock:
+                self._clients.append(_Client(sock, address, self.max_queue))
+
+    def _acquire(self):
+        """Acquire traces while any client is connected, until stopped"""
+        scope = self.scope
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    self._clients = [client for client in self._clients if client.connected]
+                    num_clients = len(self._clients)
+                if num_clients == 0:
+                    time.sleep(scope.poll_interval)
+                    continue
+                scope.arm()
+                scope.capture_and_read(set_running=False)
+                self.sequence += 1
+                frame = encode_frame(self.sequence, time.time(), *trace_payload(scope))
+                with self._lock:
+                    for client in self._clients:
+                        client.put(frame)
+        except Exception as err:
+            _log.error(f"Stopping the acquisition of the server: {err}")
+            self._stop.set()
+            raise
+        finally:
+            scope.run()
+
+
+class _FrameConnection:
+    """Client socket receiving the frames of :func:`encode_frame`
+
+    Parameters
+    ----------
+    address : str or tuple
+        ``'<host>:<port>'``, ``'unix:<path>'`` or ``(host, port)``
+    timeout : float or ``None``
+        Seconds to wait for each frame, ``None`` waits indefinitely
+    """
+
+    def __init__(self, address, timeout=None):
+        """See class docstring"""
+        family, address = parse_server_address(address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(address)
+        self._header = bytearray(_FRAME_HEADER.size)
+        self._time_key, self._time = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _receive_into(self, buffer):
+        """Fill ``buffer`` from the socket"""
+        view = memoryview(buffer)
+        if isinstance(buffer, np.ndarray):
+            view = memoryview(buffer.reshape(-1).view(np.uint8))
+        received = 0
+        while received < len(view):
+            num = self._sock.recv_into(view[received:])
+            if num == 0:
+                raise ConnectionError("The server closed the connection")
+            received += num
+
+    def receive(self):
+        """Receive the next frame
+
+        Returns
+        -------
+        sequence : int
+            Sequence number of the frame
+        timestamp : float
+            Host time at the server when the trace was acquired
+        data : :class:`~numpy.ndarray`
+            Raw integers with one row per channel if ``'preambles'`` is in the
+            metadata, otherwise voltage values with one column per channel
+        metadata : dict
+            See :func:`trace_payload`
+
+        Raises
+        ------
+        ConnectionError
+            If the server closed the connection
+        """
+        self._receive_into(self._header)
+        (magic, sequence, timestamp, dtype, rows, columns,
+         meta_len, nbytes) = _FRAME_HEADER.unpack(self._header)
+        if magic != _MAGIC:
+            raise ConnectionError(f"Unexpected frame header {magic}")
+        meta = bytearray(meta_len)
+        self._receive_into(meta)
+        data = np.empty((rows, columns), dtype=np.dtype(dtype.rstrip(b'\x00').decode()))
+        self._receive_into(data)
+        return sequence, timestamp, data, json.loads(meta)
+
+    def _to_trace(self, data, metadata):
+        """``(time, values, channels)`` from the payload of a frame"""
+        if 'preambles' in metadata:
+            time_axis, values = dataprocessing.process_data(data, metadata['preambles'],
+                                                            metadata['wav_format'],
+                                                            verbose_acquistion=False)
+            return time_axis, values, metadata['channels']
+        key = (len(data), metadata['time_start'], metadata['time_increment'])
+        if key != self._time_key:
+            self._time = (key[1] + np.arange(key[0])*key[2])[:, np.newaxis]
+            self._time_key = key
+        return self._time, data, metadata['channels']
+
+    def close(self):
+        """Disconnect from the server"""
+        self._sock.close()
+
+
+class TraceClient(_FrameConnection):
+    """Receive traces from a :class:`TraceServer`, see the module docstring.
+
+    Iterating over the client yields ``(time, values, channels)`` like
+    :meth:`~keyoscacquire.oscilloscope.Oscilloscope.get_trace`, use
+    :meth:`receive` to get the raw payload and metadata. Gaps in the
+    sequence numbers of the frames mean that traces were dropped for this
+    client.
+
+    Parameters
+    ----------
+    address : str or tuple, default :data:`~keyoscacquire.config._server_address`
+        ``'<host>:<port>'``, ``'unix:<path>'`` or ``(host, port)``
+    timeout : float or ``None``, default ``None``
+        Seconds to wait for each trace, ``None`` waits indefinitely
+    """
+
+    def __init__(self, address=config._server_address, timeout=None):
+        """See class docstring"""
+        super().__init__(address, timeout)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get_trace()
+            except ConnectionError:
+                return
+
+    def get_trace(self):
+        """Receive the next trace
+
+        Returns
+        -------
+        time : :class:`~numpy.ndarray`
+            Time axis for the measurement
+        values : :class:`~numpy.ndarray`
+            Voltage values, each column represents one channel
+        channels : list of ints
+            The channels of the trace
+        """
+        _, _, data, metadata = self.receive()
+        return self._to_trace(data, metadata)
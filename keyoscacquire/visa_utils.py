@@ -5,8 +5,13 @@ Visa-related auxiliary functions for the keyoscacquire package
 """
 
 import os
+import json
+import time
+import socket
 import pyvisa
 import logging
+import concurrent.futures
+import numpy as np
 
 import keyoscacquire.config as config
 
@@ -47,6 +52,34 @@ def interpret_visa_id(idn):
     return maker, model, serial, firmware, model_series
 
 
+def split_compound_reply(reply):
+    """Split the reply of a compound query (several queries sent in one
+    message separated by ``;``) into the reply of each query. Semicolons
+    inside quoted strings, for instance in error descriptions, are kept.
+
+    Parameters
+    ----------
+    reply : str
+        Reply from the instrument, e.g. ``'-113,"Undefined header";+0,"No error"'``
+
+    Returns
+    -------
+    list of str
+        The reply of each query, e.g. ``['-113,"Undefined header"', '+0,"No error"']``
+    """
+    replies, current, in_quotes = [], [], False
+    for char in reply.strip():
+        if char == '"':
+            in_quotes = not in_quotes
+        if char == ';' and not in_quotes:
+            replies.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    replies.append("".join(current).strip())
+    return replies
+
+
 def obtain_instrument_information(resource_manager, address, num,
                                   ask_idn=True, timeout=200):
     """Obtain more information about a VISA resource
@@ -104,3 +137,384 @@ def obtain_instrument_information(resource_manager, address, num,
                       f"exception {ex.__class__.__name__}: VISA id returned was '{idn}'")
                 resource_info.extend(["failed to interpret"]*5)
     return resource_info
+
+
+## Discovery with caching ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+#: Filename of the VISA discovery cache in :data:`~keyoscacquire.config._cache_dir`
+_DISCOVERY_CACHE_FNAME = "visa_devices.json"
+#: Placeholders for the IDN information of instruments that did not respond,
+#: these results are not cached (the instrument may be busy or booting)
+_FAILED_PROBES = ("no IDN reply", "Error")
+
+
+def _discovery_cache_path():
+    """Full path of the VISA discovery cache file"""
+    return os.path.join(config._cache_dir, _DISCOVERY_CACHE_FNAME)
+
+
+def load_discovery_cache(ttl=config._discovery_cache_ttl):
+    """Load the VISA discovery results cached on disk that are younger
+    than ``ttl`` seconds
+
+    Parameters
+    ----------
+    ttl : float, default :data:`~keyoscacquire.config._discovery_cache_ttl`
+        Seconds the cached results are valid for
+
+    Returns
+    -------
+    dict
+        Resource information (without the sequential numbering) keyed by VISA
+        address, empty if there is no valid cache
+    """
+    try:
+        with open(_discovery_cache_path()) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {address: entry['info'] for address, entry in cache.items()
+            if now - entry['timestamp'] < ttl}
+
+
+def save_discovery_cache(resources):
+    """Add resource information to the VISA discovery cache on disk
+
+    Parameters
+    ----------
+    resources : dict
+        Resource information (without the sequential numbering, see
+        :func:`obtain_instrument_information`) keyed by VISA address
+    """
+    path = _discovery_cache_path()
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    now = time.time()
+    cache.update({address: {'timestamp': now, 'info': info}
+                  for address, info in resources.items()})
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(cache, f, indent=1)
+    except OSError as err:
+        _log.info(f"Could not write the VISA discovery cache '{path}': {err}")
+
+
+def discover_instruments(resource_manager, resources, ask_idn=True,
+                         max_workers=config._discovery_workers, use_cache=True,
+                         ttl=config._discovery_cache_ttl, timeout=200):
+    """Obtain information about several VISA resources, probing them
+    concurrently and using cached results where possible.
+
+    Only the results obtained when ``ask_idn`` is ``True`` are cached, as
+    the listing without IDNs is fast anyway, and instruments that did not
+    respond are probed again the next time.
+
+    Parameters
+    ----------
+    resource_manager : :class:`pyvisa.resource_manager`
+    resources : list of str
+        VISA addresses of the instruments to be investigated
+    ask_idn : bool
+        If ``True``: will query the instruments' IDN and interpret it
+        if possible
+    max_workers : int, default :data:`~keyoscacquire.config._discovery_workers`
+        Maximum number of resources probed concurrently
+    use_cache : bool, default ``True``
+        If ``True``: use and update the cache on disk, see
+        :func:`load_discovery_cache`
+    ttl : float, default :data:`~keyoscacquire.config._discovery_cache_ttl`
+        Seconds the cached results are valid for
+    timeout : int, default 200
+        VISA connection timeout
+
+    Returns
+    -------
+    information : list of lists
+        One list per resource, as returned by :func:`obtain_instrument_information`,
+        in the order of ``resources``
+    """
+    cached = load_discovery_cache(ttl) if (use_cache and ask_idn) else {}
+    to_probe = [address for address in resources if address not in cached]
+    probed = {}
+    if to_probe:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {address: executor.submit(obtain_instrument_information,
+                                                resource_manager, address,
+                                                resources.index(address),
+                                                ask_idn, timeout)
+                       for address in to_probe}
+            # Drop the sequential numbering, it is added back below
+            probed = {address: future.result()[1:] for address, future in futures.items()}
+        if use_cache and ask_idn:
+            save_discovery_cache({address: info for address, info in probed.items()
+                                  if info[2] not in _FAILED_PROBES})
+    probed.update(cached)
+    return [[str(i)]+probed[address] for i, address in enumerate(resources)]
+
+
+def address_from_serial(serial, ttl=config._discovery_cache_ttl):
+    """Find the VISA address of an instrument from its serial number, using
+    the discovery cache if the instrument is in it and otherwise probing
+    the connected resources (see :func:`discover_instruments`)
+
+    Parameters
+    ----------
+    serial : str
+        Serial number of the instrument, e.g. ``'MY1234567'``
+    ttl : float, default :data:`~keyoscacquire.config._discovery_cache_ttl`
+        Seconds the cached results are valid for
+
+    Returns
+    -------
+    str or ``None``
+        The VISA address, ``None`` if no instrument with the serial was found
+    """
+    # Resource info is [address, alias, maker, model, serial, firmware, model_series]
+    for address, info in load_discovery_cache(ttl).items():
+        if len(info) > 4 and info[4] == serial:
+            return address
+    rm = pyvisa.ResourceManager()
+    for info in discover_instruments(rm, list(rm.list_resources()), ttl=ttl):
+        if len(info) > 5 and info[5] == serial:
+            return info[1]
+    return None
+
+
+## Socket transport ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def parse_socket_address(address):
+    """Get the host and port from a VISA socket address
+
+    Parameters
+    ----------
+    address : str
+        VISA address on the form ``'TCPIP[board]::<host>::<port>::SOCKET'``
+
+    Returns
+    -------
+    host : str
+    port : int
+
+    Raises
+    ------
+    ValueError
+        If the address is not a TCP/IP socket address
+    """
+    parts = address.split("::")
+    if not (len(parts) == 4 and parts[0].upper().startswith('TCPIP')
+            and parts[3].upper() == 'SOCKET'):
+        raise ValueError(f"'{address}' is not a TCPIP::<host>::<port>::SOCKET address")
+    return parts[1], int(parts[2])
+
+
+class SocketResource:
+    """SCPI over a raw TCP socket (port 5025 on Keysight oscilloscopes),
+    bypassing pyvisa's message-based I/O.
+
+    Provides the subset of the :class:`pyvisa.resources.MessageBasedResource`
+    interface that :class:`~keyoscacquire.oscilloscope.Oscilloscope` uses,
+    so that it can be used as ``Oscilloscope._inst``. Binary blocks are
+    received directly into preallocated numpy arrays, and timeouts are
+    raised as :class:`pyvisa.errors.VisaIOError` like for pyvisa resources.
+
+    Parameters
+    ----------
+    host : str
+        Hostname or IP address of the instrument
+    port : int, default 5025
+        SCPI socket port
+    timeout : int, default :data:`~keyoscacquire.config._timeout`
+        Milliseconds before timeout
+    buffer_size : int, default :data:`~keyoscacquire.config._socket_buffer_size`
+        Receive buffer size requested from the operating system
+    """
+    read_termination = '\n'
+    write_termination = '\n'
+    chunk_size = 1024**2
+
+    def __init__(self, host, port=5025, timeout=config._timeout,
+                 buffer_size=config._socket_buffer_size):
+        self.resource_name = f"TCPIP::{host}::{port}::SOCKET"
+        try:
+            family, socktype, proto, _, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+            self._sock = socket.socket(family, socktype, proto)
+        except OSError as err:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_resource_not_found) from err
+        # The receive buffer must be set before connecting, as the TCP window
+        # scale is agreed on in the handshake
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock.settimeout(timeout/1000)
+        try:
+            self._sock.connect(sockaddr)
+        except OSError as err:
+            self._sock.close()
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_resource_not_found) from err
+        # Bytes received but not yet consumed
+        self._pending = bytearray()
+        self.timeout = timeout
+
+    @property
+    def timeout(self):
+        """Milliseconds before timeout of the socket operations"""
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+        self._sock.settimeout(None if timeout is None else timeout/1000)
+
+    def _recv(self, num_bytes):
+        """Receive up to ``num_bytes`` into the pending buffer"""
+        try:
+            data = self._sock.recv(num_bytes)
+        except socket.timeout as err:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout) from err
+        if not data:
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_connection_lost)
+        self._pending += data
+
+    def _read_exactly_into(self, view):
+        """Fill the memoryview ``view``, starting with any pending bytes"""
+        num_pending = min(len(self._pending), len(view))
+        view[:num_pending] = self._pending[:num_pending]
+        del self._pending[:num_pending]
+        received = num_pending
+        while received < len(view):
+            try:
+                num = self._sock.recv_into(view[received:], min(len(view)-received, self.chunk_size))
+            except socket.timeout as err:
+                raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout) from err
+            if num == 0:
+                raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_connection_lost)
+            received += num
+
+    def _discard(self, num_bytes):
+        """Read and discard exactly ``num_bytes``"""
+        buffer = memoryview(bytearray(min(num_bytes, self.chunk_size)))
+        while num_bytes > 0:
+            view = buffer[:min(num_bytes, len(buffer))]
+            self._read_exactly_into(view)
+            num_bytes -= len(view)
+
+    def _read_bytes(self, num_bytes):
+        """Read exactly ``num_bytes``"""
+        buffer = bytearray(num_bytes)
+        self._read_exactly_into(memoryview(buffer))
+        return bytes(buffer)
+
+    def read_bytes(self, count):
+        """Read exactly ``count`` bytes"""
+        return self._read_bytes(count)
+
+    def read_into(self, view):
+        """Read exactly ``len(view)`` bytes into the writable buffer ``view``
+        (e.g. a slice of a numpy array or memory map)"""
+        self._read_exactly_into(memoryview(view).cast('B'))
+
+    def clear(self):
+        """Discard any data the instrument is still sending, for instance
+        after a timeout in the middle of a binary block"""
+        self._pending.clear()
+        self._sock.settimeout(0.1)
+        try:
+            while self._sock.recv(self.chunk_size):
+                pass
+        except socket.timeout:
+            pass
+        finally:
+            self.timeout = self._timeout
+
+    def write(self, command):
+        """Write a command to the instrument"""
+        self._sock.sendall((command+self.write_termination).encode('ascii'))
+
+    def write_raw(self, message):
+        """Write bytes to the instrument"""
+        self._sock.sendall(message)
+
+    def read(self):
+        """Read a message up to the read termination"""
+        term = self.read_termination.encode('ascii')
+        while term not in self._pending:
+            self._recv(self.chunk_size)
+        end = self._pending.index(term)+len(term)
+        message = bytes(self._pending[:end])
+        del self._pending[:end]
+        return message.decode('ascii')
+
+    def query(self, command):
+        """Write a command and read the reply"""
+        self.write(command)
+        return self.read()
+
+    def read_binary_block(self, dtype=np.uint8, out=None):
+        """Read an IEEE 488.2 definite length binary block (``#<n><length><data>``)
+        and the trailing termination into a numpy array
+
+        Parameters
+        ----------
+        dtype : numpy dtype, default ``numpy.uint8``
+            Datatype of the block values (little endian)
+        out : :class:`~numpy.ndarray` or ``None``
+            Preallocated contiguous array to receive into, must be at least
+            as long as the block. A new array is allocated if ``None``
+
+        Returns
+        -------
+        :class:`~numpy.ndarray`
+            The values in the block (a view of ``out`` if given)
+
+        Raises
+        ------
+        pyvisa.errors.InvalidBinaryFormat
+            If the reply is not a definite length block
+        ValueError
+            If the block does not fit in ``out``, the block is then
+            discarded so that the connection stays in sync
+        """
+        head = self._read_bytes(2)
+        if head[:1] != b'#' or not head[1:2].isdigit() or head[1:2] == b'0':
+            raise pyvisa.errors.InvalidBinaryFormat(f"block header starting with {head!r}")
+        num_digits = int(head[1:2])
+        length = int(self._read_bytes(num_digits))
+        dtype = np.dtype(dtype).newbyteorder('<')
+        if out is None:
+            out = np.empty(length//dtype.itemsize, dtype=dtype)
+        elif length > out.nbytes:
+            self._discard(length)
+            self.read()
+            raise ValueError(f"The block of {length:,d} bytes does not fit in the "
+                             f"array of {out.nbytes:,d} bytes, it was discarded")
+        values = out[:length//dtype.itemsize]
+        self._read_exactly_into(memoryview(values).cast('B'))
+        # Consume the termination after the block
+        self.read()
+        return values
+
+    def query_binary_values(self, command, datatype='B', container=np.array,
+                            is_big_endian=False, **kwargs):
+        """Write a command and read the reply as a binary block, similar to
+        :meth:`pyvisa.resources.MessageBasedResource.query_binary_values`
+        with ``datatype`` as a struct format character"""
+        if is_big_endian:
+            raise ValueError("SocketResource only supports little endian data")
+        self.write(command)
+        values = self.read_binary_block(dtype=np.dtype(datatype))
+        return values if container is np.array else container(values)
+
+    def write_binary_values(self, command, values, datatype='B', **kwargs):
+        """Write a command followed by the values as a binary block"""
+        data = np.asarray(values, dtype=np.dtype(datatype).newbyteorder('<')).tobytes()
+        length = str(len(data))
+        self.write_raw(f"{command}#{len(length)}{length}".encode('ascii')
+                       + data + self.write_termination.encode('ascii'))
+
+    def close(self):
+        """Close the socket"""
+        self._sock.close()
@@ -49,6 +49,7 @@ if __name__ == '__main__':
                 'get_traces_connect_each_time=keyoscacquire.installed_cli_programmes:connect_each_time_cli',
                 'get_traces_single_connection=keyoscacquire.installed_cli_programmes:single_connection_cli',
                 'get_num_traces=keyoscacquire.installed_cli_programmes:num_traces_cli',
+                'get_periodic_traces=keyoscacquire.installed_cli_programmes:periodic_traces_cli',
                 'list_visa_devices=keyoscacquire.installed_cli_programmes:list_visa_devices_cli',
                 'path_of_config=keyoscacquire.installed_cli_programmes:path_of_config_cli'
             ],
@@ -56,7 +57,7 @@ if __name__ == '__main__':
           install_requires=[
               'pyvisa',
               'argparse',
-              'numpy',
+              'numpy>=1.20',
               'matplotlib',
               'tqdm',
               ],
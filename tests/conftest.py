@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures for the tests: an oscilloscope connected to a simulated instrument
+"""
+
+import numpy as np
+import pyvisa
+import pytest
+
+import keyoscacquire.oscilloscope as oscilloscope
+
+
+class FakeInstrument:
+    """Simulated InfiniiVision oscilloscope answering the SCPI commands used
+    by :class:`~keyoscacquire.oscilloscope.Oscilloscope`, with a ramp on
+    each channel. All the commands are recorded in ``log``"""
+
+    resource_name = 'USB0::0x0957::0x17A0::MY00000000::INSTR'
+
+    def __init__(self, num_points=1000):
+        self.timeout = 1000
+        self.chunk_size = 20480
+        self.read_termination = None
+        self.num_points = num_points
+        self.log = []
+        self.running = True
+        self.source = 'CHAN1'
+        self.wav_format = 'WORD'
+        self.acq_type = 'HRES'
+        self.count = 8
+        self.acq_mode = 'RTIM'
+        self.segment = 1
+        self.trigger_event = False
+
+    def write(self, command):
+        self.log.append(command)
+        for part in command.split(';'):
+            self._write_one(part.strip())
+
+    def _write_one(self, command):
+        upper = command.upper()
+        argument = command.split(' ')[-1]
+        if upper.startswith(':RUN'):
+            self.running = True
+        elif upper.startswith(':STOP'):
+            self.running = False
+        elif upper.startswith((':DIG', ':SING')):
+            self.running = False
+            self.trigger_event = True
+        elif upper.startswith(':WAVEFORM:SOURCE'):
+            self.source = argument.upper()
+        elif upper.startswith(':WAVEFORM:FORMAT'):
+            self.wav_format = argument.upper()
+        elif upper.startswith(':ACQUIRE:TYPE'):
+            self.acq_type = argument.upper()[:4]
+        elif upper.startswith(':ACQUIRE:COUNT'):
+            self.count = int(argument)
+        elif upper.startswith(':ACQUIRE:MODE'):
+            self.acq_mode = argument.upper()[:4]
+        elif upper.startswith(':ACQUIRE:SEGMENTED:INDEX'):
+            self.segment = int(argument)
+
+    def _query_one(self, query):
+        upper = query.upper()
+        if upper == '*IDN?':
+            return 'KEYSIGHT TECHNOLOGIES,DSO-X 3024T,MY00000000,07.50'
+        if upper.startswith(':SYSTEM:ERROR'):
+            return '+0,"No error"'
+        if upper.startswith(':OPEREGISTER:CONDITION'):
+            return '8' if self.running else '0'
+        if upper.startswith(':TER'):
+            triggered, self.trigger_event = self.trigger_event, False
+            return '1' if triggered else '0'
+        if upper.startswith(':CHAN') and upper.endswith(':DISP?'):
+            return '1' if upper[5] in '13' else '0'
+        if upper.startswith(':WAVEFORM:FORMAT'):
+            return self.wav_format
+        if upper.startswith(':WAVEFORM:POINTS:MODE'):
+            return 'RAW'
+        if upper.startswith(':WAVEFORM:POINTS'):
+            return str(self.num_points)
+        if upper.startswith(':WAVEFORM:PREAMBLE'):
+            format_code = {'WORD': 1, 'BYTE': 0}.get(self.wav_format, 4)
+            return f'{format_code},0,{self.num_points},1,1e-6,-5e-4,0,0.01,0.0,0'
+        if upper.startswith(':WAVEFORM:DATA'):
+            # ASCii data are voltages
+            return ','.join(f'{value*0.01:e}' for value in self.data())
+        if upper.startswith(':WAVEFORM:SEGMENTED:COUNT'):
+            return '4'
+        if upper.startswith(':WAVEFORM:SEGMENTED:TTAG'):
+            return str((self.segment-1)*1e-3)
+        if upper.startswith(':ACQUIRE:TYPE'):
+            return self.acq_type
+        if upper.startswith(':ACQUIRE:COUNT'):
+            return str(self.count)
+        return '1'
+
+    def query(self, command):
+        self.log.append(command)
+        replies = []
+        for part in command.split(';'):
+            part = part.strip()
+            if part.endswith('?') or '? ' in part:
+                replies.append(self._query_one(part.split(' ')[0]))
+            else:
+                self._write_one(part)
+        return ';'.join(replies) + '\n'
+
+    def data(self):
+        """The raw values of the current source"""
+        channel = int(self.source[-1]) if self.source[-1].isdigit() else 1
+        ramp = np.arange(self.num_points) % 100 * channel + self.segment
+        return ramp.astype(np.int16 if self.wav_format == 'WORD' else np.int8)
+
+    def query_binary_values(self, command, datatype='h', container=np.array, **kwargs):
+        self.log.append(command)
+        return container(self.data())
+
+    def close(self):
+        self.log.append('CLOSE')
+
+
+class FakeResourceManager:
+    """Opens a :class:`FakeInstrument` for any address"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def open_resource(self, address, **kwargs):
+        return FakeInstrument()
+
+
+@pytest.fixture
+def fake_visa(monkeypatch):
+    """Connect all oscilloscopes to a :class:`FakeInstrument`"""
+    monkeypatch.setattr(pyvisa, 'ResourceManager', FakeResourceManager)
+
+
+@pytest.fixture
+def scope(fake_visa):
+    """An :class:`~keyoscacquire.oscilloscope.Oscilloscope` connected to a
+    :class:`FakeInstrument` (available as ``scope._inst``)"""
+    scope = oscilloscope.Oscilloscope(address='FAKE', verbose=False)
+    scope.verbose_acquistion = False
+    yield scope
+    scope._inst.close()
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Tests of :class:`keyoscacquire.async_oscilloscope.AsyncOscilloscope`"""
+
+import asyncio
+
+import pytest
+
+from keyoscacquire.async_oscilloscope import AsyncOscilloscope
+
+
+@pytest.mark.parametrize("set_running", [True, False])
+def test_get_trace_set_running(fake_visa, set_running):
+    async def get_trace():
+        async with await AsyncOscilloscope.open('FAKE', verbose=False) as scope:
+            scope.scope.verbose_acquistion = False
+            _, values, channels = await scope.get_trace(channels=[1, 3], set_running=set_running)
+            return values, channels, await scope.is_running()
+    values, channels, running = asyncio.run(get_trace())
+    assert values.shape == (1000, 2)
+    assert channels == [1, 3]
+    assert running == set_running
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Tests of the request scheduling of :class:`keyoscacquire.broker.ScopeBroker`"""
+
+import pytest
+
+from keyoscacquire.broker import ScopeBroker, _Request
+
+
+class RecordingConnection:
+    """Client connection recording the replies instead of sending them"""
+
+    def __init__(self, settings=None, channels=None):
+        self.address = 'test'
+        self.settings = dict(settings or {})
+        self.channels = channels
+        self.replies = []
+
+    def reply(self, request_id, data, metadata):
+        self.replies.append((request_id, data, metadata))
+
+
+def trace_request(connection, **message):
+    return _Request(connection, dict(message, method='get_trace'))
+
+
+def test_default_num_averages_is_int(scope):
+    broker = ScopeBroker(scope)
+    assert broker.defaults['num_averages'] == 8
+
+
+def test_averaging_without_num_averages_uses_default(scope):
+    broker = ScopeBroker(scope)
+    connection = RecordingConnection({'acq_type': 'AVERage'})
+    request = trace_request(connection, channels=[1])
+    broker._serve_batch([request])
+    assert 'error' not in connection.replies[0][2]
+    assert broker._applied['num_averages'] == 8
+
+
+def test_omitted_settings_coalesce_with_fully_specified(scope):
+    broker = ScopeBroker(scope)
+    omitted = trace_request(RecordingConnection(), channels=[1])
+    specified = trace_request(RecordingConnection(), channels=[1],
+                              **{name: str(value) for name, value in broker.defaults.items()
+                                 if name != 'num_averages'})
+    assert broker._trace_key(omitted) == broker._trace_key(specified)
+
+
+def test_aver_m_is_averaging_with_m_averages(scope):
+    broker = ScopeBroker(scope)
+    connection = RecordingConnection()
+    assert (broker._trace_key(trace_request(connection, acq_type='AVER16'))
+            == broker._trace_key(trace_request(connection, acq_type='AVERage', num_averages='16')))
+
+
+def test_failed_setting_forgets_applied_settings(scope):
+    broker = ScopeBroker(scope)
+    broker._serve_batch([trace_request(RecordingConnection(), channels=[1])])
+    assert broker._applied
+    connection = RecordingConnection({'acq_type': 'AVERage', 'num_averages': 1})
+    broker._serve_batch([trace_request(connection, channels=[1])])
+    assert 'error' in connection.replies[0][2]
+    assert broker._applied == {}
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""Tests of the trace processing in :mod:`keyoscacquire.dataprocessing`"""
+
+import numpy as np
+import pytest
+
+from keyoscacquire import dataprocessing as dp
+
+#: Preamble of a WORD trace: 1000 points at 1 ns, 10 mV per count, 0.2 V
+#: origin and reference at count 5
+PREAMBLE = "1,0,1000,1,1e-9,0,0,0.01,0.2,5"
+
+
+def to_raw(y, preamble=PREAMBLE):
+    """Raw counts of the voltages ``y`` for ``preamble``"""
+    _, _, _, _, _, _, _, yIncr, yOrig, yRef = (float(v) for v in preamble.split(','))
+    return np.round((y-yOrig)/yIncr + yRef).astype(np.int16)
+
+
+## Welch spectrum ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def test_welch_spectrum_peak_and_power():
+    dt = 1e-9
+    time = (np.arange(4096)*dt)[:, np.newaxis]
+    # 31.25 MHz is on a frequency bin of 1024-point segments
+    values = np.sin(2*np.pi*31.25e6*time)
+    spectrum = dp.WelchSpectrum(segment_length=1024, window='rect')
+    spectrum.update(time, values)
+    assert spectrum.frequency[np.argmax(spectrum.psd[:, 0])] == pytest.approx(31.25e6)
+    # Parseval: the integrated PSD is the mean square of the sine
+    df = spectrum.frequency[1]-spectrum.frequency[0]
+    assert np.sum(spectrum.psd)*df == pytest.approx(0.5, rel=1e-6)
+
+
+def test_welch_sample_interval_from_preamble_matches_time_axis():
+    time = (np.arange(1000)*1e-9)[:, np.newaxis]
+    y = 0.2 + 0.5*np.sin(2*np.pi*5e6*time)
+    from_time, from_preamble = dp.WelchSpectrum(), dp.WelchSpectrum()
+    from_time.update(time, y)
+    from_preamble.update(time, y, xIncr=1e-9)
+    np.testing.assert_allclose(from_time.frequency, from_preamble.frequency)
+    np.testing.assert_allclose(from_time.psd, from_preamble.psd)
+
+
+def test_welch_raw_matches_voltages():
+    time = (np.arange(1000)*1e-9)[:, np.newaxis]
+    raw = to_raw(0.2 + 0.5*np.sin(2*np.pi*5e6*time[:, 0]))
+    volts, counts = dp.WelchSpectrum(segment_length=256), dp.WelchSpectrum(segment_length=256)
+    volts.update(time, ((raw-5)*0.01 + 0.2)[:, np.newaxis], xIncr=1e-9)
+    counts.update_raw(raw[np.newaxis], [PREAMBLE])
+    np.testing.assert_allclose(volts.psd, counts.psd)
+
+
+def test_welch_single_point_requires_sample_interval():
+    spectrum = dp.WelchSpectrum(window='rect')
+    with pytest.raises(ValueError, match="xIncr"):
+        spectrum.update(np.zeros((1, 1)), np.ones((1, 1)))
+    spectrum.update(np.zeros((1, 1)), np.ones((1, 1)), xIncr=1e-9)
+    assert spectrum.num_traces == 1
+
+
+## Running statistics ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def test_statistics_match_numpy():
+    rng = np.random.default_rng(1)
+    traces = rng.normal(1., 0.1, size=(50, 200, 2))
+    stats = dp.TraceStatistics()
+    for values in traces:
+        assert stats.update(values)
+    assert stats.count == 50
+    np.testing.assert_allclose(stats.mean, traces.mean(axis=0))
+    np.testing.assert_allclose(stats.std, traces.std(axis=0, ddof=1))
+    np.testing.assert_array_equal(stats.min, traces.min(axis=0))
+    np.testing.assert_array_equal(stats.max, traces.max(axis=0))
+    _, summary = stats.summary()
+    assert summary.shape == (200, 8)
+    assert stats.summary_column_names([1, 3])[:3] == ['mean 1', 'mean 3', 'std 1']
+
+
+def test_statistics_of_one_trace():
+    stats = dp.TraceStatistics()
+    stats.update(np.ones((10, 1)), time=np.arange(10))
+    np.testing.assert_array_equal(stats.std, np.zeros((10, 1)))
+    np.testing.assert_array_equal(stats.time, np.arange(10))
+
+
+def test_statistics_reject_outliers():
+    rng = np.random.default_rng(2)
+    traces = rng.normal(0., 0.1, size=(30, 100, 1))
+    stats = dp.TraceStatistics(outlier_sigma=3, min_count=10)
+    for values in traces:
+        assert stats.update(values)
+    assert not stats.update(traces[0] + 5.)
+    assert stats.rejected == 1
+    assert stats.count == 30
+    # The rejected trace does not affect the statistics
+    np.testing.assert_allclose(stats.mean, traces.mean(axis=0))
+    np.testing.assert_array_equal(stats.max, traces.max(axis=0))
+
+
+def test_statistics_keep_outliers_before_min_count():
+    stats = dp.TraceStatistics(outlier_sigma=3, min_count=10)
+    stats.update(np.zeros((10, 1)))
+    stats.update(np.full((10, 1), 0.1))
+    assert stats.update(np.full((10, 1), 100.))
+    assert stats.rejected == 0
+
+
+def test_statistics_reject_other_shape():
+    stats = dp.TraceStatistics()
+    stats.update(np.zeros((10, 1)))
+    with pytest.raises(ValueError):
+        stats.update(np.zeros((10, 2)))
+
+
+## Persistence histograms ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def test_histogram_raw_equals_volts():
+    rng = np.random.default_rng(3)
+    preambles = [PREAMBLE, PREAMBLE]
+    # Bins of one count centred on the raw voltages
+    volts = dp.PersistenceHistogram((-1.005, 1.005), voltage_bins=201, time_bins=100)
+    raw = dp.PersistenceHistogram((-1.005, 1.005), voltage_bins=201, time_bins=100)
+    for _ in range(5):
+        counts = to_raw(rng.uniform(-1.5, 1.5, size=(1000, 2))).T
+        volts.update(*dp._process_data_binary(counts, preambles, verbose_acquistion=False))
+        raw.update_raw(counts, preambles)
+    assert raw.num_traces == volts.num_traces == 5
+    np.testing.assert_array_equal(raw.counts, volts.counts)
+
+
+def test_histogram_counts_points_in_range():
+    time = np.arange(1000)*1e-9
+    values = np.linspace(-2, 2, 1000)
+    hist = dp.PersistenceHistogram((-1, 1), voltage_bins=10, time_bins=50)
+    hist.update(time, values)
+    hist.update(time, values)
+    assert hist.counts.shape == (1, 50, 10)
+    assert hist.counts.sum() == 2*np.count_nonzero(np.abs(values) < 1)
+    # A rising ramp fills the diagonal of the time-voltage plane
+    assert hist.counts[0, 0].sum() == hist.counts[0, -1].sum() == 0
+    assert hist.counts[0, 25, 5] == 2*20
+
+
+def test_histogram_folds_on_period():
+    time = np.arange(1000)*1e-9
+    hist = dp.PersistenceHistogram((0, 1), voltage_bins=2, time_bins=10, period=100e-9)
+    hist.update(time, (np.arange(1000) % 100 >= 50)*0.75)
+    assert hist.time_range == (0., 100e-9)
+    np.testing.assert_array_equal(hist.counts[0, :5], [[100, 0]]*5)
+    np.testing.assert_array_equal(hist.counts[0, 5:], [[0, 100]]*5)
+
+
+def test_histogram_rejects_other_number_of_channels():
+    hist = dp.PersistenceHistogram((-1, 1))
+    hist.update(np.arange(10), np.zeros((10, 2)))
+    with pytest.raises(ValueError):
+        hist.update(np.arange(20), np.zeros((20, 1)))
+
+
+## Waveform measurements ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def trapezoid(num_points=1000, period=100, high=30, edge=10):
+    """Pulse train from 0 to 1 with linear edges of ``edge`` points, high
+    (between the middle of the edges) for ``high`` points of each ``period``"""
+    # Half a point offset so that no point is on the middle threshold
+    phase = (np.arange(num_points) + edge//2) % period - edge/2 + 0.5
+    rise = np.clip((phase+edge/2)/edge, 0, 1)
+    fall = np.clip((high+edge/2-phase)/edge, 0, 1)
+    return np.minimum(rise, fall)
+
+
+def test_measure_pulse_train():
+    time = np.arange(1000)*1e-9
+    m = dp.measure_traces(time, trapezoid()[:, np.newaxis])
+    assert m.shape == (1, 1)
+    m = m[0, 0]
+    assert m['vmax'] == m['vpp'] == 1 and m['vmin'] == 0
+    # Top and base are bin centres of a histogram of the voltages
+    assert m['vtop'] == pytest.approx(1, abs=1/255)
+    assert m['vbase'] == pytest.approx(0, abs=1/255)
+    assert m['period'] == pytest.approx(100e-9)
+    assert m['frequency'] == pytest.approx(10e6)
+    assert m['duty_cycle'] == pytest.approx(30, abs=1)
+    assert m['rise_time'] == pytest.approx(8e-9, rel=1e-2)
+    assert m['fall_time'] == pytest.approx(8e-9, rel=1e-2)
+    assert m['overshoot'] == pytest.approx(0, abs=0.5)
+
+
+def test_measure_sine():
+    time = np.arange(10000)*1e-9
+    # Ten whole periods
+    y = np.sin(2*np.pi*1e6*time)
+    m = dp.measure_traces(time, y[:, np.newaxis])[0, 0]
+    assert m['frequency'] == pytest.approx(1e6)
+    assert m['vpp'] == pytest.approx(2, rel=1e-3)
+    assert m['vrms'] == pytest.approx(1/np.sqrt(2), rel=1e-3)
+    assert m['duty_cycle'] == pytest.approx(50, abs=0.5)
+
+
+def test_measure_batch_of_traces():
+    time = np.arange(1000)*1e-9
+    values = np.stack([np.stack([trapezoid(period=p, high=p//2), np.full(1000, 0.5)], axis=1)
+                       for p in (50, 100, 200)])
+    m = dp.measure_traces(time, values)
+    assert m.shape == (3, 2)
+    np.testing.assert_allclose(m['period'][:, 0], [50e-9, 100e-9, 200e-9])
+    np.testing.assert_allclose(m['duty_cycle'][:, 0], 50, atol=1)
+    # A constant has no edges
+    assert np.isnan(m['period'][:, 1]).all()
+    assert np.isnan(m['rise_time'][:, 1]).all()
+    np.testing.assert_array_equal(m['vrms'][:, 1], 0.5)
+
+
+def test_measure_as_dataframe():
+    time = np.arange(1000)*1e-9
+    values = np.stack([trapezoid(), trapezoid(period=50)], axis=1)
+    df = dp.measure_traces(time, values, channels=[1, 3], return_as_df=True)
+    assert list(df.columns) == ['trace', 'channel', *dp.MEASUREMENTS]
+    assert list(df['channel']) == [1, 3]
+    np.testing.assert_allclose(df['period'], [100e-9, 50e-9])
+
+
+## Event filtering ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+#: Time axis of :data:`PREAMBLE`
+TIME = np.arange(1000)*1e-9
+
+
+def events_trace():
+    """A 10 ns pulse at 100 ns, a 60 ns pulse at 500 ns and a dip below
+    -1 V from 800 ns"""
+    y = np.zeros(1000)
+    y[100:110] = 1
+    y[500:560] = 1
+    y[800:] = -2
+    return y
+
+
+@pytest.mark.parametrize("predicate, event", [
+    (dp.ThresholdCrossing(1, 0.5), 100),
+    (dp.ThresholdCrossing(1, 0.5, slope='falling'), 110),
+    (dp.ThresholdCrossing(1, -1, slope='falling'), 800),
+    (dp.ThresholdCrossing(1, 0.5, slope='either'), 100),
+    (dp.ThresholdCrossing(1, 1.5), -1),
+    (dp.PulseWidth(1, 0.5), 100),
+    (dp.PulseWidth(1, 0.5, min_width=20e-9), 500),
+    (dp.PulseWidth(1, 0.5, max_width=20e-9), 100),
+    (dp.PulseWidth(1, 0.5, min_width=100e-9), -1),
+    # The pulses below the level before 100 ns and from 800 ns are not complete
+    (dp.PulseWidth(1, 0.5, positive=False), 110),
+    (dp.AmplitudeLimit(1, low=-1), 800),
+    (dp.AmplitudeLimit(1, high=0.5), 100),
+    (dp.AmplitudeLimit(1, low=-3, high=3), -1),
+])
+def test_predicate_first_event(predicate, event):
+    assert predicate.first_event(TIME, events_trace()) == event
+
+
+def test_predicate_channel_names():
+    assert dp.ThresholdCrossing('2', 0).channel == 2
+    assert dp.ThresholdCrossing('pod1', 0).channel == 'POD1'
+    with pytest.raises(ValueError):
+        dp.ThresholdCrossing(1, 0, slope='up')
+
+
+@pytest.mark.parametrize("predicates", [
+    [dp.ThresholdCrossing(3, 0.5)],
+    [dp.PulseWidth(3, 0.5, min_width=20e-9)],
+    [dp.AmplitudeLimit(3, low=-1)],
+    [dp.ThresholdCrossing(1, 5), dp.PulseWidth(3, 0.5, max_width=20e-9)],
+])
+def test_filter_raw_equals_volts(predicates):
+    # Noise so that the levels are crossed by the scaled raw values as well
+    rng = np.random.default_rng(4)
+    y = np.stack([np.zeros(1000), events_trace()], axis=1) + rng.normal(0, 0.05, (1000, 2))
+    raw = to_raw(y).T
+    time, volts = dp._process_data_binary(raw, [PREAMBLE]*2, verbose_acquistion=False)
+    trace_filter = dp.TraceFilter(predicates)
+    event = trace_filter.match(time, volts, [1, 3])
+    assert event is not None
+    assert trace_filter.match_raw(raw, [PREAMBLE]*2, [1, 3]) == event
+
+
+def test_filter_modes():
+    values = events_trace()[:, np.newaxis]
+    predicates = [dp.PulseWidth(1, 0.5, min_width=20e-9), dp.AmplitudeLimit(1, high=5)]
+    assert dp.TraceFilter(predicates, mode='any').match(TIME, values, [1]) == 500
+    assert dp.TraceFilter(predicates, mode='all').match(TIME, values, [1]) is None
+    predicates.append(dp.ThresholdCrossing(1, -1, slope='falling'))
+    # The earliest of the events
+    assert dp.TraceFilter(predicates[::2], mode='all').match(TIME, values, [1]) == 500
+    with pytest.raises(ValueError):
+        dp.TraceFilter(predicates, mode='most')
+
+
+def test_filter_counts_traces():
+    trace_filter = dp.TraceFilter([dp.ThresholdCrossing(1, 0.5)])
+    assert trace_filter.match(TIME, events_trace()[:, np.newaxis], [1]) == 100
+    assert trace_filter.match(TIME, np.zeros((1000, 1)), [1]) is None
+    assert (trace_filter.num_examined, trace_filter.num_matched) == (2, 1)
+
+
+def test_filter_unknown_channel():
+    trace_filter = dp.TraceFilter([dp.ThresholdCrossing(2, 0.5)])
+    with pytest.raises(ValueError, match="not among the captured channels"):
+        trace_filter.match(TIME, np.zeros((1000, 1)), [1])
+
+
+def test_filter_cut():
+    time = TIME[:, np.newaxis]
+    values = np.stack([events_trace(), np.arange(1000)], axis=1)
+    # Edges between points, not subject to rounding
+    trace_filter = dp.TraceFilter([], window=(10.5e-9, 20.5e-9))
+    cut_time, cut_values = trace_filter.cut(time, values, 500)
+    np.testing.assert_array_equal(cut_values[:, 1], np.arange(490, 521))
+    assert cut_time.shape == (31, 1)
+    # The window is limited by the record
+    _, cut_values = trace_filter.cut(time, values, 5)
+    np.testing.assert_array_equal(cut_values[:, 1], np.arange(0, 26))
+    trace_filter.window = None
+    assert trace_filter.cut(time, values, 500)[1] is values
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Tests of :class:`keyoscacquire.oscilloscope.Oscilloscope` with a simulated instrument"""
+
+import numpy as np
+import pytest
+
+
+def count(log, command):
+    return sum(entry.upper().startswith(command.upper()) for entry in log)
+
+
+## Read cache ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def test_capture_without_running_adds_no_trigger_event_query(scope):
+    scope._inst.log.clear()
+    scope.get_trace(channels=[1], set_running=False)
+    assert count(scope._inst.log, ':TER?') == 0
+
+
+def test_repeated_stopped_read_is_served_from_cache(scope):
+    _, first, _ = scope.get_trace(channels=[1], set_running=False)
+    scope._inst.log.clear()
+    _, second, _ = scope.get_trace(channels=[1], set_running=False)
+    assert count(scope._inst.log, ':WAVeform:DATA?') == 0
+    assert count(scope._inst.log, ':TER?') == 1
+    np.testing.assert_array_equal(first, second)
+
+
+def test_trigger_after_read_invalidates_cache(scope):
+    scope.get_trace(channels=[1], set_running=False)
+    scope.get_trace(channels=[1], set_running=False)
+    # An acquisition triggered by someone else while stopped
+    scope._inst.trigger_event = True
+    scope._inst.log.clear()
+    scope.get_trace(channels=[1], set_running=False)
+    assert count(scope._inst.log, ':WAVeform:DATA?') == 1
+
+
+def test_running_clears_cache(scope):
+    scope.get_trace(channels=[1], set_running=False)
+    scope.get_trace(channels=[1])
+    assert not scope._read_cache_data
+
+
+## Segmented acquisition ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def test_segmented_traces(scope):
+    time, values, time_tags = scope.get_segmented_traces(4, channels=[1, 3])
+    assert values.shape == (4, scope._inst.num_points, 2)
+    np.testing.assert_allclose(time_tags, [0, 1e-3, 2e-3, 3e-3])
+    assert scope._inst.acq_mode == 'RTIM'
+    assert scope._inst.running
+    assert scope._values is values
+
+
+def test_segmented_mode_is_restored_on_failure(scope, monkeypatch):
+    def timeout(*args, **kwargs):
+        raise TimeoutError("simulated")
+    monkeypatch.setattr(scope._inst, 'query_binary_values', timeout)
+    with pytest.raises(TimeoutError):
+        scope.get_segmented_traces(4, channels=[1])
+    assert scope._inst.acq_mode == 'RTIM'
+    assert scope._inst.running
+
+
+def test_save_segmented_traces(scope, tmp_path):
+    scope.get_segmented_traces(4, channels=[1, 3])
+    scope.save_trace(str(tmp_path/"segments"), ext='.csv', savepng=False, showplot=False)
+    header = (tmp_path/"segments.csv").read_text().splitlines()
+    assert "# time,1_seg1,3_seg1,1_seg2,3_seg2,1_seg3,3_seg3,1_seg4,3_seg4" in header
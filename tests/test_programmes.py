@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Tests of the programmes in :mod:`keyoscacquire.programmes` with a
+simulated instrument"""
+
+import os
+
+import numpy as np
+import pytest
+
+import keyoscacquire.oscilloscope as oscilloscope
+import keyoscacquire.programmes as programmes
+import keyoscacquire.dataprocessing as dp
+
+
+@pytest.fixture
+def workdir(fake_visa, monkeypatch, tmp_path):
+    """Run in a temporary directory without saving pngs"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(oscilloscope.Oscilloscope, 'savepng', False)
+    return tmp_path
+
+
+## Filtered traces ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+@pytest.mark.parametrize("wav_format", ['WORD', 'BYTE', 'ASCii'])
+def test_filtered_trace_event(scope, wav_format):
+    scope.set_acquiring_options(wav_format=wav_format)
+    trace_filter = dp.TraceFilter([dp.ThresholdCrossing(1, 0.5)])
+    # The ramp of channel 1 reaches 0.5 V at the 50th point
+    assert programmes._get_filtered_trace(scope, trace_filter) == 49
+    assert scope._values.shape == (1000, 2)
+
+
+def test_filtered_trace_without_event_is_not_processed(scope):
+    scope._time = scope._values = None
+    trace_filter = dp.TraceFilter([dp.AmplitudeLimit(3, high=5)])
+    assert programmes._get_filtered_trace(scope, trace_filter) is None
+    assert scope._values is None
+
+
+def test_num_traces_keeps_window_around_events(workdir, capsys):
+    trace_filter = dp.TraceFilter([dp.ThresholdCrossing(1, 0.5)], window=(1.5e-6, 2.5e-6))
+    programmes.get_num_traces(fname="data", num=3, channels=[1, 3], trace_filter=trace_filter)
+    assert sorted(os.listdir(workdir)) == ["data n0.csv", "data n1.csv", "data n2.csv"]
+    assert "Kept 3 of 3 traces with events" in capsys.readouterr().out
+    trace = np.loadtxt(workdir/"data n1.csv", delimiter=',', comments='#')
+    # The points 48 to 51 around the event at point 49
+    np.testing.assert_allclose(trace[:, 1], [0.49, 0.50, 0.51, 0.52])
+
+
+def test_num_traces_skips_traces_without_events(workdir, capsys):
+    trace_filter = dp.TraceFilter([dp.AmplitudeLimit(1, high=5)])
+    programmes.get_num_traces(fname="data", num=3, trace_filter=trace_filter)
+    assert os.listdir(workdir) == []
+    assert "Kept 0 of 3 traces with events" in capsys.readouterr().out
+
+
+## Periodic traces ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+class FakeClock:
+    """Replaces the :mod:`time` module of the programmes: time only passes
+    when sleeping or capturing, each capture taking the next of ``durations``"""
+
+    def __init__(self, durations):
+        self.now = 0.
+        self.durations = list(durations)
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1e9 + self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def capture(self):
+        self.now += self.durations.pop(0)
+
+
+@pytest.fixture
+def clock(workdir, monkeypatch):
+    clock = FakeClock([])
+    monkeypatch.setattr(programmes, 'time', clock)
+    get_trace = oscilloscope.Oscilloscope.get_trace
+    def slow_get_trace(scope, *args, **kwargs):
+        clock.capture()
+        return get_trace(scope, *args, **kwargs)
+    monkeypatch.setattr(oscilloscope.Oscilloscope, 'get_trace', slow_get_trace)
+    return clock
+
+
+def schedule(workdir):
+    """Rows of trace, slot and lateness of the schedule log"""
+    log = np.loadtxt(workdir/"data_schedule.csv", delimiter=',', comments='#', ndmin=2)
+    return log[:, [0, 1, 3]]
+
+
+def test_periodic_traces_on_schedule(clock, workdir, capsys):
+    clock.durations = [0.1]*3
+    programmes.get_periodic_traces(fname="data", interval=1., num=3)
+    assert clock.sleeps == pytest.approx([0.9, 0.9])
+    np.testing.assert_allclose(schedule(workdir), [[0, 0, 0], [1, 1, 0], [2, 2, 0]])
+    assert os.path.exists(workdir/"data n2.csv")
+    out = capsys.readouterr().out
+    assert "Captured 3 traces, 0 slots missed" in out
+    assert "Achieved rate 1 traces/s" in out
+
+
+def test_periodic_traces_skip_missed_slots(clock, workdir, capsys):
+    # The second capture overruns until 3.5 s: the slot at 2 s is skipped,
+    # and the slot at 3 s, less than one interval late, is captured
+    clock.durations = [0.1, 2.5, 0.1, 0.1]
+    programmes.get_periodic_traces(fname="data", interval=1., num=4)
+    np.testing.assert_allclose(schedule(workdir), [[0, 0, 0], [1, 1, 0], [2, 3, 0.5], [3, 4, 0]])
+    out = capsys.readouterr().out
+    assert "Captured 4 traces, 1 slots missed" in out
+    assert "Achieved rate 0.75 traces/s" in out
+    assert "500 ms maximum lateness" in out
+
+
+def test_schedule_report(capsys):
+    programmes._print_schedule_report(0.5, [10., 10.5, 11.1], [0., 0., 0.1], 2)
+    out = capsys.readouterr().out
+    assert "Captured 3 traces, 2 slots missed" in out
+    assert "Achieved rate 1.818 traces/s (scheduled 2 traces/s)" in out
+    assert "Start jitter 47.1 ms rms, 100 ms maximum lateness" in out
+    programmes._print_schedule_report(1., [], [], 0)
+    assert capsys.readouterr().out == "Captured 0 traces, 0 slots missed\n"
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Tests of :class:`keyoscacquire.visa_utils.SocketResource` against a
+loopback stand-in for the SCPI socket server of an oscilloscope"""
+
+import socket
+import threading
+
+import numpy as np
+import pyvisa
+import pytest
+
+from keyoscacquire import visa_utils
+
+DATA = (np.arange(100_000) % 1000 - 500).astype('<i2')
+
+
+def block(data, num_digits=None):
+    """IEEE 488.2 definite length block with the termination"""
+    length = str(len(data))
+    if num_digits is not None:
+        length = length.zfill(num_digits)
+    return b"#" + str(len(length)).encode() + length.encode() + data + b"\n"
+
+
+def serve(server, replies):
+    """Answer each query of one client with the reply for its command"""
+    conn, _ = server.accept()
+    with conn, conn.makefile('rb') as commands:
+        for line in commands:
+            command = line.decode('ascii').strip()
+            if command in replies:
+                conn.sendall(replies[command])
+
+
+@pytest.fixture
+def inst():
+    replies = {'*IDN?': b"KEYSIGHT TECHNOLOGIES,LOOPBACK,MY00000000,00.00\n",
+               ':WAVeform:DATA?': block(DATA.tobytes()),
+               'PADDED?': block(DATA[:10].tobytes(), num_digits=9),
+               'EMPTY?': block(b""),
+               'ASCII?': b"1,2,3\n"}
+    server = socket.create_server(('127.0.0.1', 0))
+    server_thread = threading.Thread(target=serve, args=(server, replies), daemon=True)
+    server_thread.start()
+    inst = visa_utils.SocketResource(*server.getsockname(), timeout=5000)
+    yield inst
+    inst.close()
+    # Let the server accept and finish the connection before closing it
+    server_thread.join(timeout=5)
+    server.close()
+
+
+def test_query(inst):
+    assert inst.query('*IDN?').startswith("KEYSIGHT TECHNOLOGIES,LOOPBACK")
+
+
+def test_receive_buffer_is_set(inst):
+    assert inst._sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) > 0
+
+
+def test_binary_block_into_new_array(inst):
+    values = inst.query_binary_values(':WAVeform:DATA?', datatype='h')
+    np.testing.assert_array_equal(values, DATA)
+    assert inst.query('*IDN?').startswith("KEYSIGHT")
+
+
+def test_binary_block_into_preallocated_array(inst):
+    out = np.empty(len(DATA)+10, dtype=np.int16)
+    inst.write(':WAVeform:DATA?')
+    values = inst.read_binary_block(dtype=np.int16, out=out)
+    assert len(values) == len(DATA)
+    assert np.shares_memory(values, out)
+    np.testing.assert_array_equal(values, DATA)
+    assert inst.query('*IDN?').startswith("KEYSIGHT")
+
+
+def test_block_header_with_leading_zeros(inst):
+    np.testing.assert_array_equal(inst.query_binary_values('PADDED?', datatype='h'), DATA[:10])
+
+
+def test_empty_block(inst):
+    assert inst.query_binary_values('EMPTY?', datatype='h').size == 0
+    assert inst.query('*IDN?').startswith("KEYSIGHT")
+
+
+def test_reply_that_is_not_a_block(inst):
+    with pytest.raises(pyvisa.errors.InvalidBinaryFormat):
+        inst.query_binary_values('ASCII?')
+    inst.clear()
+    assert inst.query('*IDN?').startswith("KEYSIGHT")
+
+
+def test_block_too_long_for_array_is_discarded(inst):
+    inst.write(':WAVeform:DATA?')
+    with pytest.raises(ValueError, match="does not fit"):
+        inst.read_binary_block(dtype=np.int16, out=np.empty(10, dtype=np.int16))
+    # The rest of the block does not end up in the next reply
+    assert inst.query('*IDN?').startswith("KEYSIGHT")
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Tests of the ordering and checkpointing of :class:`keyoscacquire.sweep.ParameterSweep`"""
+
+import itertools
+
+import pytest
+
+from keyoscacquire.sweep import ParameterSweep, load_sweep, _gray_order
+
+
+GRID = {'channels': [[1], [1, 3]], 'acq_type': ['NORMal', 'HRESolution', 'AVER4']}
+
+
+## Ordering ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+def test_gray_order():
+    assert list(_gray_order([['a', 'b'], [1, 2, 3]])) == [
+        ('a', 1), ('a', 2), ('a', 3), ('b', 3), ('b', 2), ('b', 1)]
+    assert list(_gray_order([])) == [()]
+
+
+@pytest.mark.parametrize("sizes", [(2,), (2, 3), (3, 2, 4), (3, 3, 3)])
+def test_gray_order_changes_one_value(sizes):
+    value_lists = [list(range(size)) for size in sizes]
+    points = list(_gray_order(value_lists))
+    assert sorted(points) == list(itertools.product(*value_lists))
+    for previous, point in zip(points, points[1:]):
+        assert sum(a != b for a, b in zip(previous, point)) == 1
+    # The first value changes only size-1 times
+    assert sum(a[0] != b[0] for a, b in zip(points, points[1:])) == sizes[0]-1
+
+
+def test_points_change_expensive_settings_rarely(scope):
+    sweep = ParameterSweep(scope, GRID)
+    assert [point['channels'] for point in sweep.points] == [[1]]*3 + [[1, 3]]*3
+    assert [point['acq_type'][:4] for point in sweep.points] == [
+        'NORM', 'HRES', 'AVER', 'AVER', 'HRES', 'NORM']
+    unordered = ParameterSweep(scope, GRID, reorder=False)
+    assert unordered.points[:2] == [{'channels': [1], 'acq_type': 'NORMal'},
+                                    {'channels': [1], 'acq_type': 'HRESolution'}]
+
+
+def test_unknown_setting(scope):
+    with pytest.raises(ValueError, match="Cannot sweep"):
+        ParameterSweep(scope, {'timebase': [1e-3]})
+
+
+## Checkpointing ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ ##
+
+@pytest.fixture
+def interrupt_at(scope, monkeypatch):
+    """Interrupt the sweep at the capture of a point, and record the captured points"""
+    captured = []
+    set_options_get_trace = scope.set_options_get_trace
+    def interrupting(**kwargs):
+        if len(captured) == interrupt_at.index:
+            raise KeyboardInterrupt
+        captured.append(kwargs)
+        return set_options_get_trace(**kwargs)
+    interrupt_at.index = None
+    interrupt_at.captured = captured
+    monkeypatch.setattr(scope, 'set_options_get_trace', interrupting)
+    return interrupt_at
+
+
+def test_sweep_resumes_after_interrupt(scope, interrupt_at, tmp_path, capsys):
+    fname = str(tmp_path/"sweep")
+    interrupt_at.index = 2
+    assert ParameterSweep(scope, GRID, num=2, fname=fname).run() is None
+    assert "interrupted after 2 of 6 points" in capsys.readouterr().out
+    interrupt_at.index = None
+    interrupt_at.captured.clear()
+    sweep = ParameterSweep(scope, GRID, num=2, fname=fname)
+    assert sweep.run() == fname+".npz"
+    assert "Resuming the sweep after 2 of 6 points" in capsys.readouterr().out
+    # Continues at the third point in Gray code order, and only writes the
+    # settings that change from then on
+    assert interrupt_at.captured == [{'channels': [1], 'acq_type': 'AVER4'},
+                                     {'channels': [1, 3]},
+                                     {'channels': [1, 3], 'acq_type': 'HRESolution'},
+                                     {'channels': [1, 3], 'acq_type': 'NORMal'}]
+    points = load_sweep(fname)
+    assert [point['index'] for point in points] == list(range(6))
+    assert [point['settings'] for point in points] == sweep.points
+    assert points[2]['reconfigured'] == ['acq_type']
+    assert points[5]['values'].shape == (2, 1000, 2)
+    assert not (tmp_path/"sweep_partial").exists()
+
+
+def test_sweep_does_not_resume_another_sweep(scope, interrupt_at, tmp_path):
+    fname = str(tmp_path/"sweep")
+    interrupt_at.index = 1
+    ParameterSweep(scope, GRID, fname=fname).run()
+    interrupt_at.index = None
+    with pytest.raises(ValueError, match="another sweep"):
+        ParameterSweep(scope, GRID, num=2, fname=fname).run()
+    # Starting over discards the checkpoint
+    ParameterSweep(scope, GRID, num=2, fname=fname).run(resume=False)
+    assert len(load_sweep(fname)) == 6
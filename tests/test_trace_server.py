@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Tests of the trace payloads of :mod:`keyoscacquire.trace_server`"""
+
+import pytest
+
+from keyoscacquire import trace_server
+
+
+def test_payload_of_binary_capture(scope):
+    scope.set_channels_for_capture(channels=[1, 3])
+    scope.capture_and_read()
+    data, metadata = trace_server.trace_payload(scope)
+    assert data.shape == (2, scope._inst.num_points)
+    assert metadata['channels'] == [1, 3]
+    assert len(metadata['preambles']) == 2
+    frame = trace_server.encode_frame(1, 0., data, metadata)
+    assert frame[2].nbytes == data.nbytes
+
+
+def test_payload_without_analogue_channels_is_rejected(scope):
+    scope._capture_channels, scope._sources, scope._capture_pods = [], [], ['POD1']
+    scope._raw, scope._metadata = [], []
+    with pytest.raises(ValueError, match="digital pods"):
+        trace_server.trace_payload(scope)